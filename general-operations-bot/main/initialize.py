@@ -1,6 +1,6 @@
 from agent import AgentConfig
 import models
-from python.helpers import runtime, settings, defer
+from python.helpers import runtime, settings, defer, tokens
 from python.helpers.print_style import PrintStyle
 
 
@@ -25,6 +25,9 @@ def initialize_agent():
                 result[key] = value
         return result
 
+    # token counting mode for history limits
+    tokens.set_estimation(current_settings["chat_model_token_estimate"])
+
     # chat model from user settings
     chat_llm = models.ModelConfig(
         type=models.ModelType.CHAT,
@@ -114,21 +114,23 @@ class RecallMemories(Extension):
         # get memory database
         db = await Memory.get(self.agent)
 
-        # search for general memories and fragments
-        memories = await db.search_similarity_threshold(
-            query=query,
-            limit=set["memory_recall_memories_max_search"],
+        # search for general memories and fragments, and for solutions, in one pass
+        results = await db.search_hybrid_multi(
+            queries=[query],
+            groups={
+                "memories": (
+                    f"area == '{Memory.Area.MAIN.value}' or area == '{Memory.Area.FRAGMENTS.value}'",  # exclude solutions
+                    set["memory_recall_memories_max_search"],
+                ),
+                "solutions": (
+                    f"area == '{Memory.Area.SOLUTIONS.value}'",
+                    set["memory_recall_solutions_max_search"],
+                ),
+            },
             threshold=set["memory_recall_similarity_threshold"],
-            filter=f"area == '{Memory.Area.MAIN.value}' or area == '{Memory.Area.FRAGMENTS.value}'",  # exclude solutions
-        )
-
-        # search for solutions
-        solutions = await db.search_similarity_threshold(
-            query=query,
-            limit=set["memory_recall_solutions_max_search"],
-            threshold=set["memory_recall_similarity_threshold"],
-            filter=f"area == '{Memory.Area.SOLUTIONS.value}'",  # exclude solutions
         )
+        memories = results["memories"][0]
+        solutions = results["solutions"][0]
 
         if not memories and not solutions:
             log_item.update(
@@ -0,0 +1,64 @@
+from typing import Sequence
+
+import numpy as np
+
+
+def mmr_order(
+    relevance: Sequence[float],
+    vectors: np.ndarray,
+    lambda_mult: float,
+    duplicate_similarity: float,
+) -> list[int]:
+    """
+    Order candidates by maximal marginal relevance: each step picks the candidate that is most
+    relevant and least similar to those picked before. Candidates whose cosine similarity to a
+    picked one reaches duplicate_similarity are left out as near duplicates.
+    """
+    count = len(relevance)
+    if not count:
+        return []
+    scores = np.asarray(relevance, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    unit = vectors / np.where(norms > 0, norms, 1)
+
+    order: list[int] = []
+    max_similarity = np.zeros(count, dtype=np.float32)
+    remaining = np.ones(count, dtype=bool)
+    while remaining.any():
+        marginal = lambda_mult * scores - (1 - lambda_mult) * max_similarity
+        marginal[~remaining] = -np.inf
+        best = int(np.argmax(marginal))
+        remaining[best] = False
+        if order and max_similarity[best] >= duplicate_similarity:
+            continue
+        order.append(best)
+        max_similarity = np.maximum(max_similarity, unit @ unit[best])
+    return order
+
+
+def pack(order: Sequence[int], sizes: Sequence[int], budget: int) -> list[int]:
+    """Candidates in the given order that fit the budget, larger ones are skipped for smaller ones that still fit."""
+    packed = []
+    used = 0
+    for i in order:
+        if used + sizes[i] <= budget:
+            packed.append(i)
+            used += sizes[i]
+    return packed
+
+
+def group(
+    order: Sequence[int], sizes: Sequence[int], budget: int, max_groups: int
+) -> list[list[int]]:
+    """Consecutive groups of candidates that each fit the budget, at most max_groups of them."""
+    groups: list[list[int]] = []
+    used = budget
+    for i in order:
+        if used + sizes[i] > budget:
+            if len(groups) == max_groups:
+                break
+            groups.append([])
+            used = 0
+        groups[-1].append(i)
+        used += sizes[i]
+    return groups
@@ -0,0 +1,392 @@
+import asyncio
+import mimetypes
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+import weakref
+from email.utils import parsedate_to_datetime
+from typing import Mapping, TypedDict
+from urllib.parse import urlparse
+
+import aiohttp
+import xxhash
+
+from python.helpers import files
+from python.helpers.print_style import PrintStyle
+
+CACHE_FOLDER = "tmp/document_cache"
+INDEX_FILE = "cache.sqlite"
+NO_STORE_FOLDER = "no-store"  # bodies of responses that must not be cached, removed after parsing
+MAX_DOCUMENT_MB = 50
+DEFAULT_MAX_AGE = 300  # seconds a response without caching headers is fresh
+HEURISTIC_MAX_AGE = 86400  # cap of the freshness derived from Last-Modified
+FETCH_RETRIES = 3
+RETRY_STATUSES = (429,)  # besides 5xx, other error responses are final
+FETCH_TIMEOUT = 60
+EVICTION_TARGET = 0.9  # evict down to this fraction of the size limit
+
+# one connection pool per event loop, agents run their own loops in separate threads
+_sessions: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, aiohttp.ClientSession]" = (
+    weakref.WeakKeyDictionary()
+)
+
+
+class FetchedDocument(TypedDict):
+    uri: str
+    path: str  # local copy of the response body
+    content_type: str
+    checksum: str  # hash of the response body
+    text: str | None  # extracted text stored with store_text()
+    temporary: bool  # no-store body, removed with release() after parsing
+
+
+def get_session() -> aiohttp.ClientSession:
+    """Shared client session of the running event loop."""
+    loop = asyncio.get_running_loop()
+    session = _sessions.get(loop)
+    if session is None or session.closed:
+        session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=32, limit_per_host=8, ttl_dns_cache=300)
+        )
+        _sessions[loop] = session
+    return session
+
+
+class _RetryableResponse(Exception):
+    pass
+
+
+class DocumentCache:
+    """
+    On-disk cache of web documents for the document query tool.
+    Response bodies and their extracted texts are stored as files, freshness follows
+    Cache-Control, Expires and Last-Modified, stale entries are revalidated with ETag and Last-Modified.
+    Least recently used entries are evicted above the size limit.
+    """
+
+    _instance: "DocumentCache | None" = None
+    _instance_lock = threading.Lock()
+
+    @staticmethod
+    def get(max_bytes: int) -> "DocumentCache":
+        with DocumentCache._instance_lock:
+            if not DocumentCache._instance:
+                DocumentCache._instance = DocumentCache(files.get_abs_path(CACHE_FOLDER), max_bytes)
+            DocumentCache._instance.max_bytes = max_bytes
+        return DocumentCache._instance
+
+    def __init__(self, folder: str, max_bytes: int = 0):
+        self.folder = folder
+        self.max_bytes = max_bytes  # 0 = unlimited
+        os.makedirs(folder, exist_ok=True)
+        # no-store bodies left over by an interrupted parse
+        shutil.rmtree(os.path.join(folder, NO_STORE_FOLDER), ignore_errors=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(
+            os.path.join(folder, INDEX_FILE), check_same_thread=False, isolation_level=None
+        )
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            """CREATE TABLE IF NOT EXISTS documents (
+                key TEXT PRIMARY KEY,
+                file TEXT NOT NULL,
+                content_type TEXT NOT NULL,
+                checksum TEXT NOT NULL,
+                etag TEXT,
+                last_modified TEXT,
+                expires REAL NOT NULL,
+                size INTEGER NOT NULL,
+                text_size INTEGER,
+                accessed REAL NOT NULL
+            )"""
+        )
+
+    async def fetch(self, uri: str, key: str | None = None) -> FetchedDocument:
+        """
+        Body of a web document, from the cache while it is fresh, revalidated or downloaded otherwise.
+
+        Args:
+            uri: The http(s) URL to fetch
+            key: Cache key, the normalized URI, defaults to the URL
+        """
+        key = key or uri
+        entry = self._entry(key)
+        now = time.time()
+        if entry and entry["expires"] > now:
+            self._touch(key)
+            return self._document(uri, entry)
+
+        headers = {}
+        if entry:
+            if entry["etag"]:
+                headers["If-None-Match"] = entry["etag"]
+            if entry["last_modified"]:
+                headers["If-Modified-Since"] = entry["last_modified"]
+
+        session = get_session()
+        last_error = ""
+        for _ in range(FETCH_RETRIES):
+            try:
+                async with session.get(
+                    uri,
+                    headers=headers,
+                    timeout=aiohttp.ClientTimeout(total=FETCH_TIMEOUT),
+                    allow_redirects=True,
+                ) as response:
+                    if response.status == 304 and entry:
+                        return self._revalidated(uri, key, entry, response.headers, now)
+                    if response.status >= 500 or response.status in RETRY_STATUSES:
+                        raise _RetryableResponse(f"HTTP {response.status}")
+                    if response.status > 399:
+                        raise ValueError(f"Document fetch error: {uri} (HTTP {response.status})")
+                    if (response.content_length or 0) > MAX_DOCUMENT_MB * 1024 * 1024:
+                        raise ValueError(
+                            f"Document content length exceeds max. {MAX_DOCUMENT_MB}MB: "
+                            f"{response.content_length / 1024 / 1024:.1f} MB ({uri})"
+                        )
+                    body = await _read_body(response)
+                break
+            except (_RetryableResponse, aiohttp.ClientError, asyncio.TimeoutError) as e:
+                last_error = str(e) or type(e).__name__
+                await asyncio.sleep(1)
+        else:
+            raise ValueError(f"Document fetch error: {uri} ({last_error})")
+        return self._store(uri, key, response, body, now)
+
+    def release(self, document: FetchedDocument):
+        """Remove the body of a no-store response once it is parsed, cached bodies are kept."""
+        if document["temporary"]:
+            _remove_file(document["path"])
+
+    def store_text(self, key: str, text: str):
+        """Store the text extracted from a cached document, it is dropped when the body changes."""
+        entry = self._entry(key)
+        if not entry:
+            return
+        data = text.encode("utf-8")
+        _write_file(self._text_path(entry["file"]), data)
+        with self.lock:
+            self.conn.execute(
+                "UPDATE documents SET text_size = ? WHERE key = ?", (len(data), key)
+            )
+        self._evict()
+
+    def _entry(self, key: str) -> dict | None:
+        with self.lock:
+            cursor = self.conn.execute("SELECT * FROM documents WHERE key = ?", (key,))
+            row = cursor.fetchone()
+            if not row:
+                return None
+            entry = dict(zip([column[0] for column in cursor.description], row))
+        if not os.path.exists(os.path.join(self.folder, entry["file"])):
+            self._delete([key])
+            return None
+        return entry
+
+    def _document(self, uri: str, entry: dict) -> FetchedDocument:
+        text = None
+        if entry["text_size"] is not None:
+            try:
+                with open(self._text_path(entry["file"]), "r", encoding="utf-8") as f:
+                    text = f.read()
+            except OSError:
+                text = None
+        return {
+            "uri": uri,
+            "path": os.path.join(self.folder, entry["file"]),
+            "content_type": entry["content_type"],
+            "checksum": entry["checksum"],
+            "text": text,
+            "temporary": False,
+        }
+
+    def _revalidated(
+        self, uri: str, key: str, entry: dict, headers: Mapping[str, str], now: float
+    ) -> FetchedDocument:
+        # 304 Not Modified, the stored body is still valid
+        expires = _expires(headers, now, headers.get("Last-Modified") or entry["last_modified"])
+        with self.lock:
+            self.conn.execute(
+                """UPDATE documents SET expires = ?, accessed = ?,
+                etag = COALESCE(?, etag), last_modified = COALESCE(?, last_modified) WHERE key = ?""",
+                (expires or now, now, headers.get("ETag"), headers.get("Last-Modified"), key),
+            )
+        return self._document(uri, entry)
+
+    def _store(
+        self, uri: str, key: str, response: aiohttp.ClientResponse, body: bytes, now: float
+    ) -> FetchedDocument:
+        content_type = response.content_type or "application/octet-stream"
+        charset = response.charset
+        if charset and charset.lower() not in ("utf-8", "utf8") and _is_text(content_type):
+            # texts are stored as utf-8, the parsers read local files in that encoding
+            body = body.decode(charset, errors="replace").encode("utf-8")
+        checksum = xxhash.xxh3_128_hexdigest(body)
+        name = xxhash.xxh3_64_hexdigest(key.encode("utf-8")) + _extension(uri, content_type)
+        expires = _expires(response.headers, now, response.headers.get("Last-Modified"))
+        old = self._entry(key)
+        if expires is None and old:
+            self._delete([key])
+        if expires is None:
+            # no-store, the body is kept for parsing only, concurrent fetches get their own file
+            folder = os.path.join(self.folder, NO_STORE_FOLDER)
+            os.makedirs(folder, exist_ok=True)
+            path = os.path.join(folder, uuid.uuid4().hex + _extension(uri, content_type))
+            _write_file(path, body)
+            return {
+                "uri": uri,
+                "path": path,
+                "content_type": content_type,
+                "checksum": checksum,
+                "text": None,
+                "temporary": True,
+            }
+        _write_file(os.path.join(self.folder, name), body)
+
+        keep_text = bool(old and old["checksum"] == checksum and old["file"] == name)
+        if old and not keep_text:
+            _remove_file(self._text_path(old["file"]))
+            if old["file"] != name:
+                _remove_file(os.path.join(self.folder, old["file"]))
+        with self.lock:
+            self.conn.execute(
+                """INSERT OR REPLACE INTO documents
+                (key, file, content_type, checksum, etag, last_modified, expires, size, text_size, accessed)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                (
+                    key,
+                    name,
+                    content_type,
+                    checksum,
+                    response.headers.get("ETag"),
+                    response.headers.get("Last-Modified"),
+                    expires,
+                    len(body),
+                    old["text_size"] if keep_text and old else None,
+                    now,
+                ),
+            )
+        self._evict()
+        entry = self._entry(key)
+        assert entry
+        return self._document(uri, entry)
+
+    def _touch(self, key: str):
+        with self.lock:
+            self.conn.execute(
+                "UPDATE documents SET accessed = ? WHERE key = ?", (time.time(), key)
+            )
+
+    def _delete(self, keys: list[str]):
+        with self.lock:
+            for key in keys:
+                row = self.conn.execute(
+                    "SELECT file FROM documents WHERE key = ?", (key,)
+                ).fetchone()
+                if row:
+                    _remove_file(os.path.join(self.folder, row[0]))
+                    _remove_file(self._text_path(row[0]))
+                self.conn.execute("DELETE FROM documents WHERE key = ?", (key,))
+
+    def _evict(self):
+        # drop least recently used documents until the cache fits the target size
+        if not self.max_bytes:
+            return
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT key, size + COALESCE(text_size, 0) FROM documents ORDER BY accessed DESC"
+            ).fetchall()
+        total = sum(size for _, size in rows)
+        if total <= self.max_bytes:
+            return
+        target = int(self.max_bytes * EVICTION_TARGET)
+        evicted = []
+        # never evict the most recently used document, it is being processed
+        for key, size in reversed(rows[1:]):
+            if total <= target:
+                break
+            evicted.append(key)
+            total -= size
+        self._delete(evicted)
+        PrintStyle.standard(f"Evicted {len(evicted)} documents from the document cache")
+
+    def _text_path(self, name: str) -> str:
+        return os.path.join(self.folder, name + ".extracted.txt")
+
+
+async def _read_body(response: aiohttp.ClientResponse) -> bytes:
+    # the content length header may be missing or wrong, limit the body while reading
+    limit = MAX_DOCUMENT_MB * 1024 * 1024
+    data = bytearray()
+    async for block in response.content.iter_chunked(1024 * 1024):
+        data.extend(block)
+        if len(data) > limit:
+            raise ValueError(
+                f"Document content length exceeds max. {MAX_DOCUMENT_MB}MB ({response.url})"
+            )
+    return bytes(data)
+
+
+def _expires(headers: Mapping[str, str], now: float, last_modified: str | None) -> float | None:
+    """Expiration time of a response, None when it must not be stored."""
+    directives = {}
+    for part in headers.get("Cache-Control", "").split(","):
+        name, _, value = part.strip().partition("=")
+        if name:
+            directives[name.lower()] = value.strip('"')
+    if "no-store" in directives:
+        return None
+    if "no-cache" in directives:
+        return now  # stored, but revalidated on every use
+    if "max-age" in directives:
+        try:
+            age = int(headers.get("Age", "0"))
+        except ValueError:
+            age = 0
+        try:
+            return now + int(directives["max-age"]) - age
+        except ValueError:
+            return now
+    if "Expires" in headers:
+        try:
+            expires = parsedate_to_datetime(headers["Expires"]).timestamp()
+            date = parsedate_to_datetime(headers["Date"]).timestamp() if "Date" in headers else now
+            return now + expires - date
+        except (TypeError, ValueError):
+            return now  # invalid dates mean already expired
+    if last_modified:
+        # heuristic freshness of 10% of the time since the last modification
+        try:
+            modified = parsedate_to_datetime(last_modified).timestamp()
+            return now + min(HEURISTIC_MAX_AGE, max(0.0, (now - modified) * 0.1))
+        except (TypeError, ValueError):
+            pass
+    return now + DEFAULT_MAX_AGE
+
+
+def _extension(uri: str, content_type: str) -> str:
+    # parsers detect the format from the file extension
+    ext = os.path.splitext(urlparse(uri).path)[1]
+    if ext and mimetypes.guess_type("file" + ext)[0]:
+        return ext.lower()
+    return mimetypes.guess_extension(content_type) or ".bin"
+
+
+def _is_text(content_type: str) -> bool:
+    return content_type.startswith("text/") or content_type in ("application/json", "application/xml")
+
+
+def _write_file(path: str, data: bytes):
+    with open(path + ".tmp", "wb") as f:
+        f.write(data)
+    os.replace(path + ".tmp", path)
+
+
+def _remove_file(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
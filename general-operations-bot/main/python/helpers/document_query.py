@@ -1,41 +1,69 @@
 import mimetypes
 import os
 import asyncio
-import aiohttp
 import json
+import threading
+import time
+from collections import OrderedDict
+from contextlib import aclosing, asynccontextmanager
+
+import numpy as np
+import xxhash
 
 from python.helpers.vector_db import VectorDB
+from python.helpers.document_cache import DocumentCache, FetchedDocument
+from python.helpers import pdf_extract
+from python.helpers.pdf_extract import PdfPageCache
 
 os.environ["USER_AGENT"] = "@mixedbread-ai/unstructured"  # noqa E402
 from langchain_unstructured import UnstructuredLoader  # noqa E402
 
 from urllib.parse import urlparse
-from typing import Callable, Sequence, List, Optional, Tuple
+from typing import AsyncIterator, Callable, Sequence, List, Optional, Tuple, TypedDict
 from datetime import datetime
 
-from langchain_community.document_loaders import AsyncHtmlLoader
 from langchain_community.document_loaders.text import TextLoader
-from langchain_community.document_loaders.pdf import PyMuPDFLoader
 from langchain_community.document_transformers import MarkdownifyTransformer
-from langchain_community.document_loaders.parsers.images import TesseractBlobParser
 
 from langchain_core.documents import Document
 from langchain.schema import SystemMessage, HumanMessage
 
 from python.helpers.print_style import PrintStyle
-from python.helpers import files, errors
+from python.helpers import files, errors, settings, tokens, chunk_selection
+from python.helpers.defer import DeferredTask
 from agent import Agent
 
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 
 
 DEFAULT_SEARCH_THRESHOLD = 0.5
+STORE_FOLDER = "tmp/document_query"
+RECORDS_FILE = "documents.json"
+EMBEDDING_CONCURRENCY = 4  # pages embedded at the same time while a PDF is extracted
+PROGRESS_PAGES = 10  # extracted PDF pages between progress updates
+DOCUMENT_CONTEXT_SHARE = 0.5  # share of the chat model context used for document chunks
+MMR_LAMBDA = 0.7  # weight of relevance against diversity when selecting chunks
+DUPLICATE_SIMILARITY = 0.97  # chunks this similar to a selected one are left out
+MAX_MAP_GROUPS = 4  # chat model calls at most when the chunks do not fit one call
+COVERAGE_HITS = 3  # best hits of a query of which one has to fit a single call
+SAVE_DELAY = 5  # seconds changes are collected before the store is written to disk
+
+
+class DocumentRecord(TypedDict):
+    uri: str
+    checksum: str  # hash of the extracted text
+    source_checksum: str  # hash of the file bytes or the downloaded body
+    ids: list[str]
+    size: int
+    fetched: float
 
 
 class DocumentQueryStore:
     """
     FAISS Store for document query results.
     Manages documents identified by URI for storage, retrieval, and searching.
+    One store per embedding model is shared by all agents of the process,
+    documents are kept in LRU order within a size limit and optionally saved to disk.
     """
 
     # Default chunking parameters
@@ -44,24 +72,44 @@ class DocumentQueryStore:
 
     # Cache for initialized stores
     _stores: dict[str, "DocumentQueryStore"] = {}
+    _stores_lock = threading.Lock()
 
     @staticmethod
     def get(agent: Agent):
-        """Create a DocumentQueryStore instance for the specified agent."""
+        """Get the shared DocumentQueryStore for the embedding model of the specified agent."""
         if not agent or not agent.config:
             raise ValueError("Agent and agent config must be provided")
 
-        # Initialize store
-        store = DocumentQueryStore(agent)
+        model = agent.config.embeddings_model
+        namespace = files.safe_file_name(model.provider + "_" + model.name)
+        with DocumentQueryStore._stores_lock:
+            store = DocumentQueryStore._stores.get(namespace)
+            if not store:
+                store = DocumentQueryStore(agent, namespace)
+                DocumentQueryStore._stores[namespace] = store
         return store
 
     def __init__(
         self,
         agent: Agent,
+        namespace: str = "default",
     ):
         """Initialize a DocumentQueryStore instance."""
         self.agent = agent
         self.vector_db: VectorDB | None = None
+        self.folder = files.get_abs_path(STORE_FOLDER, namespace)
+        self.persist = settings.get_settings()["memory_document_cache_persist"]
+        # guards the vector db and the records, acquired in a worker thread so the event loop keeps running
+        self.lock = threading.Lock()
+        self.document_locks: dict[str, threading.Lock] = {}
+        self.documents: OrderedDict[str, DocumentRecord] = OrderedDict()
+        # changes not written to disk yet, saved together by a delayed background task
+        self.vectors_dirty = False
+        self.records_dirty = False
+        self.save_scheduled = False
+        self.save_task: DeferredTask | None = None
+        if self.persist:
+            self._load_records()
 
     @staticmethod
     def normalize_uri(uri: str) -> str:
@@ -95,65 +143,216 @@ class DocumentQueryStore:
         return normalized
 
     def init_vector_db(self):
-        return VectorDB(self.agent, cache=True)
+        return VectorDB(self.agent, cache=True, folder=self.folder if self.persist else "")
+
+    def document_lock(self, document_uri: str) -> threading.Lock:
+        """Lock held while a document is fetched and indexed, so concurrent queries do it once."""
+        with DocumentQueryStore._stores_lock:
+            return self.document_locks.setdefault(self.normalize_uri(document_uri), threading.Lock())
+
+    async def get_cached_document(
+        self, document_uri: str, source_checksum: str
+    ) -> str | None:
+        """
+        Content of an indexed document if it is still valid.
+
+        Args:
+            document_uri: The URI of the document
+            source_checksum: Hash of the current source file or downloaded body
+
+        Returns:
+            The document content, None if the document has to be fetched again
+        """
+        document_uri = self.normalize_uri(document_uri)
+        record = self.documents.get(document_uri)
+        if not record:
+            return None
+        if record["source_checksum"] != source_checksum:
+            return None
+        doc = await self.get_document(document_uri)
+        return doc.page_content if doc else None
 
     async def add_document(
-        self, text: str, document_uri: str, metadata: dict | None = None
+        self,
+        text: str,
+        document_uri: str,
+        metadata: dict | None = None,
+        source_checksum: str = "",
     ) -> tuple[bool, list[str]]:
         """
         Add a document to the store with the given URI.
+        A document already stored with the same content is kept without embedding it again.
 
         Args:
             text: The document text content
             document_uri: The URI that uniquely identifies this document
             metadata: Optional metadata for the document
+            source_checksum: Optional hash of the source file the text was extracted from
 
         Returns:
             True if successful, False otherwise
         """
         # Normalize the URI
         document_uri = self.normalize_uri(document_uri)
+        checksum = xxhash.xxh3_128_hexdigest(text.encode("utf-8"))
+        if await self._keep_unchanged(document_uri, checksum, source_checksum):
+            return True, self.documents[document_uri]["ids"]
 
-        # Delete existing document if it exists to avoid duplicates
-        await self.delete_document(document_uri)
+        # Split text into chunks, start offsets allow to reassemble the text without the overlaps
+        docs = self._text_splitter().create_documents(
+            [text], [self._document_metadata(document_uri, metadata)]
+        )
 
-        # Initialize metadata
-        doc_metadata = metadata or {}
-        doc_metadata["document_uri"] = document_uri
-        doc_metadata["timestamp"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        try:
+            vector_db = await self._get_vector_db()
+            # embed before locking, other documents can be searched meanwhile
+            vectors = await vector_db.embeddings.aembed_documents(
+                [doc.page_content for doc in docs]
+            )
+            ids = await self._insert(
+                document_uri, docs, vectors, checksum, source_checksum, len(text)
+            )
+            return bool(ids), ids
+        except Exception as e:
+            err_text = errors.format_error(e)
+            PrintStyle.error(f"Error adding document '{document_uri}': {err_text}")
+            return False, []
 
-        # Split text into chunks
-        text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=self.DEFAULT_CHUNK_SIZE, chunk_overlap=self.DEFAULT_CHUNK_OVERLAP
-        )
-        chunks = text_splitter.split_text(text)
+    async def add_document_pages(
+        self,
+        pages: AsyncIterator[tuple[int, str | None]],
+        document_uri: str,
+        metadata: dict | None = None,
+        source_checksum: str = "",
+    ) -> tuple[bool, list[str], str, bool]:
+        """
+        Add a document whose pages arrive out of order, e.g. from parallel extraction.
+        Each page is chunked and embedded as soon as it arrives while later pages are still extracted.
 
-        # Create documents
-        docs = []
-        for i, chunk in enumerate(chunks):
-            chunk_metadata = doc_metadata.copy()
-            chunk_metadata["chunk_index"] = i
-            chunk_metadata["total_chunks"] = len(chunks)
-            docs.append(Document(page_content=chunk, metadata=chunk_metadata))
+        Args:
+            pages: (page number, text) pairs in any order, the text of a failed page is None
+            document_uri: The URI that uniquely identifies this document
+            metadata: Optional metadata for the document
+            source_checksum: Optional hash of the source file the pages were extracted from
 
-        if not docs:
-            PrintStyle.error(f"No chunks created for document: {document_uri}")
-            return False, []
+        Returns:
+            Success, the ids of the chunks, the text of all pages in order and whether no page failed
+        """
+        document_uri = self.normalize_uri(document_uri)
+        doc_metadata = self._document_metadata(document_uri, metadata)
+        text_splitter = self._text_splitter()
+        limit = asyncio.Semaphore(EMBEDDING_CONCURRENCY)
 
-        try:
-            # Initialize vector db if not already initialized
-            if not self.vector_db:
-                self.vector_db = self.init_vector_db()
+        async def embed(texts: list[str]) -> list[list[float]]:
+            async with limit:
+                return await vector_db.embeddings.aembed_documents(texts)
 
-            ids = await self.vector_db.insert_documents(docs)
-            PrintStyle.standard(
-                f"Added document '{document_uri}' with {len(docs)} chunks"
+        texts: dict[int, str] = {}
+        failed = False
+        pending: dict[int, tuple[list[Document], asyncio.Task]] = {}
+        try:
+            vector_db = await self._get_vector_db()
+            async with aclosing(pages):
+                async for number, page_text in pages:
+                    if page_text is None:
+                        failed, page_text = True, ""
+                    texts[number] = page_text
+                    page_docs = text_splitter.create_documents([page_text], [doc_metadata])
+                    task = asyncio.create_task(embed([doc.page_content for doc in page_docs]))
+                    pending[number] = (page_docs, task)
+
+            # pages in order, chunk offsets are shifted to positions in the whole text
+            text = "\n".join(texts[number] for number in sorted(texts))
+            checksum = xxhash.xxh3_128_hexdigest(text.encode("utf-8"))
+            if failed:
+                # not valid for the source, the next query extracts the failed pages again
+                source_checksum = ""
+            if await self._keep_unchanged(document_uri, checksum, source_checksum):
+                return True, self.documents[document_uri]["ids"], text, not failed
+            docs: list[Document] = []
+            vectors: list[list[float]] = []
+            offset = 0
+            for number in sorted(texts):
+                page_docs, task = pending[number]
+                vectors.extend(await task)
+                for doc in page_docs:
+                    doc.metadata["page"] = number + 1
+                    doc.metadata["start_index"] += offset
+                docs.extend(page_docs)
+                offset += len(texts[number]) + 1
+
+            ids = await self._insert(
+                document_uri, docs, vectors, checksum, source_checksum, len(text)
             )
-            return True, ids
+            return bool(ids), ids, text, not failed
         except Exception as e:
             err_text = errors.format_error(e)
             PrintStyle.error(f"Error adding document '{document_uri}': {err_text}")
-            return False, []
+            return False, [], "", False
+        finally:
+            for _, task in pending.values():
+                task.cancel()
+
+    def _text_splitter(self) -> RecursiveCharacterTextSplitter:
+        return RecursiveCharacterTextSplitter(
+            chunk_size=self.DEFAULT_CHUNK_SIZE,
+            chunk_overlap=self.DEFAULT_CHUNK_OVERLAP,
+            add_start_index=True,
+        )
+
+    def _document_metadata(self, document_uri: str, metadata: dict | None) -> dict:
+        doc_metadata = metadata or {}
+        doc_metadata["document_uri"] = document_uri
+        doc_metadata["timestamp"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        return doc_metadata
+
+    async def _keep_unchanged(
+        self, document_uri: str, checksum: str, source_checksum: str
+    ) -> bool:
+        # the same content is already indexed, only record where it came from
+        record = self.documents.get(document_uri)
+        if not record or record["checksum"] != checksum:
+            return False
+        async with self._locked():
+            record["source_checksum"] = source_checksum
+            record["fetched"] = time.time()
+            self.documents.move_to_end(document_uri)
+            self._save(vectors=False)
+        PrintStyle.standard(f"Document '{document_uri}' is unchanged")
+        return True
+
+    async def _insert(
+        self,
+        document_uri: str,
+        docs: list[Document],
+        vectors: list[list[float]],
+        checksum: str,
+        source_checksum: str,
+        size: int,
+    ) -> list[str]:
+        if not docs:
+            PrintStyle.error(f"No chunks created for document: {document_uri}")
+            return []
+        for i, doc in enumerate(docs):
+            doc.metadata["chunk_index"] = i
+            doc.metadata["total_chunks"] = len(docs)
+
+        vector_db = await self._get_vector_db()
+        async with self._locked():
+            self._remove(document_uri)
+            ids = vector_db.insert_embeddings(docs, vectors)
+            self.documents[document_uri] = {
+                "uri": document_uri,
+                "checksum": checksum,
+                "source_checksum": source_checksum,
+                "ids": ids,
+                "size": size,
+                "fetched": time.time(),
+            }
+            self._evict(document_uri)
+            self._save()
+        PrintStyle.standard(f"Added document '{document_uri}' with {len(docs)} chunks")
+        return ids
 
     async def get_document(self, document_uri: str) -> Optional[Document]:
         """
@@ -166,10 +365,6 @@ class DocumentQueryStore:
             The complete document if found, None otherwise
         """
 
-        # DB not initialized, no documents inside
-        if not self.vector_db:
-            return None
-
         # Normalize the URI
         document_uri = self.normalize_uri(document_uri)
 
@@ -181,12 +376,24 @@ class DocumentQueryStore:
 
         # Combine chunks into a single document
         chunks = sorted(docs, key=lambda x: x.metadata.get("chunk_index", 0))
-        full_content = "\n".join(chunk.page_content for chunk in chunks)
+        if all("start_index" in chunk.metadata for chunk in chunks):
+            # drop the parts overlapping the previous chunk
+            full_content = ""
+            end = 0
+            for chunk in chunks:
+                start = chunk.metadata["start_index"]
+                if full_content and start > end:
+                    full_content += "\n"  # whitespace stripped by the splitter
+                full_content += chunk.page_content[max(0, end - start) :]
+                end = max(end, start + len(chunk.page_content))
+        else:
+            full_content = "\n".join(chunk.page_content for chunk in chunks)
 
         # Use metadata from first chunk
         metadata = chunks[0].metadata.copy()
         metadata.pop("chunk_index", None)
         metadata.pop("total_chunks", None)
+        metadata.pop("start_index", None)
 
         return Document(page_content=full_content, metadata=metadata)
 
@@ -201,18 +408,19 @@ class DocumentQueryStore:
             List of document chunks
         """
 
-        # DB not initialized, no documents inside
-        if not self.vector_db:
-            return []
-
         # Normalize the URI
         document_uri = self.normalize_uri(document_uri)
 
-        # get docs from vector db
+        record = self.documents.get(document_uri)
+        if not record:
+            return []
 
-        chunks = await self.vector_db.search_by_metadata(
-            filter=f"document_uri == '{document_uri}'",
-        )
+        # get docs from vector db by the ids of the record
+        vector_db = await self._get_vector_db()
+        async with self._locked():
+            chunks = vector_db.db.get_by_ids(record["ids"])
+            if document_uri in self.documents:
+                self.documents.move_to_end(document_uri)
 
         PrintStyle.standard(f"Found {len(chunks)} chunks for document: {document_uri}")
         return chunks
@@ -227,16 +435,7 @@ class DocumentQueryStore:
         Returns:
             True if the document exists, False otherwise
         """
-
-        # DB not initialized, no documents inside
-        if not self.vector_db:
-            return False
-
-        # Normalize the URI
-        document_uri = self.normalize_uri(document_uri)
-
-        chunks = await self._get_document_chunks(document_uri)
-        return len(chunks) > 0
+        return self.normalize_uri(document_uri) in self.documents
 
     async def delete_document(self, document_uri: str) -> bool:
         """
@@ -249,34 +448,24 @@ class DocumentQueryStore:
             True if deleted, False if not found
         """
 
-        # DB not initialized, no documents inside
-        if not self.vector_db:
-            return False
-
         # Normalize the URI
         document_uri = self.normalize_uri(document_uri)
-
-        chunks = await self.vector_db.search_by_metadata(
-            filter=f"document_uri == '{document_uri}'",
-        )
-        if not chunks:
+        if document_uri not in self.documents:
             return False
 
-        # Collect IDs to delete
-        ids_to_delete = [chunk.metadata["id"] for chunk in chunks]
-
-        # Delete from vector store
-        if ids_to_delete:
-            dels = await self.vector_db.delete_documents_by_ids(ids_to_delete)
-            PrintStyle.standard(
-                f"Deleted document '{document_uri}' with {len(dels)} chunks"
-            )
-            return True
-
-        return False
+        await self._get_vector_db()
+        async with self._locked():
+            deleted = self._remove(document_uri)
+            self._save()
+        PrintStyle.standard(f"Deleted document '{document_uri}' with {deleted} chunks")
+        return True
 
     async def search_documents(
-        self, query: str, limit: int = 10, threshold: float = 0.5, filter: str = ""
+        self,
+        query: str,
+        limit: int = 10,
+        threshold: float = 0.5,
+        filter: str | Callable[[dict], bool] = "",
     ) -> List[Document]:
         """
         Search for documents similar to the query across the entire store.
@@ -290,25 +479,60 @@ class DocumentQueryStore:
             List of matching documents
         """
 
-        # DB not initialized, no documents inside
-        if not self.vector_db:
-            return []
-
         # Handle empty query
         if not query:
             return []
 
+        results = await self.search_documents_multi([query], limit, threshold, filter)
+        PrintStyle.standard(f"Search '{query}' returned {len(results[0])} results")
+        return [doc for doc, _ in results[0]]
+
+    async def search_documents_multi(
+        self,
+        queries: Sequence[str],
+        limit: int = 10,
+        threshold: float = 0.5,
+        filter: str | Callable[[dict], bool] = "",
+        document_uri: str = "",
+    ) -> List[List[Tuple[Document, float]]]:
+        """
+        Search several queries at once, they are embedded concurrently and searched in one index pass.
+
+        Args:
+            queries: The search query strings
+            limit: Maximum number of results to return per query
+            threshold: Minimum similarity score threshold (0-1)
+            document_uri: Only search the chunks of this (normalized) document
+
+        Returns:
+            List of matching documents with their relevance score (0-1) for each query
+        """
+
+        # No documents inside
+        if not self.documents or not queries:
+            return [[] for _ in queries]
+
         # Perform search
         try:
-            results = await self.vector_db.search_by_similarity_threshold(
-                query=query, limit=limit, threshold=threshold, filter=filter
+            vector_db = await self._get_vector_db()
+            distinct = list(dict.fromkeys(queries))
+            # query embeddings, asymmetric models embed questions differently than documents
+            embeddings = await asyncio.gather(
+                *(vector_db.embeddings.aembed_query(query) for query in distinct)
             )
-
-            PrintStyle.standard(f"Search '{query}' returned {len(results)} results")
-            return results
+            async with self._locked():
+                ids = None
+                if document_uri:
+                    record = self.documents.get(document_uri)
+                    ids = record["ids"] if record else []
+                found = vector_db.search_by_vectors_with_scores(
+                    embeddings, limit=limit, threshold=threshold, filter=filter, ids=ids
+                )
+            by_query = dict(zip(distinct, found))
+            return [by_query[query] for query in queries]
         except Exception as e:
             PrintStyle.error(f"Error searching documents: {str(e)}")
-            return []
+            return [[] for _ in queries]
 
     async def search_document(
         self, document_uri: str, query: str, limit: int = 10, threshold: float = 0.5
@@ -325,10 +549,29 @@ class DocumentQueryStore:
         Returns:
             List of matching document chunks
         """
-        return await self.search_documents(
-            query, limit, threshold, f"document_uri == '{document_uri}'"
+        if not query:
+            return []
+        results = await self.search_document_multi(document_uri, [query], limit, threshold)
+        return [doc for doc, _ in results[0]]
+
+    async def search_document_multi(
+        self,
+        document_uri: str,
+        queries: Sequence[str],
+        limit: int = 10,
+        threshold: float = 0.5,
+    ) -> List[List[Tuple[Document, float]]]:
+        """Search several queries within a specific document, (chunk, relevance) pairs for each query."""
+        return await self.search_documents_multi(
+            queries, limit, threshold, document_uri=self.normalize_uri(document_uri)
         )
 
+    async def get_vectors(self, ids: Sequence[str]) -> np.ndarray:
+        """Stored embeddings of the given chunk ids."""
+        vector_db = await self._get_vector_db()
+        async with self._locked():
+            return vector_db.get_vectors(ids)
+
     async def list_documents(self) -> List[str]:
         """
         Get a list of all document URIs in the store.
@@ -336,19 +579,107 @@ class DocumentQueryStore:
         Returns:
             List of document URIs
         """
-        # DB not initialized, no documents inside
+        return sorted(self.documents.keys())
+
+    async def _get_vector_db(self) -> VectorDB:
         if not self.vector_db:
-            return []
+            async with self._locked():
+                if not self.vector_db:
+                    self.vector_db = self.init_vector_db()
+                    self._drop_orphans()
+        return self.vector_db
+
+    @asynccontextmanager
+    async def _locked(self):
+        await asyncio.to_thread(self.lock.acquire)
+        try:
+            yield
+        finally:
+            self.lock.release()
+
+    def _remove(self, document_uri: str) -> int:
+        # lock must be held
+        record = self.documents.pop(document_uri, None)
+        if not record or not self.vector_db:
+            return 0
+        return self.vector_db.delete_ids(record["ids"])
+
+    def _evict(self, keep: str):
+        # lock must be held, drop least recently used documents above the size limit
+        max_size = settings.get_settings()["memory_document_cache_mb"] * 1024 * 1024
+        total = sum(record["size"] for record in self.documents.values())
+        for uri in list(self.documents.keys()):
+            if total <= max_size:
+                break
+            if uri == keep:
+                continue
+            total -= self.documents[uri]["size"]
+            self._remove(uri)
+            PrintStyle.standard(f"Evicted document '{uri}' from the document query store")
+
+    def _drop_orphans(self):
+        # lock must be held, chunks of documents that were not recorded (interrupted save)
+        assert self.vector_db
+        known = {id for record in self.documents.values() for id in record["ids"]}
+        stored = self.vector_db.db.get_all_docs()
+        orphans = [id for id in stored if id not in known]
+        if orphans:
+            self.vector_db.delete_ids(orphans)
+        # records of chunks that are missing
+        for uri, record in list(self.documents.items()):
+            if any(id not in stored for id in record["ids"]):
+                self._remove(uri)
+
+    def _load_records(self):
+        path = os.path.join(self.folder, RECORDS_FILE)
+        if not os.path.exists(path):
+            return
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                records: list[DocumentRecord] = json.load(f)
+            self.documents = OrderedDict((record["uri"], record) for record in records)
+        except (OSError, ValueError, KeyError) as e:
+            PrintStyle.error(f"Could not read document query store {path}: {e}")
+
+    def _save(self, vectors: bool = True):
+        # lock must be held, marks the store dirty and schedules one write for the changes of the next seconds
+        if not self.persist or not self.vector_db:
+            return
+        self.vectors_dirty = self.vectors_dirty or vectors
+        self.records_dirty = True
+        if not self.save_scheduled:
+            self.save_scheduled = True
+            self.save_task = DeferredTask(thread_name="DocumentQuerySave").start_task(
+                self._save_later
+            )
 
-        # Extract unique URIs
-        uris = set()
-        for doc in self.vector_db.db.get_all_docs().values():
-            if isinstance(doc.metadata, dict):
-                uri = doc.metadata.get("document_uri")
-                if uri:
-                    uris.add(uri)
+    async def _save_later(self):
+        while True:
+            await asyncio.sleep(SAVE_DELAY)
+            async with self._locked():
+                if not self.records_dirty:
+                    # cleared under the lock, so a change made now schedules a new save
+                    self.save_scheduled = False
+                    return
+                vectors = None
+                if self.vectors_dirty and self.vector_db:
+                    vectors = await asyncio.to_thread(self.vector_db.serialize)
+                records = json.dumps(list(self.documents.values()))
+                self.vectors_dirty = self.records_dirty = False
+            # chunks are written before the records, records of missing chunks are dropped on load
+            try:
+                await asyncio.to_thread(self._write, vectors, records)
+            except OSError as e:
+                PrintStyle.error(f"Could not save document query store: {e}")
 
-        return sorted(list(uris))
+    def _write(self, vectors: tuple[np.ndarray, bytes] | None, records: str):
+        if vectors:
+            VectorDB.write(self.folder, *vectors)
+        os.makedirs(self.folder, exist_ok=True)
+        path = os.path.join(self.folder, RECORDS_FILE)
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            f.write(records)
+        os.replace(path + ".tmp", path)
 
 
 class DocumentQueryHelper:
@@ -367,64 +698,139 @@ class DocumentQueryHelper:
 
         # index document
         _ = await self.document_get_content(document_uri, True)
-        selected_chunks = {}
-        for question in questions:
-            self.progress_callback(f"Optimizing query: {question}")
-            human_content = f'Search Query: "{question}"'
-            system_content = self.agent.parse_prompt(
-                "fw.document_query.optmimize_query.md"
-            )
 
-            optimized_query = (
-                await self.agent.call_utility_model(
-                    system=system_content, message=human_content
-                )
-            ).strip()
+        # optimize all queries concurrently
+        optimized_queries = await asyncio.gather(
+            *[self.optimize_query(question) for question in questions]
+        )
 
-            self.progress_callback(f"Searching document with query: {optimized_query}")
+        # embed them in one batch and search them in one pass
+        self.progress_callback(
+            f"Searching document with {len(optimized_queries)} queries"
+        )
+        found = await self.store.search_document_multi(
+            document_uri=document_uri,
+            queries=optimized_queries,
+            limit=100,
+            threshold=DEFAULT_SEARCH_THRESHOLD,
+        )
 
-            normalized_uri = self.store.normalize_uri(document_uri)
-            chunks = await self.store.search_document(
-                document_uri=normalized_uri,
-                query=optimized_query,
-                limit=100,
-                threshold=DEFAULT_SEARCH_THRESHOLD,
+        # union of the hits, ranked by their best relevance to any query
+        relevance: dict[str, float] = {}
+        candidates: dict[str, Document] = {}
+        for optimized_query, hits in zip(optimized_queries, found):
+            self.progress_callback(
+                f"Found {len(hits)} chunks for query: {optimized_query}"
             )
+            for chunk, score in hits:
+                id = chunk.metadata["id"]
+                candidates[id] = chunk
+                relevance[id] = max(score, relevance.get(id, 0.0))
 
-            self.progress_callback(f"Found {len(chunks)} chunks")
-
-            for chunk in chunks:
-                selected_chunks[chunk.metadata["id"]] = chunk
-
-        if not selected_chunks:
+        if not candidates:
             self.progress_callback(f"No relevant content found in the document")
             content = f"!!! No content found for document: {document_uri} matching queries: {json.dumps(questions)}"
             return False, content
 
-        self.progress_callback(
-            f"Processing {len(questions)} questions in context of {len(selected_chunks)} chunks"
-        )
-
         questions_str = "\n".join([f" *  {question}" for question in questions])
-        content = "\n\n----\n\n".join(
-            [chunk.page_content for chunk in selected_chunks.values()]
-        )
-
         qa_system_message = self.agent.parse_prompt(
             "fw.document_query.system_prompt.md"
         )
+
+        # drop near duplicates and order by relevance and diversity
+        ids = list(candidates)
+        vectors = await self.store.get_vectors(ids)
+        order = chunk_selection.mmr_order(
+            [relevance[id] for id in ids], vectors, MMR_LAMBDA, DUPLICATE_SIMILARITY
+        )
+        sizes = tokens.approximate_tokens_batch([candidates[id].page_content for id in ids])
+        budget = self.context_budget(qa_system_message + questions_str)
+        packed = {ids[i] for i in chunk_selection.pack(order, sizes, budget)}
+
+        # every query must keep one of its best hits, otherwise answer from groups of chunks and combine
+        covered = all(
+            not hits
+            or any(chunk.metadata["id"] in packed for chunk, _ in hits[:COVERAGE_HITS])
+            for hits in found
+        )
+        if covered:
+            self.progress_callback(
+                f"Processing {len(questions)} questions in context of {len(packed)} of {len(candidates)} chunks"
+            )
+            ai_response = await self.answer_queries(
+                qa_system_message, questions_str, [candidates[id] for id in packed]
+            )
+        else:
+            groups = chunk_selection.group(order, sizes, budget, MAX_MAP_GROUPS)
+            self.progress_callback(
+                f"Processing {len(questions)} questions in {len(groups)} parts of the document"
+            )
+            partial_answers = await asyncio.gather(
+                *[
+                    self.answer_queries(
+                        qa_system_message,
+                        questions_str,
+                        [candidates[ids[i]] for i in part],
+                    )
+                    for part in groups
+                ]
+            )
+            self.progress_callback(f"Combining answers of {len(groups)} parts")
+            answers = "\n\n----\n\n".join(partial_answers)
+            ai_response, _reasoning = await self.agent.call_chat_model(
+                messages=[
+                    SystemMessage(
+                        content=self.agent.parse_prompt(
+                            "fw.document_query.reduce_prompt.md"
+                        )
+                    ),
+                    HumanMessage(
+                        content=f"# Partial answers:\n{answers}\n\n# Queries:\n{questions_str}"
+                    ),
+                ]
+            )
+
+        self.progress_callback(f"Q&A process completed")
+
+        return True, str(ai_response)
+
+    async def answer_queries(
+        self, system_message: str, questions_str: str, chunks: list[Document]
+    ) -> str:
+        # chunks in document order read better than in order of relevance
+        chunks = sorted(chunks, key=lambda chunk: chunk.metadata.get("chunk_index", 0))
+        content = "\n\n----\n\n".join([chunk.page_content for chunk in chunks])
         qa_user_message = f"# Document:\n{content}\n\n# Queries:\n{questions_str}"
 
         ai_response, _reasoning = await self.agent.call_chat_model(
             messages=[
-                SystemMessage(content=qa_system_message),
+                SystemMessage(content=system_message),
                 HumanMessage(content=qa_user_message),
             ]
         )
+        return str(ai_response)
+
+    def context_budget(self, prompt: str) -> int:
+        """Tokens available for document chunks in a chat model call with the given prompt."""
+        ctx_length = self.agent.config.chat_model.ctx_length
+        return max(
+            int(ctx_length * DOCUMENT_CONTEXT_SHARE) - tokens.approximate_tokens(prompt),
+            0,
+        )
 
-        self.progress_callback(f"Q&A process completed")
+    async def optimize_query(self, question: str) -> str:
+        self.progress_callback(f"Optimizing query: {question}")
+        human_content = f'Search Query: "{question}"'
+        system_content = self.agent.parse_prompt("fw.document_query.optmimize_query.md")
 
-        return True, str(ai_response)
+        optimized_query = (
+            await self.agent.call_utility_model(
+                system=system_content, message=human_content
+            )
+        ).strip()
+
+        self.progress_callback(f"Optimized query: {optimized_query}")
+        return optimized_query
 
     async def document_get_content(
         self, document_uri: str, add_to_db: bool = False
@@ -435,44 +841,6 @@ class DocumentQueryHelper:
         mimetype, encoding = mimetypes.guess_type(document_uri)
         mimetype = mimetype or "application/octet-stream"
 
-        if mimetype == "application/octet-stream":
-            if url.scheme in ["http", "https"]:
-                response: aiohttp.ClientResponse | None = None
-                retries = 0
-                last_error = ""
-                while not response and retries < 3:
-                    try:
-                        async with aiohttp.ClientSession() as session:
-                            response = await session.head(
-                                document_uri,
-                                timeout=aiohttp.ClientTimeout(total=2.0),
-                                allow_redirects=True,
-                            )
-                            if response.status > 399:
-                                raise Exception(response.status)
-                            break
-                    except Exception as e:
-                        await asyncio.sleep(1)
-                        last_error = str(e)
-                    retries += 1
-
-                if not response:
-                    raise ValueError(
-                        f"DocumentQueryHelper::document_get_content: Document fetch error: {document_uri} ({last_error})"
-                    )
-
-                mimetype = response.headers["content-type"]
-                if "content-length" in response.headers:
-                    content_length = (
-                        float(response.headers["content-length"]) / 1024 / 1024
-                    )  # MB
-                    if content_length > 50.0:
-                        raise ValueError(
-                            f"Document content length exceeds max. 50MB: {content_length} MB ({document_uri})"
-                        )
-                if mimetype and "; charset=" in mimetype:
-                    mimetype = mimetype.split("; charset=")[0]
-
         if scheme == "file":
             try:
                 document_uri = files.fix_dev_path(url.path)
@@ -484,63 +852,114 @@ class DocumentQueryHelper:
                 f"Compressed documents are unsupported '{encoding}' ({document_uri})"
             )
 
-        if mimetype == "application/octet-stream":
-            raise ValueError(
-                f"Unsupported document mimetype '{mimetype}' ({document_uri})"
-            )
-
         # Use the store's normalization method
         document_uri_norm = self.store.normalize_uri(document_uri)
 
-        exists = await self.store.document_exists(document_uri_norm)
-        document_content = ""
-        if not exists:
-            if mimetype.startswith("image/"):
-                document_content = self.handle_image_document(document_uri, scheme)
-            elif mimetype == "text/html":
-                document_content = self.handle_html_document(document_uri, scheme)
-            elif mimetype.startswith("text/") or mimetype == "application/json":
-                document_content = self.handle_text_document(document_uri, scheme)
-            elif mimetype == "application/pdf":
-                document_content = self.handle_pdf_document(document_uri, scheme)
+        # one fetch per document at a time, concurrent queries wait and use the stored result
+        fetched: FetchedDocument | None = None
+        lock = self.store.document_lock(document_uri_norm)
+        await asyncio.to_thread(lock.acquire)
+        try:
+            # web documents are downloaded to the document cache and parsed from there
+            if scheme in ["http", "https"]:
+                fetched = await self.fetch_cache().fetch(document_uri, document_uri_norm)
+                if mimetype == "application/octet-stream":
+                    mimetype = fetched["content_type"]
+                source_path = fetched["path"]
+                source_checksum = fetched["checksum"]
+            elif scheme == "file":
+                source_path = document_uri
+                source_checksum = self.source_checksum(document_uri)
             else:
-                document_content = self.handle_unstructured_document(
-                    document_uri, scheme
+                raise ValueError(f"Unsupported scheme: {scheme}")
+
+            if mimetype == "application/octet-stream":
+                raise ValueError(
+                    f"Unsupported document mimetype '{mimetype}' ({document_uri})"
                 )
+
+            document_content = await self.store.get_cached_document(
+                document_uri_norm, source_checksum
+            )
+            if document_content is not None:
+                self.progress_callback(f"Using indexed document")
+                return document_content
+
+            success, ids, complete = False, None, True
+            if fetched and fetched["text"] is not None:
+                self.progress_callback(f"Using cached document text")
+                document_content = fetched["text"]
+            elif mimetype == "application/pdf":
+                pages = self.handle_pdf_document(source_path, "file")
+                if add_to_db:
+                    # pages are chunked and embedded while the remaining ones are extracted
+                    self.progress_callback(f"Indexing document")
+                    success, ids, document_content, complete = await self.store.add_document_pages(
+                        pages, document_uri_norm, source_checksum=source_checksum
+                    )
+                else:
+                    texts = dict([page async for page in pages])
+                    complete = None not in texts.values()
+                    document_content = "\n".join(texts[number] or "" for number in sorted(texts))
+            else:
+                if mimetype.startswith("image/"):
+                    document_content = self.handle_image_document(source_path, "file")
+                elif mimetype == "text/html":
+                    document_content = self.handle_html_document(source_path, "file")
+                elif mimetype.startswith("text/") or mimetype == "application/json":
+                    document_content = self.handle_text_document(source_path, "file")
+                else:
+                    document_content = self.handle_unstructured_document(
+                        source_path, "file"
+                    )
+            # a text with failed pages is not kept, they are extracted again next time
+            if fetched and fetched["text"] is None and document_content and complete:
+                self.fetch_cache().store_text(document_uri_norm, document_content)
+
             if add_to_db:
-                self.progress_callback(f"Indexing document")
-                success, ids = await self.store.add_document(
-                    document_content, document_uri_norm
-                )
+                if ids is None:
+                    self.progress_callback(f"Indexing document")
+                    success, ids = await self.store.add_document(
+                        document_content, document_uri_norm, source_checksum=source_checksum
+                    )
                 if not success:
                     self.progress_callback(f"Failed to index document")
                     raise ValueError(
                         f"DocumentQueryHelper::document_get_content: Failed to index document: {document_uri_norm}"
                     )
                 self.progress_callback(f"Indexed {len(ids)} chunks")
-        else:
-            doc = await self.store.get_document(document_uri_norm)
-            if doc:
-                document_content = doc.page_content
-            else:
-                raise ValueError(
-                    f"DocumentQueryHelper::document_get_content: Document not found: {document_uri_norm}"
-                )
-        return document_content
+            return document_content
+        finally:
+            if fetched:
+                self.fetch_cache().release(fetched)
+            lock.release()
+
+    def fetch_cache(self) -> DocumentCache:
+        return DocumentCache.get(
+            settings.get_settings()["memory_document_fetch_cache_mb"] * 1024 * 1024
+        )
+
+    def source_checksum(self, document: str) -> str:
+        """Hash of a local file to validate its indexed content."""
+        hasher = xxhash.xxh3_128()
+        with open(document, "rb") as f:
+            while block := f.read(1024 * 1024):
+                hasher.update(block)
+        return hasher.hexdigest()
 
     def handle_image_document(self, document: str, scheme: str) -> str:
         return self.handle_unstructured_document(document, scheme)
 
     def handle_html_document(self, document: str, scheme: str) -> str:
-        if scheme in ["http", "https"]:
-            loader = AsyncHtmlLoader(web_path=document)
-            parts: list[Document] = loader.load()
-        elif scheme == "file":
+        # web documents are parsed from their copy in the document cache
+        if scheme == "file":
             # Use RFC file operations instead of TextLoader
             file_content_bytes = files.read_file_bin(document)
             file_content = file_content_bytes.decode("utf-8")
             # Create Document manually since we're not using TextLoader
-            parts = [Document(page_content=file_content, metadata={"source": document})]
+            parts: list[Document] = [
+                Document(page_content=file_content, metadata={"source": document})
+            ]
         else:
             raise ValueError(f"Unsupported scheme: {scheme}")
 
@@ -552,15 +971,12 @@ class DocumentQueryHelper:
         )
 
     def handle_text_document(self, document: str, scheme: str) -> str:
-        if scheme in ["http", "https"]:
-            loader = AsyncHtmlLoader(web_path=document)
-            elements: list[Document] = loader.load()
-        elif scheme == "file":
+        if scheme == "file":
             # Use RFC file operations instead of TextLoader
             file_content_bytes = files.read_file_bin(document)
             file_content = file_content_bytes.decode("utf-8")
             # Create Document manually since we're not using TextLoader
-            elements = [
+            elements: list[Document] = [
                 Document(page_content=file_content, metadata={"source": document})
             ]
         else:
@@ -568,87 +984,31 @@ class DocumentQueryHelper:
 
         return "\n".join([element.page_content for element in elements])
 
-    def handle_pdf_document(self, document: str, scheme: str) -> str:
-        temp_file_path = ""
-        if scheme == "file":
-            # Use RFC file operations to read the PDF file as binary
-            file_content_bytes = files.read_file_bin(document)
-            # Create a temporary file for PyMuPDFLoader since it needs a file path
-            import tempfile
-
-            with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as temp_file:
-                temp_file.write(file_content_bytes)
-                temp_file_path = temp_file.name
-        elif scheme in ["http", "https"]:
-            # download the file from the web url to a temporary file using python libraries for downloading
-            import requests
-            import tempfile
-
-            with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as temp_file:
-                response = requests.get(document, timeout=10.0)
-                if response.status_code != 200:
-                    raise ValueError(
-                        f"DocumentQueryHelper::handle_pdf_document: Failed to download PDF from {document}: {response.status_code}"
-                    )
-                temp_file.write(response.content)
-                temp_file_path = temp_file.name
-        else:
+    async def handle_pdf_document(
+        self, document: str, scheme: str
+    ) -> AsyncIterator[tuple[int, str | None]]:
+        """
+        Pages of a PDF as (page number, text) in order of completion, None for pages that failed.
+        Pages are extracted in parallel, only pages without a text layer are OCRed
+        and extracted pages are cached by file hash.
+        """
+        if scheme != "file":
             raise ValueError(f"Unsupported scheme: {scheme}")
-
-        if not os.path.exists(temp_file_path):
-            raise ValueError(
-                f"DocumentQueryHelper::handle_pdf_document: Temporary file not found: {temp_file_path}"
-            )
-
-        try:
-            try:
-                loader = PyMuPDFLoader(
-                    temp_file_path,
-                    mode="single",
-                    extract_tables="markdown",
-                    extract_images=True,
-                    images_inner_format="text",
-                    images_parser=TesseractBlobParser(),
-                    pages_delimiter="\n",
-                )
-                elements: list[Document] = loader.load()
-                contents = "\n".join([element.page_content for element in elements])
-            except Exception as e:
-                PrintStyle.error(
-                    f"DocumentQueryHelper::handle_pdf_document: Error loading with PyMuPDF: {e}"
-                )
-                contents = ""
-
-            if not contents:
-                import pdf2image
-                import pytesseract
-
-                PrintStyle.debug(
-                    f"DocumentQueryHelper::handle_pdf_document: FALLBACK Converting PDF to images: {temp_file_path}"
-                )
-
-                # Convert PDF to images
-                pages = pdf2image.convert_from_path(temp_file_path)  # type: ignore
-                for page in pages:
-                    contents += pytesseract.image_to_string(page) + "\n\n"
-
-            return contents
-        finally:
-            os.unlink(temp_file_path)
+        set = settings.get_settings()
+        cache = PdfPageCache.get(set["memory_document_fetch_cache_mb"] * 1024 * 1024)
+        total = await asyncio.to_thread(pdf_extract.page_count, document)
+        done = 0
+        async for number, text in pdf_extract.extract_pages(
+            document, set["memory_document_pdf_workers"], cache
+        ):
+            done += 1
+            if done == total or done % PROGRESS_PAGES == 0:
+                self.progress_callback(f"Extracted {done}/{total} pages")
+            yield number, text
 
     def handle_unstructured_document(self, document: str, scheme: str) -> str:
         elements: list[Document] = []
-        if scheme in ["http", "https"]:
-            # loader = UnstructuredURLLoader(urls=[document], mode="single")
-            loader = UnstructuredLoader(
-                web_url=document,
-                mode="single",
-                partition_via_api=False,
-                # chunking_strategy="by_page",
-                strategy="hi_res",
-            )
-            elements = loader.load()
-        elif scheme == "file":
+        if scheme == "file":
             # Use RFC file operations to read the file as binary
             file_content_bytes = files.read_file_bin(document)
             # Create a temporary file for UnstructuredLoader since it needs a file path
@@ -0,0 +1,217 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Iterator, Sequence
+
+import numpy as np
+from langchain_core.stores import BaseStore
+
+from python.helpers.print_style import PrintStyle
+
+CACHE_FILE = "cache.sqlite"
+NAMESPACE_UUID = uuid.UUID(int=1985)  # same as langchain's CacheBackedEmbeddings, keeps legacy keys valid
+MIGRATION_BATCH = 1000
+EVICTION_TARGET = 0.9  # evict down to this fraction of the size limit
+
+
+class EmbeddingCache:
+    """
+    Embedding cache in a single SQLite file.
+    Vectors are stored as raw float32 blobs, least recently used entries are evicted above the size limit.
+    """
+
+    _instances: dict[str, "EmbeddingCache"] = {}
+    _instances_lock = threading.Lock()
+
+    @staticmethod
+    def get(cache_dir: str, max_bytes: int) -> "EmbeddingCache":
+        path = os.path.join(cache_dir, CACHE_FILE)
+        with EmbeddingCache._instances_lock:
+            cache = EmbeddingCache._instances.get(path)
+            if cache is None:
+                cache = EmbeddingCache(path, max_bytes)
+                cache.migrate_file_store(cache_dir)
+                EmbeddingCache._instances[path] = cache
+            cache.max_bytes = max_bytes
+        return cache
+
+    def __init__(self, path: str, max_bytes: int = 0):
+        self.path = path
+        self.max_bytes = max_bytes  # 0 = unlimited
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            """CREATE TABLE IF NOT EXISTS embeddings (
+                key TEXT PRIMARY KEY,
+                vector BLOB NOT NULL,
+                accessed REAL NOT NULL
+            )"""
+        )
+        self.conn.execute(
+            "CREATE INDEX IF NOT EXISTS embeddings_accessed ON embeddings (accessed)"
+        )
+        self.total_bytes = self.conn.execute(
+            "SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings"
+        ).fetchone()[0]
+
+    def mget(self, keys: Sequence[str]) -> list[np.ndarray | None]:
+        if not keys:
+            return []
+        found: dict[str, bytes] = {}
+        with self.lock:
+            for chunk in _chunks(list(dict.fromkeys(keys)), 500):
+                rows = self.conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({_placeholders(chunk)})",
+                    chunk,
+                ).fetchall()
+                found.update(rows)
+            if found:
+                # refresh access time for LRU eviction
+                now = time.time()
+                self.conn.executemany(
+                    "UPDATE embeddings SET accessed = ? WHERE key = ?",
+                    [(now, key) for key in found],
+                )
+        return [
+            np.frombuffer(found[key], dtype=np.float32) if key in found else None
+            for key in keys
+        ]
+
+    def mset(self, items: Sequence[tuple[str, Sequence[float] | np.ndarray]]):
+        if not items:
+            return
+        now = time.time()
+        rows = [
+            (key, np.asarray(vector, dtype=np.float32).tobytes(), now)
+            for key, vector in items
+        ]
+        with self.lock:
+            self.conn.execute("BEGIN")
+            try:
+                old_bytes = self._sizes([key for key, _, _ in rows])
+                self.conn.executemany(
+                    "INSERT OR REPLACE INTO embeddings (key, vector, accessed) VALUES (?, ?, ?)",
+                    rows,
+                )
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+            self.total_bytes += sum(len(blob) for _, blob, _ in rows) - old_bytes
+            if self.max_bytes and self.total_bytes > self.max_bytes:
+                self._evict(int(self.max_bytes * EVICTION_TARGET))
+
+    def mdelete(self, keys: Sequence[str]):
+        with self.lock:
+            for chunk in _chunks(list(keys), 500):
+                self.total_bytes -= self._sizes(chunk)
+                self.conn.execute(
+                    f"DELETE FROM embeddings WHERE key IN ({_placeholders(chunk)})", chunk
+                )
+
+    def yield_keys(self, prefix: str | None = None) -> Iterator[str]:
+        with self.lock:
+            if prefix:
+                rows = self.conn.execute(
+                    "SELECT key FROM embeddings WHERE substr(key, 1, ?) = ?",
+                    (len(prefix), prefix),
+                ).fetchall()
+            else:
+                rows = self.conn.execute("SELECT key FROM embeddings").fetchall()
+        for (key,) in rows:
+            yield key
+
+    def _sizes(self, keys: list[str]) -> int:
+        total = 0
+        for chunk in _chunks(keys, 500):
+            total += self.conn.execute(
+                f"SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings WHERE key IN ({_placeholders(chunk)})",
+                chunk,
+            ).fetchone()[0]
+        return total
+
+    def _evict(self, target_bytes: int):
+        # drop least recently used entries until the cache fits the target size
+        removed = 0
+        cursor = self.conn.execute(
+            "SELECT key, LENGTH(vector) FROM embeddings ORDER BY accessed"
+        )
+        keys = []
+        for key, size in cursor:
+            if self.total_bytes - removed <= target_bytes:
+                break
+            keys.append(key)
+            removed += size
+        cursor.close()
+        for chunk in _chunks(keys, 500):
+            self.conn.execute(
+                f"DELETE FROM embeddings WHERE key IN ({_placeholders(chunk)})", chunk
+            )
+        self.total_bytes -= removed
+
+    def migrate_file_store(self, cache_dir: str):
+        """One-time import of a LocalFileStore cache (one JSON file per embedding) into the database."""
+        names = [
+            name
+            for name in os.listdir(cache_dir)
+            if not name.startswith(CACHE_FILE) and os.path.isfile(os.path.join(cache_dir, name))
+        ]
+        if not names:
+            return
+        PrintStyle.standard(f"Migrating {len(names)} cached embeddings to {CACHE_FILE}...")
+        for chunk in _chunks(names, MIGRATION_BATCH):
+            items = []
+            for name in chunk:
+                try:
+                    with open(os.path.join(cache_dir, name), "rb") as f:
+                        items.append((name, json.loads(f.read())))
+                except (OSError, ValueError):
+                    pass  # unreadable entries are just not migrated
+            self.mset(items)
+            for name in chunk:
+                try:
+                    os.remove(os.path.join(cache_dir, name))
+                except OSError:
+                    pass
+
+
+class EmbeddingCacheStore(BaseStore[str, list[float]]):
+    """Document embedding store for CacheBackedEmbeddings, keyed by text within a model namespace."""
+
+    def __init__(self, cache: EmbeddingCache, namespace: str):
+        self.cache = cache
+        self.namespace = namespace
+
+    def encode_key(self, text: str) -> str:
+        # same key format as the previous LocalFileStore cache so migrated entries are reused
+        sha1_hex = hashlib.sha1(text.encode("utf-8")).hexdigest()
+        return f"{self.namespace}{uuid.uuid5(NAMESPACE_UUID, sha1_hex)}"
+
+    def mget(self, keys: Sequence[str]) -> list[list[float] | None]:
+        vectors = self.cache.mget([self.encode_key(key) for key in keys])
+        return [vector.tolist() if vector is not None else None for vector in vectors]
+
+    def mset(self, key_value_pairs: Sequence[tuple[str, list[float]]]) -> None:
+        self.cache.mset([(self.encode_key(key), value) for key, value in key_value_pairs])
+
+    def mdelete(self, keys: Sequence[str]) -> None:
+        self.cache.mdelete([self.encode_key(key) for key in keys])
+
+    def yield_keys(self, *, prefix: str | None = None) -> Iterator[str]:
+        # texts are not stored, only their hashed keys
+        yield from self.cache.yield_keys(self.namespace + (prefix or ""))
+
+
+def _chunks(items: list, size: int) -> Iterator[list]:
+    for i in range(0, len(items), size):
+        yield items[i : i + size]
+
+
+def _placeholders(items: list) -> str:
+    return ",".join("?" * len(items))
@@ -70,7 +70,7 @@ def load_plugin_variables(file: str, backup_dirs: list[str] | None = None) -> di
         #         return cls[1]().get_variables()  # type: ignore
     return {}
 
-from python.helpers.strings import sanitize_string
+from python.helpers import strings
 
 
 def parse_file(_filename: str, _directories: list[str] | None = None, _encoding="utf-8", **kwargs):
@@ -288,7 +288,7 @@ def is_full_json_template(text):
 def write_file(relative_path: str, content: str, encoding: str = "utf-8"):
     abs_path = get_abs_path(relative_path)
     os.makedirs(os.path.dirname(abs_path), exist_ok=True)
-    content = sanitize_string(content, encoding)
+    content = strings.sanitize_string(content, encoding)
     with open(abs_path, "w", encoding=encoding) as f:
         f.write(content)
 
@@ -41,12 +41,34 @@ class OutputMessage(TypedDict):
 
 class Record:
     def __init__(self):
-        pass
+        self.parent: "Record | None" = None
+        self._summary: str = ""
+        self._tokens: int | None = None  # cached token count, None when stale
+
+    @property
+    def summary(self) -> str:
+        return self._summary
+
+    @summary.setter
+    def summary(self, summary: str):
+        self._summary = summary
+        self.invalidate_tokens()
 
-    @abstractmethod
     def get_tokens(self) -> int:
+        if self._tokens is None:
+            self._tokens = self.calculate_tokens()
+        return self._tokens
+
+    @abstractmethod
+    def calculate_tokens(self) -> int:
         pass
 
+    def invalidate_tokens(self, child: "Record | None" = None):
+        """Drop the cached token count of this record and its ancestors, called on every change."""
+        self._tokens = None
+        if self.parent:
+            self.parent.invalidate_tokens(self)
+
     @abstractmethod
     async def compress(self) -> bool:
         pass
@@ -77,15 +99,10 @@ class Record:
 
 class Message(Record):
     def __init__(self, ai: bool, content: MessageContent, tokens: int = 0):
+        super().__init__()
         self.ai = ai
         self.content = content
-        self.summary: str = ""
-        self.tokens: int = tokens or self.calculate_tokens()
-
-    def get_tokens(self) -> int:
-        if not self.tokens:
-            self.tokens = self.calculate_tokens()
-        return self.tokens
+        self._tokens = tokens or None
 
     def calculate_tokens(self):
         text = self.output_text()
@@ -93,7 +110,6 @@ class Message(Record):
 
     def set_summary(self, summary: str):
         self.summary = summary
-        self.tokens = self.calculate_tokens()
 
     async def compress(self):
         return False
@@ -113,25 +129,25 @@ class Message(Record):
             "ai": self.ai,
             "content": self.content,
             "summary": self.summary,
-            "tokens": self.tokens,
+            "tokens": self.get_tokens(),
         }
 
     @staticmethod
     def from_dict(data: dict, history: "History"):
         content = data.get("content", "Content lost")
-        msg = Message(ai=data["ai"], content=content)
-        msg.summary = data.get("summary", "")
-        msg.tokens = data.get("tokens", 0)
+        msg = Message(ai=data["ai"], content=content, tokens=data.get("tokens", 0))
+        msg._summary = data.get("summary", "")
         return msg
 
 
 class Topic(Record):
     def __init__(self, history: "History"):
+        super().__init__()
         self.history = history
-        self.summary: str = ""
+        self.parent = history
         self.messages: list[Message] = []
 
-    def get_tokens(self):
+    def calculate_tokens(self):
         if self.summary:
             return tokens.approximate_tokens(self.summary)
         else:
@@ -141,7 +157,9 @@ class Topic(Record):
         self, ai: bool, content: MessageContent, tokens: int = 0
     ) -> Message:
         msg = Message(ai=ai, content=content, tokens=tokens)
+        msg.parent = self
         self.messages.append(msg)
+        self.invalidate_tokens()
         return msg
 
     def output(self) -> list[OutputMessage]:
@@ -210,7 +228,9 @@ class Topic(Record):
                 "fw.msg_summary.md", summary=summary
             )
             sum_msg = Message(False, sum_msg_content)
+            sum_msg.parent = self
             self.messages[1 : cnt_to_sum + 1] = [sum_msg]
+            self.invalidate_tokens()
             return True
         return False
 
@@ -236,24 +256,31 @@ class Topic(Record):
     def from_dict(data: dict, history: "History"):
         topic = Topic(history=history)
         topic.summary = data.get("summary", "")
-        topic.messages = [
-            Message.from_dict(m, history=history) for m in data.get("messages", [])
-        ]
+        for m in data.get("messages", []):
+            msg = Message.from_dict(m, history=history)
+            msg.parent = topic
+            topic.messages.append(msg)
         return topic
 
 
 class Bulk(Record):
     def __init__(self, history: "History"):
+        super().__init__()
         self.history = history
-        self.summary: str = ""
+        self.parent = history
         self.records: list[Record] = []
 
-    def get_tokens(self):
+    def calculate_tokens(self):
         if self.summary:
             return tokens.approximate_tokens(self.summary)
         else:
             return sum([r.get_tokens() for r in self.records])
 
+    def add_record(self, record: Record):
+        record.parent = self
+        self.records.append(record)
+        self.invalidate_tokens()
+
     def output(
         self, human_label: str = "user", ai_label: str = "ai"
     ) -> list[OutputMessage]:
@@ -286,8 +313,8 @@ class Bulk(Record):
     def from_dict(data: dict, history: "History"):
         bulk = Bulk(history=history)
         bulk.summary = data["summary"]
-        cls = data["_cls"]
-        bulk.records = [Record.from_dict(r, history=history) for r in data["records"]]
+        for r in data["records"]:
+            bulk.add_record(Record.from_dict(r, history=history))
         return bulk
 
 
@@ -295,11 +322,15 @@ class History(Record):
     def __init__(self, agent):
         from agent import Agent
 
+        super().__init__()
         self.counter = 0
         self.bulks: list[Bulk] = []
         self.topics: list[Topic] = []
         self.current = Topic(history=self)
         self.agent: Agent = agent
+        # cached sums of the bulks and past topics, the current topic caches its own count
+        self._bulks_tokens: int | None = None
+        self._topics_tokens: int | None = None
 
     def get_tokens(self) -> int:
         return (
@@ -308,16 +339,27 @@ class History(Record):
             + self.get_current_topic_tokens()
         )
 
+    def invalidate_tokens(self, child: Record | None = None):
+        # a change in the current topic leaves the sums of bulks and past topics valid
+        if child is None or isinstance(child, Bulk):
+            self._bulks_tokens = None
+        if child is None or (isinstance(child, Topic) and child is not self.current):
+            self._topics_tokens = None
+
     def is_over_limit(self):
         limit = _get_ctx_size_for_history()
         total = self.get_tokens()
         return total > limit
 
     def get_bulks_tokens(self) -> int:
-        return sum(record.get_tokens() for record in self.bulks)
+        if self._bulks_tokens is None:
+            self._bulks_tokens = sum(record.get_tokens() for record in self.bulks)
+        return self._bulks_tokens
 
     def get_topics_tokens(self) -> int:
-        return sum(record.get_tokens() for record in self.topics)
+        if self._topics_tokens is None:
+            self._topics_tokens = sum(record.get_tokens() for record in self.topics)
+        return self._topics_tokens
 
     def get_current_topic_tokens(self) -> int:
         return self.current.get_tokens()
@@ -332,6 +374,7 @@ class History(Record):
         if self.current.messages:
             self.topics.append(self.current)
             self.current = Topic(history=self)
+            self.invalidate_tokens()
 
     def output(self) -> list[OutputMessage]:
         result: list[OutputMessage] = []
@@ -346,6 +389,7 @@ class History(Record):
         history.bulks = [Bulk.from_dict(b, history=history) for b in data["bulks"]]
         history.topics = [Topic.from_dict(t, history=history) for t in data["topics"]]
         history.current = Topic.from_dict(data["current"], history=history)
+        history.invalidate_tokens()
         return history
 
     def to_dict(self):
@@ -405,13 +449,14 @@ class History(Record):
         # move oldest topic to bulks and summarize
         for topic in self.topics:
             bulk = Bulk(history=self)
-            bulk.records.append(topic)
+            bulk.add_record(topic)
             if topic.summary:
                 bulk.summary = topic.summary
             else:
                 await bulk.summarize()
             self.bulks.append(bulk)
             self.topics.remove(topic)
+            self.invalidate_tokens()
             return True
         return False
 
@@ -421,6 +466,7 @@ class History(Record):
         # remove oldest bulk if necessary
         if not compressed:
             self.bulks.pop(0)
+            self.invalidate_tokens()
             return True
         return compressed
 
@@ -436,11 +482,13 @@ class History(Record):
             ]
         )
         self.bulks = bulks
+        self.invalidate_tokens()
         return True
 
     async def merge_bulks(self, bulks: list[Bulk]) -> Bulk:
         bulk = Bulk(history=self)
-        bulk.records = cast(list[Record], bulks)
+        for b in bulks:
+            bulk.add_record(b)
         await bulk.summarize()
         return bulk
 
@@ -31,6 +31,10 @@ async def run_loop():
                 await scheduler_tick()
             except Exception as e:
                 PrintStyle().error(errors.format_error(e))
+            try:
+                await memory_maintenance_tick()
+            except Exception as e:
+                PrintStyle().error(errors.format_error(e))
         await asyncio.sleep(SLEEP_TIME)  # TODO! - if we lower it under 1min, it can run a 5min job multiple times in it's target minute
 
 
@@ -41,6 +45,12 @@ async def scheduler_tick():
     await scheduler.tick()
 
 
+async def memory_maintenance_tick():
+    # imported here, memory pulls in the agent and models
+    from python.helpers.memory import Memory
+    await Memory.run_maintenance()
+
+
 def pause_loop():
     global keep_running, pause_time
     keep_running = False
@@ -1,33 +1,67 @@
+import asyncio
+import fnmatch
 import glob
+import multiprocessing
 import os
 import hashlib
-from typing import Any, Dict, Literal, TypedDict
+import json
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, AsyncIterator, Callable, Dict, Literal, TypedDict
+import xxhash
 from langchain_community.document_loaders import (
     CSVLoader,
     PyPDFLoader,
     TextLoader,
     UnstructuredHTMLLoader,
 )
+from langchain_core.documents import Document
 from python.helpers.log import LogItem
 from python.helpers.print_style import PrintStyle
 
 text_loader_kwargs = {"autodetect_encoding": True}
 
+# Mapping file extensions to corresponding loader classes
+# Note: Using TextLoader for JSON and MD to avoid parsing issues with consolidation
+file_types_loaders = {
+    "txt": TextLoader,
+    "pdf": PyPDFLoader,
+    "csv": CSVLoader,
+    "html": UnstructuredHTMLLoader,
+    "json": TextLoader,  # Use TextLoader for better consolidation compatibility
+    "md": TextLoader,    # Use TextLoader for better consolidation compatibility
+}
+
+INSERT_BATCH_DOCS = 1000  # parsed chunks collected before they are embedded and inserted
+HASH_BLOCK_SIZE = 1024 * 1024
+CHECKSUM_PREFIX = "xxh3:"  # distinguishes current checksums from the md5 ones of older indexes
+
 
 class KnowledgeImport(TypedDict):
     file: str
     checksum: str
+    size: int  # file size and modification time at the last check, the file is only hashed when they change
+    mtime_ns: int
     ids: list[str]
+    chunks: list[str]  # content hash of each chunk, aligned with ids
     state: Literal["changed", "original", "removed"]
     documents: list[Any]
+    metadata: dict[str, Any]  # applied to the documents of a changed file once it is parsed
 
 
-def calculate_checksum(file_path: str) -> str:
-    hasher = hashlib.md5()
+def calculate_checksum(file_path: str, legacy: bool = False) -> tuple[str, str | None]:
+    """
+    Fast non-cryptographic checksum of a file read in blocks.
+    With legacy=True the md5 of older indexes is computed in the same pass, otherwise it is None.
+    """
+    hasher = xxhash.xxh3_128()
+    md5 = hashlib.md5() if legacy else None
     with open(file_path, "rb") as f:
-        buf = f.read()
-        hasher.update(buf)
-    return hasher.hexdigest()
+        while block := f.read(HASH_BLOCK_SIZE):
+            hasher.update(block)
+            if md5:
+                md5.update(block)
+    return CHECKSUM_PREFIX + hasher.hexdigest(), md5.hexdigest() if md5 else None
 
 
 def load_knowledge(
@@ -36,27 +70,18 @@ def load_knowledge(
     index: Dict[str, KnowledgeImport],
     metadata: dict[str, Any] = {},
     filename_pattern: str = "**/*",
+    paths: set[str] | None = None,
 ) -> Dict[str, KnowledgeImport]:
     """
-    Load knowledge files from a directory with change detection and metadata enhancement.
+    Scan knowledge files in a directory with change detection and metadata enhancement.
 
-    This function now includes enhanced error handling and compatibility with the
-    intelligent memory consolidation system.
+    Changed files are only marked here, their documents are loaded by parse_files
+    so that parsing can run in parallel worker processes.
+    When paths are given (files or folders reported by the watcher), only those are checked
+    and only index entries below them can be marked as removed.
     """
 
-    # Mapping file extensions to corresponding loader classes
-    # Note: Using TextLoader for JSON and MD to avoid parsing issues with consolidation
-    file_types_loaders = {
-        "txt": TextLoader,
-        "pdf": PyPDFLoader,
-        "csv": CSVLoader,
-        "html": UnstructuredHTMLLoader,
-        "json": TextLoader,  # Use TextLoader for better consolidation compatibility
-        "md": TextLoader,    # Use TextLoader for better consolidation compatibility
-    }
-
     cnt_files = 0
-    cnt_docs = 0
 
     # Validate and create knowledge directory if needed
     if not knowledge_dir:
@@ -96,7 +121,10 @@ def load_knowledge(
 
     # Fetch all files in the directory with specified extensions
     try:
-        kn_files = glob.glob(os.path.join(knowledge_dir, filename_pattern), recursive=True)
+        if paths is None:
+            kn_files = glob.glob(os.path.join(knowledge_dir, filename_pattern), recursive=True)
+        else:
+            kn_files = _expand_paths(knowledge_dir, filename_pattern, paths)
         kn_files = [f for f in kn_files if os.path.isfile(f) and not os.path.basename(f).startswith('.')]
     except Exception as e:
         PrintStyle(font_color="red").print(f"Error scanning knowledge directory {knowledge_dir}: {e}")
@@ -124,66 +152,55 @@ def load_knowledge(
             if ext not in file_types_loaders:
                 continue  # Skip unsupported file types
 
-            checksum = calculate_checksum(file_path)
-            if not checksum:
-                continue  # Skip files with checksum errors
-
             file_key = file_path
 
             # Load existing data from the index or create a new entry
             file_data: KnowledgeImport = index.get(file_key, {
                 "file": file_key,
                 "checksum": "",
+                "size": -1,
+                "mtime_ns": -1,
                 "ids": [],
+                "chunks": [],
                 "state": "changed",
-                "documents": []
+                "documents": [],
+                "metadata": {},
             })
 
-            # Check if file has changed
-            if file_data.get("checksum") == checksum:
+            # Check if file has changed, hash only when its size or modification time differ
+            stat = os.stat(file_path)
+            if (
+                file_data.get("checksum")
+                and file_data.get("size") == stat.st_size
+                and file_data.get("mtime_ns") == stat.st_mtime_ns
+            ):
                 file_data["state"] = "original"
             else:
-                file_data["state"] = "changed"
-
-            # Process changed files
+                previous = file_data.get("checksum", "")
+                legacy = bool(previous) and not previous.startswith(CHECKSUM_PREFIX)
+                checksum, legacy_checksum = calculate_checksum(file_path, legacy)
+                file_data["size"] = stat.st_size
+                file_data["mtime_ns"] = stat.st_mtime_ns
+                if previous in (checksum, legacy_checksum):
+                    file_data["state"] = "original"
+                    file_data["checksum"] = checksum
+                else:
+                    file_data["state"] = "changed"
+
+            # Changed files are parsed later by parse_files
             if file_data["state"] == "changed":
                 file_data["checksum"] = checksum
-                loader_cls = file_types_loaders[ext]
-
-                try:
-                    loader = loader_cls(
-                        file_path,
-                        **(
-                            text_loader_kwargs
-                            if ext in ["txt", "csv", "html", "md"]
-                            else {}
-                        ),
-                    )
-                    documents = loader.load_and_split()
-
-                    # Enhanced metadata for better consolidation compatibility
-                    enhanced_metadata = {
-                        **metadata,
-                        "source_file": os.path.basename(file_path),
-                        "source_path": file_path,
-                        "file_type": ext,
-                        "knowledge_source": True,  # Flag to distinguish from conversation memories
-                        "import_timestamp": None,  # Will be set when inserted into memory
-                    }
-
-                    # Apply metadata to all documents
-                    for doc in documents:
-                        doc.metadata = {**doc.metadata, **enhanced_metadata}
-
-                    file_data["documents"] = documents
-                    cnt_files += 1
-                    cnt_docs += len(documents)
-
-                except Exception as e:
-                    PrintStyle(font_color="red").print(f"Error loading {file_path}: {e}")
-                    if log_item:
-                        log_item.stream(progress=f"\nError loading {os.path.basename(file_path)}: {e}")
-                    continue
+                file_data["documents"] = []
+                # Enhanced metadata for better consolidation compatibility
+                file_data["metadata"] = {
+                    **metadata,
+                    "source_file": os.path.basename(file_path),
+                    "source_path": file_path,
+                    "file_type": ext,
+                    "knowledge_source": True,  # Flag to distinguish from conversation memories
+                    "import_timestamp": None,  # Will be set when inserted into memory
+                }
+                cnt_files += 1
 
             # Update the index
             index[file_key] = file_data
@@ -196,14 +213,138 @@ def load_knowledge(
     current_files = set(kn_files)
     for file_key, file_data in list(index.items()):
         if file_key not in current_files and not file_data.get("state"):
-            index[file_key]["state"] = "removed"
+            if paths is None or _is_below(file_key, paths):
+                index[file_key]["state"] = "removed"
 
     # Log results
-    if cnt_files > 0 or cnt_docs > 0:
-        PrintStyle.standard(f"Processed {cnt_docs} documents from {cnt_files} files.")
+    if cnt_files > 0:
+        PrintStyle.standard(f"Found {cnt_files} new or changed files.")
         if log_item:
-            log_item.stream(
-                progress=f"\nProcessed {cnt_docs} documents from {cnt_files} files."
-            )
+            log_item.stream(progress=f"\nFound {cnt_files} new or changed files.")
 
     return index
+
+
+def _expand_paths(knowledge_dir: str, filename_pattern: str, paths: set[str]) -> list[str]:
+    # changed paths inside the directory, folders are expanded to the files matching the pattern
+    root = os.path.join(knowledge_dir, "")
+    name_pattern = filename_pattern.split("/")[-1]
+    result: set[str] = set()  # nested folders and their files are often reported together
+    for path in paths:
+        if not (path + os.sep).startswith(root):
+            continue
+        if os.path.isdir(path):
+            result.update(glob.glob(os.path.join(path, "**", name_pattern), recursive=True))
+        elif fnmatch.fnmatch(os.path.basename(path), name_pattern):
+            result.add(path)
+    return sorted(result)
+
+
+def _is_below(file_path: str, paths: set[str]) -> bool:
+    return any(file_path == path or file_path.startswith(path + os.sep) for path in paths)
+
+
+def load_file(file_path: str, metadata: dict[str, Any]) -> list[Document]:
+    """Load and split one knowledge file, runs in a worker process."""
+    ext = os.path.basename(file_path).split(".")[-1].lower()
+    loader = file_types_loaders[ext](
+        file_path,
+        **(text_loader_kwargs if ext in ["txt", "csv", "html", "md"] else {}),
+    )
+    documents = loader.load_and_split()
+    # Apply metadata to all documents
+    for doc in documents:
+        doc.metadata = {**doc.metadata, **metadata}
+    return documents
+
+
+def chunk_hash(doc: Document) -> str:
+    """Hash of a chunk's text and metadata before it is inserted."""
+    data = json.dumps([doc.page_content, doc.metadata], sort_keys=True, default=str)
+    return xxhash.xxh3_128_hexdigest(data.encode("utf-8"))
+
+
+def match_chunks(
+    entry: KnowledgeImport, hashes: list[str], exists: Callable[[str], bool]
+) -> tuple[list[str | None], list[str]]:
+    """
+    Match the chunks of a re-parsed file to its stored ones by content hash.
+    Returns the reused id of each chunk (None for chunks to insert) and the ids of vanished chunks.
+    Entries of older indexes without chunk hashes match nothing.
+    """
+    old_ids = entry.get("ids", [])
+    old_hashes = entry.get("chunks", [])
+    if len(old_hashes) != len(old_ids):
+        return [None] * len(hashes), list(old_ids)
+    available: dict[str, list[str]] = {}
+    for id, hash in zip(old_ids, old_hashes):
+        if exists(id):  # chunks deleted from memory meanwhile are inserted again
+            available.setdefault(hash, []).append(id)
+    matched = [available[hash].pop(0) if available.get(hash) else None for hash in hashes]
+    kept = set(id for id in matched if id)
+    return matched, [id for id in old_ids if id not in kept]
+
+
+async def parse_files(
+    log_item: LogItem | None,
+    entries: list[KnowledgeImport],
+    workers: int,
+) -> AsyncIterator[tuple[KnowledgeImport, list[Document] | None]]:
+    """
+    Load changed files in a bounded process pool and yield (entry, documents) as files complete.
+    Documents are None when a file could not be loaded.
+    """
+    if not entries:
+        return
+    executor = create_executor(min(workers, len(entries)))
+    fallback: Executor | None = None
+    try:
+        loop = asyncio.get_running_loop()
+        futures = {
+            loop.run_in_executor(executor, load_file, entry["file"], entry["metadata"]): entry
+            for entry in entries
+        }
+        done = 0
+        pending = set(futures)
+        while pending:
+            finished, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for future in finished:
+                entry = futures.pop(future)
+                name = os.path.basename(entry["file"])
+                try:
+                    documents = future.result()
+                except BrokenProcessPool:
+                    # workers could not start or crashed, parse the remaining files in a thread
+                    if not fallback:
+                        PrintStyle.warning("Knowledge import workers failed, parsing in a thread")
+                        fallback = ThreadPoolExecutor(max_workers=1)
+                    retry = loop.run_in_executor(fallback, load_file, entry["file"], entry["metadata"])
+                    futures[retry] = entry
+                    pending.add(retry)
+                    continue
+                except Exception as e:
+                    done += 1
+                    PrintStyle(font_color="red").print(f"Error loading {entry['file']}: {e}")
+                    if log_item:
+                        log_item.stream(progress=f"\nError loading {name}: {e}")
+                    yield entry, None
+                    continue
+                done += 1
+                message = f"Loaded {name}: {len(documents)} chunks ({done}/{len(entries)})"
+                PrintStyle.standard(message)
+                if log_item:
+                    log_item.stream(progress=f"\n{message}")
+                yield entry, documents
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+        if fallback:
+            fallback.shutdown(wait=False, cancel_futures=True)
+
+
+def create_executor(workers: int) -> Executor:
+    if workers <= 1:
+        return ThreadPoolExecutor(max_workers=1)
+    # spawn instead of fork, forking a process with running threads can deadlock the children
+    return ProcessPoolExecutor(
+        max_workers=workers, mp_context=multiprocessing.get_context("spawn")
+    )
@@ -0,0 +1,129 @@
+import json
+import os
+import sqlite3
+import threading
+from typing import Iterable
+
+from python.helpers.knowledge_import import KnowledgeImport
+from python.helpers.print_style import PrintStyle
+
+INDEX_FILE = "knowledge_import.sqlite"
+LEGACY_FILE = "knowledge_import.json"
+
+
+class KnowledgeImportIndex:
+    """
+    Imported knowledge files of a memory subdir in a SQLite table keyed by path.
+    Change detection only reads checksums and stat fields, chunk ids are loaded for changed files only.
+    Every file is written in its own transaction, so concurrent importers can update single rows.
+    """
+
+    def __init__(self, db_dir: str):
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(
+            os.path.join(db_dir, INDEX_FILE), check_same_thread=False, isolation_level=None
+        )
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            """CREATE TABLE IF NOT EXISTS files (
+                path TEXT PRIMARY KEY,
+                checksum TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                ids TEXT NOT NULL,
+                chunks TEXT NOT NULL
+            )"""
+        )
+        self._migrate(os.path.join(db_dir, LEGACY_FILE))
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    def entries(self, paths: Iterable[str] | None = None) -> dict[str, KnowledgeImport]:
+        """Entries without chunk ids, all of them or those at or below the given paths."""
+        sql = "SELECT path, checksum, size, mtime_ns FROM files"
+        with self.lock:
+            if paths is None:
+                rows = self.conn.execute(sql).fetchall()
+            else:
+                rows = []
+                for path in set(paths):
+                    # the file itself and a primary key range for everything below a folder
+                    rows.extend(
+                        self.conn.execute(
+                            f"{sql} WHERE path = ? OR (path >= ? AND path < ?)",
+                            (path, path + os.sep, path + chr(ord(os.sep) + 1)),
+                        )
+                    )
+        return {
+            path: {"file": path, "checksum": checksum, "size": size, "mtime_ns": mtime_ns}  # type: ignore
+            for path, checksum, size, mtime_ns in rows
+        }
+
+    def load_chunks(self, entries: Iterable[KnowledgeImport]):
+        """Fill in ids and chunk hashes of the given entries."""
+        with self.lock:
+            for entry in entries:
+                row = self.conn.execute(
+                    "SELECT ids, chunks FROM files WHERE path = ?", (entry["file"],)
+                ).fetchone()
+                entry["ids"] = json.loads(row[0]) if row else []
+                entry["chunks"] = json.loads(row[1]) if row else []
+
+    def put(self, entry: KnowledgeImport):
+        self._execute(
+            """INSERT OR REPLACE INTO files (path, checksum, size, mtime_ns, ids, chunks)
+            VALUES (?, ?, ?, ?, ?, ?)""",
+            [_row(entry)],
+        )
+
+    def update_stat(self, entry: KnowledgeImport):
+        """Store the checksum and stat fields of an unchanged file, its chunks stay as they are."""
+        self._execute(
+            "UPDATE files SET checksum = ?, size = ?, mtime_ns = ? WHERE path = ?",
+            [(entry["checksum"], entry.get("size", -1), entry.get("mtime_ns", -1), entry["file"])],
+        )
+
+    def delete(self, paths: Iterable[str]):
+        self._execute("DELETE FROM files WHERE path = ?", [(path,) for path in paths])
+
+    def _execute(self, sql: str, rows: list[tuple]):
+        if not rows:
+            return
+        with self.lock:
+            self.conn.execute("BEGIN")
+            try:
+                self.conn.executemany(sql, rows)
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+
+    def _migrate(self, legacy_path: str):
+        # one-time import of the JSON index used by older versions
+        if not os.path.exists(legacy_path):
+            return
+        try:
+            with open(legacy_path, "r") as f:
+                legacy: dict[str, KnowledgeImport] = json.load(f)
+        except (OSError, ValueError) as e:
+            PrintStyle.error(f"Could not read {legacy_path}, knowledge will be imported again: {e}")
+            legacy = {}
+        self._execute(
+            """INSERT OR IGNORE INTO files (path, checksum, size, mtime_ns, ids, chunks)
+            VALUES (?, ?, ?, ?, ?, ?)""",
+            [_row({**entry, "file": path}) for path, entry in legacy.items()],  # type: ignore
+        )
+        os.remove(legacy_path)
+
+
+def _row(entry: KnowledgeImport) -> tuple:
+    return (
+        entry["file"],
+        entry.get("checksum", ""),
+        entry.get("size", -1),
+        entry.get("mtime_ns", -1),
+        json.dumps(entry.get("ids", [])),
+        json.dumps(entry.get("chunks", [])),
+    )
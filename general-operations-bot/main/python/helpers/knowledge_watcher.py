@@ -0,0 +1,222 @@
+import asyncio
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import time
+from typing import Awaitable, Callable
+
+from python.helpers.defer import DeferredTask
+from python.helpers.print_style import PrintStyle
+
+DEBOUNCE = 2.0  # seconds without new events before changes are imported
+POLL_INTERVAL = 5.0  # seconds between scans when inotify is not available
+READ_TIMEOUT = 1.0
+
+# inotify event masks, see inotify(7)
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+WATCH_MASK = (
+    IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF
+)
+EVENT_HEADER = struct.Struct("iIII")
+
+
+class KnowledgeWatcher:
+    """
+    Watches knowledge folders and reports changed paths in debounced batches.
+    Uses inotify on Linux and falls back to periodic stat scans elsewhere
+    or when the inotify watch limit is reached.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        roots: list[str],
+        on_change: Callable[[set[str]], Awaitable[None]],
+        debounce: float = DEBOUNCE,
+    ):
+        self.roots = sorted(set(roots))
+        self.on_change = on_change
+        self.debounce = debounce
+        self.stopped = False
+        self.task: DeferredTask | None = None
+        self.thread_name = f"KnowledgeWatcher-{name}"
+
+    def start(self) -> "KnowledgeWatcher":
+        # keep a reference, the task is cancelled when garbage collected
+        self.task = DeferredTask(thread_name=self.thread_name).start_task(self._run)
+        return self
+
+    def stop(self):
+        self.stopped = True
+        if self.task:
+            self.task.kill()
+
+    async def _run(self):
+        backend = _create_backend(self.roots)
+        pending: set[str] = set()
+        last_event = 0.0
+        try:
+            while not self.stopped:
+                changed = await asyncio.to_thread(backend.read, READ_TIMEOUT)
+                changed = {path for path in changed if _is_relevant(path)}
+                if changed:
+                    pending.update(changed)
+                    last_event = time.monotonic()
+                    continue
+                if pending and time.monotonic() - last_event >= self.debounce:
+                    batch, pending = pending, set()
+                    try:
+                        await self.on_change(batch)
+                    except Exception as e:
+                        PrintStyle.error(f"Knowledge import of changed files failed: {e}")
+        except Exception as e:
+            PrintStyle.error(f"Knowledge watcher stopped: {e}")
+            raise
+        finally:
+            backend.close()
+
+
+class _InotifyBackend:
+    def __init__(self, roots: list[str]):
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.roots = roots
+        self.watches: dict[int, str] = {}
+        self.polling: _PollingBackend | None = None  # replaces inotify once a new folder cannot be watched
+        try:
+            for root in roots:
+                self._watch_tree(root)
+        except Exception:
+            self.close()
+            raise
+
+    def read(self, timeout: float) -> set[str]:
+        if self.polling:
+            return self.polling.read(timeout)
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return set()
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return set()
+        changed: set[str] = set()
+        offset = 0
+        while offset + EVENT_HEADER.size <= len(data):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = data[offset : offset + length].rstrip(b"\0")
+            offset += length
+            if mask & IN_Q_OVERFLOW:
+                # events were dropped, report the roots so that everything is rescanned
+                changed.update(self.watches.values())
+                continue
+            directory = self.watches.get(wd)
+            if directory is None:
+                continue
+            if mask & IN_IGNORED:
+                del self.watches[wd]
+                continue
+            path = os.path.join(directory, os.fsdecode(name)) if name else directory
+            if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                try:
+                    self._watch_tree(path)
+                except OSError as e:
+                    # the watch limit is reached, changes below the new folder would be missed
+                    PrintStyle.warning(f"Knowledge watcher falls back to polling: {e}")
+                    self.close()
+                    self.polling = _PollingBackend(self.roots)
+                    # the remaining events are dropped, report the roots so that everything is rescanned
+                    return changed | set(self.roots)
+            changed.add(path)
+        return changed
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+        if self.polling:
+            self.polling.close()
+
+    def _watch_tree(self, root: str):
+        for directory, subdirs, _ in os.walk(root):
+            subdirs[:] = [d for d in subdirs if not d.startswith(".")]
+            wd = self.libc.inotify_add_watch(self.fd, os.fsencode(directory), WATCH_MASK)
+            if wd < 0:
+                code = ctypes.get_errno()
+                if code in (errno.ENOENT, errno.ENOTDIR):
+                    continue  # removed since it was listed
+                raise OSError(code, f"inotify_add_watch failed for {directory}")
+            self.watches[wd] = directory
+
+
+class _PollingBackend:
+    def __init__(self, roots: list[str], interval: float = POLL_INTERVAL):
+        self.roots = roots
+        self.interval = interval
+        self.state = self._scan()
+        self.next_scan = time.monotonic() + interval
+
+    def read(self, timeout: float) -> set[str]:
+        wait = self.next_scan - time.monotonic()
+        if wait > 0:
+            time.sleep(min(wait, timeout))
+            if time.monotonic() < self.next_scan:
+                return set()
+        state = self._scan()
+        changed = {
+            path
+            for path in state.keys() | self.state.keys()
+            if state.get(path) != self.state.get(path)
+        }
+        self.state = state
+        self.next_scan = time.monotonic() + self.interval
+        return changed
+
+    def close(self):
+        pass
+
+    def _scan(self) -> dict[str, tuple[int, int]]:
+        state = {}
+        for root in self.roots:
+            for directory, subdirs, names in os.walk(root):
+                subdirs[:] = [d for d in subdirs if not d.startswith(".")]
+                for name in names:
+                    path = os.path.join(directory, name)
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue  # removed while scanning
+                    state[path] = (stat.st_size, stat.st_mtime_ns)
+        return state
+
+
+def _create_backend(roots: list[str]) -> _InotifyBackend | _PollingBackend:
+    roots = [root for root in roots if os.path.isdir(root)]
+    if hasattr(select, "select") and os.name == "posix":
+        try:
+            return _InotifyBackend(roots)
+        except (OSError, AttributeError) as e:
+            # no inotify on this platform, or the watch limit is reached
+            PrintStyle.warning(f"Knowledge watcher falls back to polling: {e}")
+    return _PollingBackend(roots)
+
+
+def _is_relevant(path: str) -> bool:
+    # editor swap and backup files, load_knowledge skips hidden files as well
+    name = os.path.basename(path)
+    return not name.startswith(".") and not name.endswith("~")
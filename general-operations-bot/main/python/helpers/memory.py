@@ -1,6 +1,13 @@
+import asyncio
+import dataclasses
 from datetime import datetime
-from typing import Any, List, Sequence
-from langchain.storage import InMemoryByteStore, LocalFileStore
+from typing import Any, Awaitable, Callable, Iterable, Iterator, List, Mapping, Sequence
+import operator
+import pickle
+import shutil
+import threading
+import uuid
+from langchain.storage import InMemoryByteStore
 from langchain.embeddings import CacheBackedEmbeddings
 from python.helpers import guids
 
@@ -25,8 +32,21 @@ import numpy as np
 from python.helpers.print_style import PrintStyle
 from . import files
 from langchain_core.documents import Document
-from python.helpers import knowledge_import
+from python.helpers import knowledge_import, settings
+from python.helpers.defer import DeferredTask
 from python.helpers.log import Log, LogItem
+from python.helpers.memory_journal import MemoryJournal
+from python.helpers.embedding_cache import EmbeddingCache, EmbeddingCacheStore
+from python.helpers import memory_index
+from python.helpers.memory_filter import MetadataFilter, MetadataIndex
+from python.helpers.memory_lexical import LexicalIndex, fuse_rankings
+from python.helpers import memory_retention
+from python.helpers.memory_retention import AccessLog
+from python.helpers.memory_docstore import DOCSTORE_FILE, LazyDocuments, SQLiteDocstore
+from python.helpers.memory_reindex import ReindexCheckpoint, embed_batches
+from python.helpers import memory_snapshot
+from python.helpers.knowledge_watcher import KnowledgeWatcher
+from python.helpers.knowledge_index import KnowledgeImportIndex
 from enum import Enum
 from agent import Agent
 import models
@@ -39,17 +59,510 @@ logging.getLogger("langchain_core.vectorstores.base").setLevel(logging.ERROR)
 
 
 class MyFaiss(FAISS):
+    journal: MemoryJournal | None = None
+    access_log: AccessLog | None = None
+    _metadata_index: MetadataIndex | None = None
+    _lexical_index: LexicalIndex | None = None
+    _id_to_position: dict[str, int] | None = None
+    _tombstones: set[int] | None = None
+    _compaction: DeferredTask | None = None
+    _rebuild: DeferredTask | None = None
+    _snapshot_task: DeferredTask | None = None
+    _index_mapped = False  # index file is memory-mapped, copied to memory before the first write
+
+    def __init__(self, *args: Any, **kwargs: Any):
+        super().__init__(*args, **kwargs)
+        self.lock = threading.RLock()  # guards index mutations against the background compaction
+
+    @classmethod
+    def load_local(
+        cls,
+        folder_path: str,
+        embeddings: Embeddings,
+        index_name: str = "index",
+        *,
+        allow_dangerous_deserialization: bool = False,
+        mmap: bool = False,
+        **kwargs: Any,
+    ) -> "MyFaiss":
+        if not mmap:
+            return super().load_local(  # type: ignore
+                folder_path,
+                embeddings,
+                index_name,
+                allow_dangerous_deserialization=allow_dangerous_deserialization,
+                **kwargs,
+            )
+        if not allow_dangerous_deserialization:
+            raise ValueError("Loading the docstore requires allow_dangerous_deserialization=True.")
+        # like FAISS.load_local, but pages of the index file are only read when searched
+        index, mapped = memory_index.read_index(
+            os.path.join(folder_path, f"{index_name}.faiss"), mmap=True
+        )
+        with open(os.path.join(folder_path, f"{index_name}.pkl"), "rb") as f:
+            docstore, index_to_docstore_id = pickle.load(f)
+        db = cls(embeddings, index, docstore, index_to_docstore_id, **kwargs)
+        db._index_mapped = mapped
+        return db
+
+    def _own_index(self):
+        # copy-on-write of a memory-mapped index, called with the lock held
+        if self._index_mapped:
+            self.index = memory_index.owned_copy(self.index)
+            self._index_mapped = False
+
     # override aget_by_ids
     def get_by_ids(self, ids: Sequence[str], /) -> List[Document]:
+        ids = ids if isinstance(ids, list) else [ids]  # type: ignore
+        if isinstance(self.docstore, SQLiteDocstore):
+            return self.docstore.mget(ids)
         # return all self.docstore._dict[id] in ids
-        return [self.docstore._dict[id] for id in (ids if isinstance(ids, list) else [ids]) if id in self.docstore._dict]  # type: ignore
+        return [self.docstore._dict[id] for id in ids if id in self.docstore._dict]  # type: ignore
 
     async def aget_by_ids(self, ids: Sequence[str], /) -> List[Document]:
         return self.get_by_ids(ids)
 
-    def get_all_docs(self):
+    def get_all_docs(self) -> Mapping[str, Document]:
+        if isinstance(self.docstore, SQLiteDocstore):
+            return LazyDocuments(self.docstore)
+        return self.docstore._dict  # type: ignore
+
+    def get_metadata(self, id: str) -> dict[str, Any] | None:
+        if isinstance(self.docstore, SQLiteDocstore):
+            return self.docstore.metadata.get(id)
+        doc = self.docstore._dict.get(id)  # type: ignore
+        return doc.metadata if doc else None
+
+    def iter_metadata(self) -> Iterator[tuple[str, dict[str, Any]]]:
+        if isinstance(self.docstore, SQLiteDocstore):
+            return iter(list(self.docstore.metadata.items()))
+        return ((id, doc.metadata) for id, doc in list(self.docstore._dict.items()))  # type: ignore
+
+    @property
+    def metadata_index(self) -> MetadataIndex:
+        # built lazily on first filtered search, then kept in sync by add_vectors and delete
+        if self._metadata_index is None:
+            self._metadata_index = MetadataIndex.from_metadata(self.iter_metadata())
+        return self._metadata_index
+
+    @property
+    def lexical_index(self) -> LexicalIndex:
+        # built lazily on first hybrid search like the metadata index
+        if self._lexical_index is None:
+            with self.lock:
+                docs = (
+                    self.docstore.iter_documents()
+                    if isinstance(self.docstore, SQLiteDocstore)
+                    else list(self.docstore._dict.items())  # type: ignore
+                )
+                self._lexical_index = LexicalIndex.from_texts(
+                    (id, doc.page_content) for id, doc in docs
+                )
+        return self._lexical_index
+
+    def get_texts(self, ids: Sequence[str]) -> list[str | None]:
+        docs = self._docs_by_id(ids)
+        return [docs[id].page_content if id in docs else None for id in ids]
+
+    def _docs_by_id(self, ids: Sequence[str]) -> Mapping[str, Document]:
+        if isinstance(self.docstore, SQLiteDocstore):
+            # one query for all ids, content is only read here
+            return {doc.id: doc for doc in self.docstore.mget(ids)}  # type: ignore
         return self.docstore._dict  # type: ignore
 
+    def get_positions(self, ids: Iterable[str]) -> list[int]:
+        if self._id_to_position is None:
+            self._id_to_position = {id: pos for pos, id in self.index_to_docstore_id.items()}
+        return sorted(self._id_to_position[id] for id in ids if id in self._id_to_position)
+
+    @property
+    def tombstones(self) -> set[int]:
+        # positions of deleted documents still present in the index, derived after loading a snapshot
+        if self._tombstones is None:
+            self._tombstones = set(range(self.index.ntotal)).difference(self.index_to_docstore_id)
+        return self._tombstones
+
+    def tombstone_ratio(self) -> float:
+        return len(self.tombstones) / self.index.ntotal if self.index.ntotal else 0.0
+
+    def add_texts(
+        self,
+        texts: Iterable[str],
+        metadatas: list[dict] | None = None,
+        ids: list[str] | None = None,
+        **kwargs: Any,
+    ) -> list[str]:
+        texts = list(texts)
+        embeddings = self._embed_documents(texts)
+        return self.add_vectors(texts, embeddings, metadatas=metadatas, ids=ids)
+
+    async def aadd_texts(
+        self,
+        texts: Iterable[str],
+        metadatas: list[dict] | None = None,
+        ids: list[str] | None = None,
+        **kwargs: Any,
+    ) -> list[str]:
+        texts = list(texts)
+        embeddings = await self._aembed_documents(texts)
+        return self.add_vectors(texts, embeddings, metadatas=metadatas, ids=ids)
+
+    def add_embeddings(
+        self,
+        text_embeddings: Iterable[tuple[str, list[float]]],
+        metadatas: list[dict] | None = None,
+        ids: list[str] | None = None,
+        **kwargs: Any,
+    ) -> list[str]:
+        texts, embeddings = zip(*text_embeddings)
+        return self.add_vectors(list(texts), list(embeddings), metadatas=metadatas, ids=ids)
+
+    def add_vectors(
+        self,
+        texts: list[str],
+        embeddings: Sequence[Sequence[float]] | np.ndarray,
+        metadatas: list[dict] | None = None,
+        ids: list[str] | None = None,
+    ) -> list[str]:
+        # replaces FAISS.__add so that inserted vectors can be written to the journal
+        ids = ids or [str(uuid.uuid4()) for _ in texts]
+        metadatas = metadatas or [{} for _ in texts]
+        documents = [
+            Document(id=id, page_content=text, metadata=metadata)
+            for id, text, metadata in zip(ids, texts, metadatas)
+        ]
+        vectors = np.array(embeddings, dtype=np.float32).reshape(len(ids), -1)
+
+        with self.lock:
+            self._own_index()
+            start = self.index.ntotal
+            self.index.add(vectors)
+            self.docstore.add({id: doc for id, doc in zip(ids, documents)})  # type: ignore
+            self.index_to_docstore_id.update({start + i: id for i, id in enumerate(ids)})
+            if self._metadata_index is not None:
+                self._metadata_index.add((id, doc.metadata) for id, doc in zip(ids, documents))
+            if self._lexical_index is not None:
+                self._lexical_index.add(zip(ids, texts))
+            if self._id_to_position is not None:
+                self._id_to_position.update({id: start + i for i, id in enumerate(ids)})
+
+        if self.journal:
+            self.journal.append_add(ids, documents, vectors)
+        return ids
+
+    def delete(self, ids: list[str] | None = None, **kwargs: Any) -> bool | None:
+        # deleted vectors stay in the index as tombstones until the next compaction
+        if ids is None:
+            raise ValueError("No ids provided to delete.")
+        with self.lock:
+            positions = self.get_positions(ids)
+            missing = set(ids).difference(self._id_to_position)  # type: ignore
+            if missing:
+                raise ValueError(f"Some specified ids do not exist in the current store. Ids not found: {missing}")
+            removed = [(id, self.get_metadata(id) or {}) for id in ids]
+            tombstones = self.tombstones
+            for pos in positions:
+                del self.index_to_docstore_id[pos]
+            tombstones.update(positions)
+            for id in ids:
+                self._id_to_position.pop(id, None)  # type: ignore
+            # the docstore may already miss documents deleted after the last snapshot
+            stored = [id for id in ids if self.get_metadata(id) is not None]
+            if stored:
+                self.docstore.delete(stored)
+            if self._metadata_index is not None:
+                self._metadata_index.remove(removed)
+            if self._lexical_index is not None:
+                self._lexical_index.remove(ids)
+        if self.journal and ids:
+            self.journal.append_delete(ids)
+        return True
+
+    def compact(self):
+        """Rebuild the index without tombstoned vectors."""
+        with self.lock:
+            if not self.tombstones:
+                return
+            self._own_index()  # faiss cannot clone a mapped index
+            index = self.index
+            positions = sorted(self.index_to_docstore_id)
+            vectors = memory_index.reconstruct(index, positions)
+            start_total = index.ntotal
+
+        # building the new index is the slow part, inserts and deletes may continue meanwhile
+        compacted = memory_index.empty_clone(index)  # keeps IVF training
+        compacted.add(vectors)
+
+        with self.lock:
+            if self.index is not index:
+                return  # index was rebuilt in the meantime
+            remap = {pos: i for i, pos in enumerate(positions)}
+            added = list(range(start_total, index.ntotal))
+            if added:
+                compacted.add(memory_index.reconstruct(index, added))
+                remap.update({pos: len(positions) + i for i, pos in enumerate(added)})
+            self.index = compacted
+            self.index_to_docstore_id = {
+                remap[pos]: id for pos, id in self.index_to_docstore_id.items()
+            }
+            self._tombstones = None  # documents deleted while compacting
+            self._id_to_position = None
+
+    def compact_in_background(self, ratio: float):
+        """Schedule a compaction when tombstones make up more than the given ratio of the index."""
+        if ratio <= 0 or self.tombstone_ratio() < ratio:
+            return
+        if self._compaction and self._compaction.is_alive():
+            return
+
+        async def compact():
+            try:
+                self.compact()
+            except Exception as e:
+                PrintStyle.error(f"Memory index compaction failed: {e}")
+
+        self._compaction = DeferredTask(thread_name="MemoryIndexCompaction").start_task(compact)
+
+    def rebuild_index(self, index_type: memory_index.IndexType) -> bool:
+        """
+        Migrate to another index type or retrain the current one on all stored vectors.
+        Like compact, inserts and deletes may continue while the new index is built.
+        Returns False when the index was replaced in the meantime and the rebuild was dropped.
+        """
+        with self.lock:
+            index = self.index
+            positions = sorted(self.index_to_docstore_id)
+            start_total = index.ntotal
+            lossy = memory_index.is_lossy(index)
+            if lossy:
+                texts = self.get_texts([self.index_to_docstore_id[pos] for pos in positions])
+            else:
+                vectors = memory_index.reconstruct(index, positions)
+
+        if lossy:
+            # PQ codes are approximations, train on fresh (cached) embeddings instead
+            vectors = np.array(
+                self._embed_documents([text or "" for text in texts]), dtype=np.float32
+            ).reshape(len(positions), index.d)
+        rebuilt = memory_index.create_index(index_type, index.d, vectors)
+
+        with self.lock:
+            if self.index is not index:
+                return False  # index was rebuilt or compacted in the meantime
+            remap = {pos: i for i, pos in enumerate(positions)}
+            added = list(range(start_total, index.ntotal))
+            if added:
+                rebuilt.add(memory_index.reconstruct(index, added))
+                remap.update({pos: len(positions) + i for i, pos in enumerate(added)})
+            self.index = rebuilt
+            self._index_mapped = False
+            self.index_to_docstore_id = {
+                remap[pos]: id for pos, id in self.index_to_docstore_id.items()
+            }
+            self._id_to_position = None
+            self._tombstones = None  # documents deleted while rebuilding
+        return True
+
+    def rebuild_in_background(self, rebuild: Callable[[], Awaitable[None]]):
+        """Run an index rebuild as a deferred task unless one is still running."""
+        if self._rebuild and self._rebuild.is_alive():
+            return
+        self._rebuild = DeferredTask(thread_name="MemoryIndexRebuild").start_task(rebuild)
+
+    def replace_embeddings(
+        self,
+        embedding_function: Embeddings,
+        ids: list[str],
+        vectors: np.ndarray,
+        index_type: memory_index.IndexType,
+    ):
+        """Switch to vectors of another embedding model, documents deleted meanwhile are skipped."""
+        with self.lock:
+            live = set(self.index_to_docstore_id.values())
+            keep = [i for i, id in enumerate(ids) if id in live]
+            vectors = vectors[keep]
+            self.index = memory_index.create_index(index_type, vectors.shape[1], vectors)
+            self._index_mapped = False
+            self.index_to_docstore_id = {pos: ids[i] for pos, i in enumerate(keep)}
+            self.embedding_function = embedding_function
+            self._id_to_position = None
+            self._tombstones = set()
+            if len(keep) < len(live):
+                # documents without text were not re-embedded
+                self._metadata_index = None
+                self._lexical_index = None
+
+    def similarity_search_with_score_by_vector(
+        self,
+        embedding: List[float],
+        k: int = 4,
+        filter: Any = None,
+        fetch_k: int = 20,
+        **kwargs: Any,
+    ) -> List[tuple[Document, float]]:
+        # langchain's implementation does not know about tombstones and the metadata index
+        return self.similarity_search_multi(
+            [embedding], [(filter, k)], fetch_k=fetch_k, **kwargs
+        )[0][0]
+
+    def _get_docs(self, positions: Iterable[int]) -> list[Document | None]:
+        # -1 for missing results, tombstones have no id
+        ids = [self.index_to_docstore_id.get(int(pos)) for pos in positions]
+        docs = self._docs_by_id([id for id in ids if id])
+        return [docs.get(id) if id is not None else None for id in ids]
+
+    def range_search_with_score_by_vector(
+        self, embedding: Sequence[float], min_score: float, filter: Any = None
+    ) -> list[tuple[Document, float]]:
+        """All documents scoring at least min_score against the vector, best first."""
+        vector = np.array([embedding], dtype=np.float32)
+        if self._normalize_L2:
+            faiss.normalize_L2(vector)
+
+        positions = None
+        filter_func = None
+        with self.lock:
+            if isinstance(filter, MetadataFilter) and filter.plan is not None:
+                positions = self.get_positions(self.metadata_index.resolve(filter.plan))
+                if not filter.plan.exact:
+                    filter_func = filter
+            elif filter is not None:
+                filter_func = self._create_filter_func(filter)
+
+            scores, found = memory_index.range_search(
+                self.index, vector, min_score, positions, exclude=self.tombstones
+            )
+            found_docs = self._get_docs(found)
+
+        docs = []
+        for score, doc in sorted(zip(scores, found_docs), key=lambda r: -r[0]):
+            if doc is None:
+                continue
+            if filter_func and not filter_func(doc.metadata):
+                continue
+            docs.append((doc, float(score)))
+        return docs
+
+    def similarity_search_multi(
+        self,
+        embeddings: Sequence[Sequence[float]] | np.ndarray,
+        groups: list[tuple[Any, int]],
+        fetch_k: int = 20,
+        **kwargs: Any,
+    ) -> list[list[list[tuple[Document, float]]]]:
+        """
+        Search several query vectors against several (filter, k) groups in one pass.
+        Returns results[group][query] as (document, score) pairs.
+        """
+        vectors = np.array(embeddings, dtype=np.float32).reshape(-1, self.index.d)
+        if self._normalize_L2:
+            faiss.normalize_L2(vectors)
+
+        with self.lock:
+            # resolve indexed metadata conditions to candidate positions before the vector search
+            subsets: list[list[int] | None] = []
+            ks: list[int] = []
+            for filter, k in groups:
+                if isinstance(filter, MetadataFilter) and filter.plan is not None:
+                    candidates = self.metadata_index.resolve(filter.plan)
+                    subsets.append(self.get_positions(candidates))
+                    ks.append(k if filter.plan.exact else max(k, fetch_k))
+                else:
+                    subsets.append(None)
+                    ks.append(k if filter is None else max(k, fetch_k))
+            found = [
+                (scores, [self._get_docs(row) for row in positions])
+                for scores, positions in memory_index.search_subsets(
+                    self.index, vectors, subsets, ks, exclude=self.tombstones
+                )
+            ]
+
+        score_threshold = kwargs.get("score_threshold")
+        cmp = (
+            operator.ge
+            if self.distance_strategy
+            in (DistanceStrategy.MAX_INNER_PRODUCT, DistanceStrategy.JACCARD)
+            else operator.le
+        )
+
+        results = []
+        for (filter, k), (scores, found_docs) in zip(groups, found):
+            exact = filter is None or (
+                isinstance(filter, MetadataFilter) and filter.plan is not None and filter.plan.exact
+            )
+            filter_func = None if exact else self._create_filter_func(filter)
+            group_results = []
+            for query_scores, query_docs in zip(scores, found_docs):
+                docs = []
+                for score, doc in zip(query_scores, query_docs):
+                    if doc is None:
+                        continue
+                    if filter_func and not filter_func(doc.metadata):
+                        continue
+                    if score_threshold is not None and not cmp(score, score_threshold):
+                        continue
+                    docs.append((doc, float(score)))
+                    if len(docs) >= k:
+                        break
+                group_results.append(docs)
+            results.append(group_results)
+        return results
+
+    def lexical_search_multi(
+        self,
+        queries: Sequence[str],
+        embeddings: Sequence[Sequence[float]] | np.ndarray,
+        groups: list[tuple[Any, int]],
+    ) -> list[list[list[tuple[Document, float]]]]:
+        """
+        BM25 keyword search of several queries in several (filter, k) groups.
+        Returns results[group][query] as (document, score) pairs in BM25 order,
+        scored against the query vectors like similarity_search_multi.
+        """
+        vectors = np.array(embeddings, dtype=np.float32).reshape(-1, self.index.d)
+        if self._normalize_L2:
+            faiss.normalize_L2(vectors)
+
+        results = []
+        with self.lock:
+            lexical = self.lexical_index
+            for filter, k in groups:
+                candidates = None
+                filter_func = None
+                if isinstance(filter, MetadataFilter) and filter.plan is not None:
+                    candidates = self.metadata_index.resolve(filter.plan)
+                    if not filter.plan.exact:
+                        filter_func = filter
+                elif filter is not None:
+                    filter_func = self._create_filter_func(filter)
+                group_results = []
+                for query, vector in zip(queries, vectors):
+                    hits = []
+                    for id, _ in lexical.search(query, candidates):
+                        if filter_func and not filter_func(self.get_metadata(id) or {}):
+                            continue
+                        hits.append(id)
+                        if len(hits) >= k:
+                            break
+                    scores = self._vector_scores(vector, hits)
+                    docs = self._docs_by_id(hits)
+                    group_results.append(
+                        [(docs[id], scores[id]) for id in hits if id in docs and id in scores]
+                    )
+                results.append(group_results)
+        return results
+
+    def _vector_scores(self, vector: np.ndarray, ids: list[str]) -> dict[str, float]:
+        # scores of stored vectors like the index computes them, for documents found by other means
+        positions = self.get_positions(ids)
+        scores = memory_index.reconstruct(self.index, positions) @ vector
+        by_position = dict(zip(positions, scores))
+        return {
+            id: float(by_position[self._id_to_position[id]])  # type: ignore
+            for id in ids
+            if id in self._id_to_position  # type: ignore
+        }
+
 
 class Memory:
 
@@ -60,6 +573,9 @@ class Memory:
         INSTRUMENTS = "instruments"
 
     index: dict[str, "MyFaiss"] = {}
+    _reindex_tasks: dict[str, DeferredTask] = {}
+    _knowledge_watchers: dict[str, KnowledgeWatcher] = {}
+    _knowledge_locks: dict[str, threading.Lock] = {}
 
     @staticmethod
     async def get(agent: Agent):
@@ -78,6 +594,8 @@ class Memory:
             Memory.index[memory_subdir] = db
             wrap = Memory(agent, db, memory_subdir=memory_subdir)
             if agent.config.knowledge_subdirs:
+                # watch first, files changed during the initial import are picked up afterwards
+                Memory._watch_knowledge(memory_subdir, agent.config.knowledge_subdirs)
                 await wrap.preload_knowledge(
                     log_item, agent.config.knowledge_subdirs, memory_subdir
                 )
@@ -106,6 +624,9 @@ class Memory:
 
         PrintStyle.standard("Initializing VectorDB...")
 
+        # a re-index of a previously loaded instance would overwrite this one when done
+        Memory._stop_reindex(memory_subdir)
+
         if log_item:
             log_item.stream(progress="\nInitializing VectorDB")
 
@@ -117,31 +638,29 @@ class Memory:
         # make sure embeddings and database directories exist
         os.makedirs(db_dir, exist_ok=True)
 
-        if in_memory:
-            store = InMemoryByteStore()
-        else:
-            os.makedirs(em_dir, exist_ok=True)
-            store = LocalFileStore(em_dir)
-
         embeddings_model = models.get_embedding_model(
             model_config.provider,
             model_config.name,
             **model_config.build_kwargs(),
         )
-        embeddings_model_id = files.safe_file_name(
-            model_config.provider + "_" + model_config.name
-        )
-
-        # here we setup the embeddings model with the chosen cache storage
-        embedder = CacheBackedEmbeddings.from_bytes_store(
-            embeddings_model, store, namespace=embeddings_model_id
+        embedder = Memory._create_embedder(
+            embeddings_model, model_config.provider, model_config.name, em_dir, in_memory
         )
 
         # initial DB and docs variables
         db: MyFaiss | None = None
         docs: dict[str, Document] | None = None
+        journal = MemoryJournal(db_dir) if not in_memory else None
 
         created = False
+        reindex: ReindexCheckpoint | None = None
+
+        # finish a snapshot write interrupted by a crash
+        Memory._recover_snapshot(db_dir)
+
+        # convert an imported snapshot export to the index and docstore files
+        if memory_snapshot.is_snapshot(db_dir) and not files.exists(db_dir, "index.faiss"):
+            Memory._import_snapshot(log_item, db_dir, in_memory)
 
         # if db folder exists and is not empty:
         if os.path.exists(db_dir) and files.exists(db_dir, "index.faiss"):
@@ -149,13 +668,20 @@ class Memory:
                 folder_path=db_dir,
                 embeddings=embedder,
                 allow_dangerous_deserialization=True,
+                mmap=not in_memory and Memory._index_mmap(),
                 distance_strategy=DistanceStrategy.COSINE,
                 # normalize_L2=True,
                 relevance_score_fn=Memory._cosine_normalizer,
             )  # type: ignore
 
+            memory_index.configure_index(db.index)
+
+            # open the docstore file, or move documents to it when the setting changed
+            docstore_converted = Memory._prepare_docstore(db, db_dir, in_memory)
+
             # if there is a mismatch in embeddings used, re-index the whole DB
             emb_ok = False
+            embedding_set = {}
             emb_set_file = files.get_abs_path(db_dir, "embedding.json")
             if files.exists(emb_set_file):
                 embedding_set = json.loads(files.read_file(emb_set_file))
@@ -165,20 +691,66 @@ class Memory:
                 ):
                     # model matches
                     emb_ok = True
+                    ReindexCheckpoint.remove(db_dir)  # left over when switching back
+
+            # keep serving the old index with the old model while the new one is built in the background
+            if db and not emb_ok and not in_memory:
+                previous = Memory._previous_embedder(embedding_set, model_config, em_dir)
+                if previous:
+                    db.embedding_function = previous
+                    reindex = Memory._reindex_checkpoint(db_dir, embedder, model_config)
+                    emb_ok = True
 
             # re-index -  create new DB and insert existing docs
             if db and not emb_ok:
-                docs = db.get_all_docs()
+                docs = dict(db.get_all_docs().items())
+                # journaled vectors belong to the old model, only documents are kept
+                if journal and not journal.is_empty():
+                    Memory._apply_journal_to_docs(docs, journal)
                 db = None
 
+            # apply changes journaled since the last snapshot
+            elif db and journal and not journal.is_empty():
+                Memory._replay_journal(log_item, db, journal)
+                # fold the journal into a snapshot if it is not used anymore or a compaction was interrupted
+                if (
+                    not Memory._journal_enabled()
+                    or journal.has_rotated()
+                    or journal.size() > Memory._journal_compact_size()
+                ):
+                    Memory._save_db_file(db, memory_subdir)
+
+            # migrate or retrain the index if the corpus crossed a size threshold
+            if db and Memory._rebuild_index_if_needed(log_item, db):
+                Memory._save_db_file(db, memory_subdir)
+                Memory._save_meta_file(db, memory_subdir)
+
+            # drop vectors of deleted documents left in the snapshot
+            elif db and 0 < Memory._compaction_ratio() < db.tombstone_ratio():
+                db.compact()
+                Memory._save_db_file(db, memory_subdir)
+
+            if db and isinstance(db.docstore, SQLiteDocstore):
+                db.docstore.retain(set(db.index_to_docstore_id.values()))
+                # load documents back to memory when the setting changed, after the journal replay
+                if in_memory or not Memory._docstore_lazy():
+                    db.docstore = InMemoryDocstore(dict(db.docstore.iter_documents()))
+                    docstore_converted = True
+            if db and docstore_converted:
+                Memory._save_db_file(db, memory_subdir)
+                if not in_memory and not isinstance(db.docstore, SQLiteDocstore):
+                    Memory._remove_docstore_file(db_dir)
+
         # DB not loaded, create one
         if not db:
-            index = faiss.IndexFlatIP(len(embedder.embed_query("example")))
+            index = memory_index.create_index(
+                memory_index.FLAT, len(embedder.embed_query("example"))
+            )
 
             db = MyFaiss(
                 embedding_function=embedder,
                 index=index,
-                docstore=InMemoryDocstore(),
+                docstore=Memory._create_docstore(db_dir, in_memory),
                 index_to_docstore_id={},
                 distance_strategy=DistanceStrategy.COSINE,
                 # normalize_L2=True,
@@ -190,24 +762,31 @@ class Memory:
                 PrintStyle.standard("Indexing memories...")
                 if log_item:
                     log_item.stream(progress="\nIndexing memories")
-                db.add_documents(documents=list(docs.values()), ids=list(docs.keys()))
-
-            # save DB
-            Memory._save_db_file(db, memory_subdir)
-            # save meta file
-            meta_file_path = files.get_abs_path(db_dir, "embedding.json")
-            files.write_file(
-                meta_file_path,
-                json.dumps(
-                    {
-                        "model_provider": model_config.provider,
-                        "model_name": model_config.name,
-                    }
-                ),
-            )
+                Memory._reindex_docs(log_item, db, docs, db_dir, model_config, in_memory)
+                # ANN indexes are trained on the re-embedded corpus
+                Memory._rebuild_index_if_needed(log_item, db)
+            if isinstance(db.docstore, SQLiteDocstore):
+                db.docstore.retain(set(db.index_to_docstore_id.values()))
+
+            # save DB together with the meta file
+            Memory._save_db_file(db, memory_subdir, model_config)
+            if not in_memory and not isinstance(db.docstore, SQLiteDocstore):
+                Memory._remove_docstore_file(db_dir)  # left over from a re-index
+            ReindexCheckpoint.remove(db_dir)
 
             created = True
 
+        # further changes are appended to the journal instead of rewriting the snapshot
+        if journal and Memory._journal_enabled():
+            db.journal = journal
+
+        # recall counters for least-recently-recalled eviction
+        if not in_memory:
+            db.access_log = AccessLog(os.path.join(db_dir, memory_retention.ACCESS_FILE))
+
+        if reindex:
+            Memory._start_reindex(log_item, db, embedder, reindex, memory_subdir, model_config)
+
         return db, created
 
     def __init__(
@@ -221,7 +800,26 @@ class Memory:
         self.memory_subdir = memory_subdir
 
     async def preload_knowledge(
-        self, log_item: LogItem | None, kn_dirs: list[str], memory_subdir: str
+        self,
+        log_item: LogItem | None,
+        kn_dirs: list[str],
+        memory_subdir: str,
+        paths: set[str] | None = None,
+    ):
+        # the watcher and Memory.get may import into the same subdir from different threads
+        lock = Memory._knowledge_locks.setdefault(memory_subdir, threading.Lock())
+        await asyncio.to_thread(lock.acquire)
+        try:
+            await self._preload_knowledge(log_item, kn_dirs, memory_subdir, paths)
+        finally:
+            lock.release()
+
+    async def _preload_knowledge(
+        self,
+        log_item: LogItem | None,
+        kn_dirs: list[str],
+        memory_subdir: str,
+        paths: set[str] | None,
     ):
         if log_item:
             log_item.update(heading="Preloading knowledge...")
@@ -229,117 +827,363 @@ class Memory:
         # db abs path
         db_dir = Memory._abs_db_dir(memory_subdir)
 
-        # Load the index file if it exists
-        index_path = files.get_abs_path(db_dir, "knowledge_import.json")
-
         # make sure directory exists
         if not os.path.exists(db_dir):
             os.makedirs(db_dir)
 
-        index: dict[str, knowledge_import.KnowledgeImport] = {}
-        if os.path.exists(index_path):
-            with open(index_path, "r") as f:
-                index = json.load(f)
-
-        # preload knowledge folders
-        index = self._preload_knowledge_folders(log_item, kn_dirs, index)
-
-        for file in index:
-            if index[file]["state"] in ["changed", "removed"] and index[file].get(
-                "ids", []
-            ):  # for knowledge files that have been changed or removed and have IDs
-                await self.delete_documents_by_ids(
-                    index[file]["ids"]
-                )  # remove original version
-            if index[file]["state"] == "changed":
-                index[file]["ids"] = await self.insert_documents(
-                    index[file]["documents"]
-                )  # insert new version
-
-        # remove index where state="removed"
-        index = {k: v for k, v in index.items() if v["state"] != "removed"}
-
-        # strip state and documents from index and save it
-        for file in index:
-            if "documents" in index[file]:
-                del index[file]["documents"]  # type: ignore
-            if "state" in index[file]:
-                del index[file]["state"]  # type: ignore
-        with open(index_path, "w") as f:
-            json.dump(index, f)
+        store = KnowledgeImportIndex(db_dir)
+        try:
+            await self._import_knowledge(log_item, kn_dirs, store, paths)
+        finally:
+            store.close()
+
+    async def _import_knowledge(
+        self,
+        log_item: LogItem | None,
+        kn_dirs: list[str],
+        store: KnowledgeImportIndex,
+        paths: set[str] | None,
+    ):
+        # preload knowledge folders, only the changed paths when called by the watcher
+        index = store.entries(paths)
+        known = {file: (e["checksum"], e["size"], e["mtime_ns"]) for file, e in index.items()}
+        index = self._preload_knowledge_folders(log_item, kn_dirs, index, paths)
+        states = {file: index[file].get("state") for file in index}
+
+        # unchanged files only need new stat fields when they were hashed again
+        for file, entry in index.items():
+            if states[file] == "original" and known.get(file) != (
+                entry["checksum"], entry["size"], entry["mtime_ns"]
+            ):
+                store.update_stat(entry)
+
+        # chunk ids are only needed for changed and removed files
+        store.load_chunks(
+            entry for file, entry in index.items() if states[file] in ("changed", "removed")
+        )
+
+        # remove chunks of knowledge files that have been removed, in one batch
+        removed = [file for file in index if states[file] == "removed"]
+        stale_ids = [id for file in removed for id in index[file]["ids"]]
+        if stale_ids:
+            await self.delete_documents_by_ids(stale_ids)
+        store.delete(removed)
+
+        # parse new versions in worker processes, update them in large batches as files complete
+        changed = [index[file] for file in index if states[file] == "changed"]
+        batch: list[knowledge_import.KnowledgeImport] = []
+        batch_docs = 0
+        async for entry, documents in knowledge_import.parse_files(
+            log_item, changed, Memory._knowledge_import_workers()
+        ):
+            if documents is None:
+                entry["checksum"] = ""  # retried on the next start, previous chunks are kept
+                store.put(entry)
+                continue
+            entry["documents"] = documents
+            batch.append(entry)
+            batch_docs += len(documents)
+            if batch_docs >= knowledge_import.INSERT_BATCH_DOCS:
+                await self._insert_knowledge(batch, store)
+                batch, batch_docs = [], 0
+        await self._insert_knowledge(batch, store)
+
+    async def _insert_knowledge(
+        self, entries: list[knowledge_import.KnowledgeImport], store: KnowledgeImportIndex
+    ):
+        # only new or changed chunks are embedded, vanished ones are deleted
+        plans = []
+        stale_ids: list[str] = []
+        new_docs: list[Document] = []
+        exists = lambda id: self.db.get_metadata(id) is not None
+        for entry in entries:
+            hashes = [knowledge_import.chunk_hash(doc) for doc in entry["documents"]]
+            ids, vanished = knowledge_import.match_chunks(entry, hashes, exists)
+            stale_ids.extend(vanished)
+            new_docs.extend(doc for doc, id in zip(entry["documents"], ids) if id is None)
+            plans.append((entry, hashes, ids))
+        if stale_ids:
+            await self.delete_documents_by_ids(stale_ids)
+
+        # one insert for all files, the ids are split back per file
+        new_ids = iter(await self.insert_documents(new_docs))
+        for entry, hashes, ids in plans:
+            entry["ids"] = [id if id is not None else next(new_ids) for id in ids]
+            entry["chunks"] = hashes
+            entry["documents"] = []  # parsed documents are not needed anymore
+            store.put(entry)
 
     def _preload_knowledge_folders(
         self,
         log_item: LogItem | None,
         kn_dirs: list[str],
         index: dict[str, knowledge_import.KnowledgeImport],
+        paths: set[str] | None = None,
     ):
-        # load knowledge folders, subfolders by area
-        for kn_dir in kn_dirs:
-            for area in Memory.Area:
-                index = knowledge_import.load_knowledge(
-                    log_item,
-                    files.get_abs_path("knowledge", kn_dir, area.value),
-                    index,
-                    {"area": area.value},
-                )
+        for folder, metadata, pattern in Memory._knowledge_folders(kn_dirs):
+            index = knowledge_import.load_knowledge(
+                log_item, folder, index, metadata, filename_pattern=pattern, paths=paths
+            )
+        return index
 
-        # load instruments descriptions
-        index = knowledge_import.load_knowledge(
-            log_item,
-            files.get_abs_path("instruments"),
-            index,
-            {"area": Memory.Area.INSTRUMENTS.value},
-            filename_pattern="**/*.md",
+    @staticmethod
+    def _knowledge_folders(kn_dirs: list[str]) -> list[tuple[str, dict[str, Any], str]]:
+        # knowledge folders with subfolders by area, and instruments descriptions
+        folders = [
+            (files.get_abs_path("knowledge", kn_dir, area.value), {"area": area.value}, "**/*")
+            for kn_dir in kn_dirs
+            for area in Memory.Area
+        ]
+        folders.append(
+            (
+                files.get_abs_path("instruments"),
+                {"area": Memory.Area.INSTRUMENTS.value},
+                "**/*.md",
+            )
         )
+        return folders
 
-        return index
+    @staticmethod
+    def _watch_knowledge(memory_subdir: str, kn_dirs: list[str]):
+        """Import knowledge files into the subdir in the background as soon as they change."""
+        watcher = Memory._knowledge_watchers.pop(memory_subdir, None)
+        if watcher:
+            watcher.stop()
+        if not Memory._knowledge_watch_enabled():
+            return
+        roots = [folder for folder, _, _ in Memory._knowledge_folders(kn_dirs)]
+        for root in roots:
+            os.makedirs(root, exist_ok=True)
+
+        async def on_change(paths: set[str]):
+            db = Memory.index.get(memory_subdir)
+            if not db:
+                return  # unloaded, the next Memory.get scans all folders
+            PrintStyle.standard(f"Importing changed knowledge into '{memory_subdir}'...")
+            memory = Memory(None, db, memory_subdir)  # type: ignore
+            await memory.preload_knowledge(None, kn_dirs, memory_subdir, paths)
+
+        Memory._knowledge_watchers[memory_subdir] = KnowledgeWatcher(
+            memory_subdir, roots, on_change
+        ).start()
 
     async def search_similarity_threshold(
         self, query: str, limit: int, threshold: float, filter: str = ""
     ):
-        comparator = Memory._get_comparator(filter) if filter else None
+        comparator = Memory._get_filter(filter)
 
-        return await self.db.asearch(
+        docs = await self.db.asearch(
             query,
             search_type="similarity_score_threshold",
             k=limit,
             score_threshold=threshold,
             filter=comparator,
         )
+        self._record_access(docs)
+        return docs
+
+    async def search_similarity_threshold_multi(
+        self, queries: list[str], groups: dict[str, tuple[str, int]], threshold: float
+    ) -> dict[str, list[list[Document]]]:
+        """
+        Search several queries in several filtered groups at once, e.g. memory areas.
+        Groups map a name to (filter, limit), results are returned as results[group][query index].
+        Each distinct query is embedded only once and all groups share one index pass.
+        """
+        embedded = await self._embed_queries(queries)
+        results = self._without_scores(
+            await self._search_multi(queries, groups, threshold, embedded)
+        )
+        self._record_access(doc for group in results.values() for docs in group for doc in docs)
+        return results
 
-    async def delete_documents_by_query(
-        self, query: str, threshold: float, filter: str = ""
-    ):
-        k = 100
-        tot = 0
-        removed = []
+    async def _embed_queries(self, queries: list[str]) -> dict[str, list[float]]:
+        distinct = list(dict.fromkeys(queries))
+        embeddings = await asyncio.gather(*(self.db._aembed_query(q) for q in distinct))
+        return dict(zip(distinct, embeddings))
 
-        while True:
-            # Perform similarity search with score
-            docs = await self.search_similarity_threshold(
-                query, limit=k, threshold=threshold, filter=filter
+    async def _search_multi(
+        self,
+        queries: list[str],
+        groups: dict[str, tuple[str, int]],
+        threshold: float,
+        embedded: dict[str, list[float]],
+    ) -> dict[str, list[list[tuple[Document, float]]]]:
+        names = list(groups)
+        found = await asyncio.to_thread(
+            self.db.similarity_search_multi,
+            list(embedded.values()),
+            [(Memory._get_filter(filter), limit) for filter, limit in groups.values()],
+        )
+
+        relevance = self.db._select_relevance_score_fn()
+        results: dict[str, list[list[tuple[Document, float]]]] = {}
+        for name, group in zip(names, found):
+            by_query = {
+                query: Memory._above_threshold(docs, relevance, threshold)
+                for query, docs in zip(embedded, group)
+            }
+            results[name] = [by_query[query] for query in queries]
+        return results
+
+    async def search_hybrid_multi(
+        self, queries: list[str], groups: dict[str, tuple[str, int]], threshold: float
+    ) -> dict[str, list[list[Document]]]:
+        """
+        Same as search_similarity_threshold_multi, fused with BM25 keyword matches of the queries.
+        Keyword hits are held to the same vector similarity threshold,
+        both rankings are merged by reciprocal rank fusion.
+        """
+        return self._without_scores(
+            await self.search_hybrid_multi_with_scores(queries, groups, threshold)
+        )
+
+    async def search_hybrid_multi_with_scores(
+        self, queries: list[str], groups: dict[str, tuple[str, int]], threshold: float
+    ) -> dict[str, list[list[tuple[Document, float]]]]:
+        """Same as search_hybrid_multi, returns (document, relevance score) pairs."""
+        embedded = await self._embed_queries(queries)
+        results = await self._search_multi(queries, groups, threshold, embedded)
+        if Memory._lexical_search_enabled():
+            results = await self._fuse_lexical(queries, groups, threshold, embedded, results)
+        self._record_access(doc for group in results.values() for docs in group for doc, _ in docs)
+        return results
+
+    async def _fuse_lexical(
+        self,
+        queries: list[str],
+        groups: dict[str, tuple[str, int]],
+        threshold: float,
+        embedded: dict[str, list[float]],
+        results: dict[str, list[list[tuple[Document, float]]]],
+    ) -> dict[str, list[list[tuple[Document, float]]]]:
+        lexical = await asyncio.to_thread(
+            self.db.lexical_search_multi,
+            queries,
+            [embedded[query] for query in queries],
+            [(Memory._get_filter(filter), limit) for filter, limit in groups.values()],
+        )
+        relevance = self.db._select_relevance_score_fn()
+        for (name, (_, limit)), group in zip(groups.items(), lexical):
+            results[name] = [
+                fuse_rankings(
+                    [semantic, Memory._above_threshold(keyword, relevance, threshold)],
+                    lambda result: Memory._doc_key(result[0]),
+                    limit,
+                )
+                for semantic, keyword in zip(results[name], group)
+            ]
+        return results
+
+    @staticmethod
+    def _above_threshold(
+        docs: list[tuple[Document, float]], relevance: Callable[[float], float], threshold: float
+    ) -> list[tuple[Document, float]]:
+        scored = [(doc, relevance(score)) for doc, score in docs]
+        return [(doc, score) for doc, score in scored if score >= threshold]
+
+    @staticmethod
+    def _without_scores(
+        results: dict[str, list[list[tuple[Document, float]]]],
+    ) -> dict[str, list[list[Document]]]:
+        return {
+            name: [[doc for doc, _ in docs] for docs in group] for name, group in results.items()
+        }
+
+    def _record_access(self, docs: Iterable[Document]):
+        if self.db.access_log:
+            self.db.access_log.record(
+                doc.metadata["id"] for doc in docs if doc.metadata.get("id")
             )
-            removed += docs
 
-            # Extract document IDs and filter based on score
-            # document_ids = [result[0].metadata["id"] for result in docs if result[1] < score_limit]
-            document_ids = [result.metadata["id"] for result in docs]
+    async def enforce_retention(self, dry_run: bool) -> dict[str, Any]:
+        """
+        Evict memories exceeding the retention policies of their area, knowledge documents are exempt.
+        Returns a report of the evicted (or, in a dry run, evictable) memories, also written next to the index.
+        """
+        policies = memory_retention.parse_policies(Memory._retention_policies())
+        access = self.db.access_log.get_all() if self.db.access_log else {}
+        plan = memory_retention.plan_evictions(self.db.iter_metadata(), policies, access)
+
+        report: dict[str, Any] = {
+            "memory_subdir": self.memory_subdir,
+            "time": Memory.get_timestamp(),
+            "dry_run": dry_run,
+            "areas": {},
+        }
+        evict_ids = []
+        for area, area_plan in plan.items():
+            evict = area_plan["evict"]
+            evict_ids.extend(id for id, _ in evict)
+            reasons: dict[str, int] = {}
+            for _, reason in evict:
+                reasons[reason] = reasons.get(reason, 0) + 1
+            samples = evict[: memory_retention.REPORT_SAMPLES]
+            docs = {doc.metadata.get("id"): doc for doc in self.db.get_by_ids([id for id, _ in samples])}
+            report["areas"][area] = {
+                "policy": dataclasses.asdict(area_plan["policy"]),
+                "documents": area_plan["documents"],
+                "evicted": len(evict),
+                "reasons": reasons,
+                "samples": [
+                    {
+                        "id": id,
+                        "reason": reason,
+                        "timestamp": docs[id].metadata.get("timestamp") if id in docs else None,
+                        "recalls": access.get(id, (0, 0))[0],
+                        "preview": docs[id].page_content[:100] if id in docs else "",
+                    }
+                    for id, reason in samples
+                ],
+            }
+
+        if evict_ids and not dry_run:
+            await self.delete_documents_by_ids(evict_ids)
+        if self.db.access_log:
+            self.db.access_log.retain(set(self.db.index_to_docstore_id.values()))
+
+        files.write_file(
+            os.path.join(Memory._abs_db_dir(self.memory_subdir), memory_retention.REPORT_FILE),
+            json.dumps(report, indent=2, ensure_ascii=False),
+        )
+        if evict_ids:
+            action = "Would evict" if dry_run else "Evicted"
+            PrintStyle.standard(
+                f"{action} {len(evict_ids)} memories in '{self.memory_subdir}' by retention policy"
+            )
+        return report
 
-            # Delete documents with IDs over the threshold score
-            if document_ids:
-                # fnd = self.db.get(where={"id": {"$in": document_ids}})
-                # if fnd["ids"]: self.db.delete(ids=fnd["ids"])
-                # tot += len(fnd["ids"])
-                await self.db.adelete(ids=document_ids)
-                tot += len(document_ids)
+    @staticmethod
+    async def run_maintenance():
+        """Background job: enforce retention policies on all loaded memory subdirs."""
+        if not memory_retention.maintenance_due():
+            return
+        dry_run = settings.get_settings()["memory_retention_dry_run"]
+        for memory_subdir, db in list(Memory.index.items()):
+            try:
+                await Memory(None, db, memory_subdir).enforce_retention(dry_run)  # type: ignore
+            except Exception as e:
+                PrintStyle.error(f"Memory retention failed in '{memory_subdir}': {e}")
 
-            # If fewer than K document IDs, break the loop
-            if len(document_ids) < k:
-                break
+    async def delete_documents_by_query(
+        self, query: str, threshold: float, filter: str = ""
+    ):
+        # one range search at the threshold instead of repeated top-k searches
+        embedding = await self.db._aembed_query(query)
+        comparator = Memory._get_filter(filter)
+        found = await asyncio.to_thread(
+            self.db.range_search_with_score_by_vector,
+            embedding,
+            Memory._cosine_score(threshold),
+            comparator,
+        )
+        removed = [doc for doc, _ in found]
 
-        if tot:
+        # delete all matches in one batch and persist once
+        if removed:
+            await self.db.adelete(ids=[doc.metadata["id"] for doc in removed])
             self._save_db()  # persist
+            self.db.compact_in_background(Memory._compaction_ratio())
         return removed
 
     async def delete_documents_by_ids(self, ids: list[str]):
@@ -353,6 +1197,7 @@ class Memory:
 
         if rem_docs:
             self._save_db()  # persist
+            self.db.compact_in_background(Memory._compaction_ratio())
         return rem_docs
 
     async def insert_text(self, text, metadata: dict = {}):
@@ -373,10 +1218,33 @@ class Memory:
 
             await self.db.aadd_documents(documents=docs, ids=ids)
             self._save_db()  # persist
+            self._rebuild_index_in_background()
         return ids
 
+    def _rebuild_index_in_background(self):
+        # building an ANN index trains on and adds every vector, too slow for the event loop
+        config = settings.get_settings()["memory_index_type"]
+        if not memory_index.needs_rebuild(self.db.index, config):
+            return
+        db, memory_subdir = self.db, self.memory_subdir
+
+        async def rebuild():
+            try:
+                if Memory._rebuild_index_if_needed(None, db):
+                    Memory._save_db_file(db, memory_subdir)
+                    Memory._save_meta_file(db, memory_subdir)
+            except Exception as e:
+                PrintStyle.error(f"Memory index rebuild failed in '{memory_subdir}': {e}")
+
+        db.rebuild_in_background(rebuild)
+
     def _save_db(self):
-        Memory._save_db_file(self.db, self.memory_subdir)
+        if self.db.journal:
+            # changes are already persisted in the journal, snapshot only when it grows too large
+            if self.db.journal.size() > Memory._journal_compact_size():
+                Memory._compact_db(self.db, self.memory_subdir)
+        else:
+            Memory._save_db_file(self.db, self.memory_subdir)
 
     def _generate_doc_id(self):
         while True:
@@ -386,9 +1254,501 @@ class Memory:
             
 
     @staticmethod
-    def _save_db_file(db: MyFaiss, memory_subdir: str):
+    def _create_embedder(
+        embeddings_model: Embeddings, provider: str, name: str, em_dir: str, in_memory: bool
+    ) -> CacheBackedEmbeddings:
+        embeddings_model_id = files.safe_file_name(provider + "_" + name)
+
+        # here we setup the embeddings model with the chosen cache storage
+        if in_memory:
+            return CacheBackedEmbeddings.from_bytes_store(
+                embeddings_model, InMemoryByteStore(), namespace=embeddings_model_id
+            )
+        os.makedirs(em_dir, exist_ok=True)
+        cache = EmbeddingCache.get(
+            em_dir, settings.get_settings()["memory_embedding_cache_mb"] * 1024 * 1024
+        )
+        return CacheBackedEmbeddings(
+            embeddings_model, EmbeddingCacheStore(cache, embeddings_model_id)
+        )
+
+    @staticmethod
+    def _previous_embedder(
+        embedding_set: dict, model_config: models.ModelConfig, em_dir: str
+    ) -> CacheBackedEmbeddings | None:
+        """Embedder for the model the index was built with, None when it cannot be loaded anymore."""
+        provider = embedding_set.get("model_provider")
+        name = embedding_set.get("model_name")
+        if not provider or not name:
+            return None
+        try:
+            # connection settings of the configured model only apply to the same provider
+            kwargs = model_config.build_kwargs() if provider == model_config.provider else {}
+            model = models.get_embedding_model(provider, name, **kwargs)
+            embedder = Memory._create_embedder(model, provider, name, em_dir, False)
+            embedder.embed_query("example")
+            return embedder
+        except Exception as e:
+            PrintStyle.warning(
+                f"Previous embedding model {provider}/{name} is not available, re-indexing memory before use: {e}"
+            )
+            return None
+
+    @staticmethod
+    def _reindex_checkpoint(
+        db_dir: str, embedder: Embeddings, model_config: models.ModelConfig
+    ) -> ReindexCheckpoint:
+        return ReindexCheckpoint(
+            db_dir,
+            {
+                "model_provider": model_config.provider,
+                "model_name": model_config.name,
+                "dim": len(embedder.embed_query("example")),
+            },
+        )
+
+    @staticmethod
+    def _reindex_docs(
+        log_item: LogItem | None,
+        db: MyFaiss,
+        docs: dict[str, Document],
+        db_dir: str,
+        model_config: models.ModelConfig,
+        in_memory: bool,
+    ):
+        """Embed documents into a new DB in batches, resuming from the checkpoint of an interrupted run."""
+        checkpoint = (
+            None
+            if in_memory
+            else Memory._reindex_checkpoint(db_dir, db.embedding_function, model_config)
+        )
+        done_ids, done_vectors = checkpoint.load() if checkpoint else ([], None)
+        keep = [i for i, id in enumerate(done_ids) if id in docs]
+        done = set(done_ids)
+        todo = [id for id in docs if id not in done]
+
+        async def embed():
+            return await embed_batches(
+                db.embedding_function,
+                todo,
+                lambda batch: [docs[id].page_content for id in batch],
+                checkpoint,
+                Memory._reindex_batch_size(),
+                Memory._reindex_workers(),
+                log_item,
+                done=len(keep),
+                total=len(docs),
+            )
+
+        ids, vectors = DeferredTask(thread_name="MemoryReindex").start_task(embed).result_sync()
+        if done_vectors is not None and keep:
+            ids = [done_ids[i] for i in keep] + ids
+            vectors = np.concatenate([done_vectors[keep], vectors])
+        if ids:
+            db.add_vectors(
+                [docs[id].page_content for id in ids],
+                vectors,
+                metadatas=[docs[id].metadata for id in ids],
+                ids=ids,
+            )
+
+    @staticmethod
+    def _start_reindex(
+        log_item: LogItem | None,
+        db: MyFaiss,
+        embedder: Embeddings,
+        checkpoint: ReindexCheckpoint,
+        memory_subdir: str,
+        model_config: models.ModelConfig,
+    ):
+        # keep a reference, the task is cancelled when garbage collected
+        Memory._reindex_tasks[memory_subdir] = DeferredTask(
+            thread_name="MemoryReindex"
+        ).start_task(
+            Memory._reindex, log_item, db, embedder, checkpoint, memory_subdir, model_config
+        )
+
+    @staticmethod
+    def _stop_reindex(memory_subdir: str):
+        task = Memory._reindex_tasks.pop(memory_subdir, None)
+        if task:
+            task.kill()
+
+    @staticmethod
+    async def _reindex(
+        log_item: LogItem | None,
+        db: MyFaiss,
+        embedder: Embeddings,
+        checkpoint: ReindexCheckpoint,
+        memory_subdir: str,
+        model_config: models.ModelConfig,
+    ):
+        """Re-embed all documents with the new model while the old index keeps serving, then swap."""
+        try:
+            PrintStyle.standard("Re-indexing memory with the new embedding model...")
+            ids, vectors = checkpoint.load()
+            embedded = list(ids)
+            parts = [vectors]
+            attempted = set(ids)
+            while True:
+                with db.lock:
+                    live = list(db.index_to_docstore_id.values())
+                    todo = [id for id in live if id not in attempted]
+                    if not todo:
+                        # documents inserted while embedding are caught up above, swap atomically
+                        config = settings.get_settings()["memory_index_type"]
+                        db.replace_embeddings(
+                            embedder,
+                            embedded,
+                            np.concatenate(parts),
+                            memory_index.resolve_index_type(config, len(live)),
+                        )
+                        break
+                attempted.update(todo)
+                ids, vectors = await embed_batches(
+                    embedder,
+                    todo,
+                    db.get_texts,
+                    checkpoint,
+                    Memory._reindex_batch_size(),
+                    Memory._reindex_workers(),
+                    log_item,
+                    done=len(live) - len(todo),
+                    total=len(live),
+                )
+                embedded.extend(ids)
+                parts.append(vectors)
+
+            Memory._save_db_file(db, memory_subdir, model_config)
+            checkpoint.clear()
+            PrintStyle.standard("Memory re-index finished")
+            if log_item:
+                log_item.stream(progress="\nMemory re-index finished")
+        except Exception as e:
+            PrintStyle.error(f"Memory re-index failed in '{memory_subdir}': {e}")
+
+    @staticmethod
+    def export_snapshot(
+        memory_subdir: str, out_dir: str, dtype: str = "float32"
+    ) -> dict[str, Any]:
+        """Write a loaded memory subdir to a portable snapshot directory, returns its manifest."""
+        db = Memory.index.get(memory_subdir)
+        if not db:
+            raise ValueError(f"Memory '{memory_subdir}' is not loaded")
+        with db.lock:
+            # inserts grow the index in place, so the export reads a copy taken under the lock
+            index = memory_index.owned_copy(db.index)
+            positions = sorted(db.index_to_docstore_id)
+            ids = [db.index_to_docstore_id[pos] for pos in positions]
+        meta_file = files.get_abs_path(Memory._abs_db_dir(memory_subdir), "embedding.json")
+        meta = json.loads(files.read_file(meta_file)) if files.exists(meta_file) else {}
+        return memory_snapshot.write_snapshot(
+            out_dir,
+            index,
+            positions,
+            ids,
+            db.get_by_ids,
+            {
+                "model_provider": meta.get("model_provider"),
+                "model_name": meta.get("model_name"),
+            },
+            dtype=dtype,
+            # flat indexes are rebuilt from the vectors, ANN structures are kept
+            include_index=memory_index.get_index_type(index) != memory_index.FLAT,
+        )
+
+    @staticmethod
+    def import_snapshot(src_dir: str, memory_subdir: str):
+        """Copy a snapshot export into an empty memory subdir, it is converted on the next initialize."""
+        db_dir = Memory._abs_db_dir(memory_subdir)
+        if files.exists(db_dir, "index.faiss"):
+            raise ValueError(f"Memory '{memory_subdir}' already exists")
+        manifest = memory_snapshot.SnapshotReader(src_dir).manifest
+        os.makedirs(db_dir, exist_ok=True)
+        for name in manifest["files"].values():
+            if name:
+                shutil.copyfile(os.path.join(src_dir, name), os.path.join(db_dir, name))
+        # copied last, like the export marks completion
+        shutil.copyfile(
+            os.path.join(src_dir, memory_snapshot.MANIFEST_FILE),
+            os.path.join(db_dir, memory_snapshot.MANIFEST_FILE),
+        )
+        Memory.index.pop(memory_subdir, None)
+
+    @staticmethod
+    def _import_snapshot(log_item: LogItem | None, db_dir: str, in_memory: bool):
+        PrintStyle.standard("Importing memory snapshot...")
+        if log_item:
+            log_item.stream(progress="\nImporting memory snapshot")
+        reader = memory_snapshot.SnapshotReader(db_dir)
+
+        if not in_memory:
+            Memory._remove_docstore_file(db_dir)
+        docstore = Memory._create_docstore(db_dir, in_memory)
+        ids: list[str] = []
+        for docs in reader.iter_documents():
+            docstore.add({doc.id: doc for doc in docs})  # type: ignore
+            ids.extend(doc.id for doc in docs)  # type: ignore
+
+        # same steps as _write_snapshot, without serializing the index to memory first
+        index_tmp = os.path.join(db_dir, "index.faiss.tmp")
+        index_path = reader.index_path()
+        if index_path:
+            shutil.copyfile(index_path, index_tmp)
+        else:
+            faiss.write_index(reader.build_index(), index_tmp)
+        with open(os.path.join(db_dir, "index.pkl.tmp"), "wb") as f:
+            pickle.dump((docstore, dict(enumerate(ids))), f)
+        files.write_file(os.path.join(db_dir, "snapshot.pending"), "")
+        Memory._recover_snapshot(db_dir)
+
+        # a different current model is handled by the regular re-index on load, an unknown one as well
+        manifest = reader.manifest
+        if manifest.get("model_provider") and manifest.get("model_name"):
+            meta = {key: manifest[key] for key in ("model_provider", "model_name", "index_type")}
+            files.write_file(os.path.join(db_dir, "embedding.json"), json.dumps(meta))
+        reader.remove()
+
+    @staticmethod
+    def _save_db_file(
+        db: MyFaiss, memory_subdir: str, model_config: models.ModelConfig | None = None
+    ):
+        """Write a snapshot, with the model the vectors belong to when given (swapped in together)."""
         abs_dir = Memory._abs_db_dir(memory_subdir)
-        db.save_local(folder_path=abs_dir)
+        journal = db.journal or MemoryJournal(abs_dir)
+        with journal.lock:
+            journal.generation += 1
+            index_data, store_data = Memory._serialize_db(db)
+            meta = Memory._meta(db, memory_subdir, model_config) if model_config else None
+            with journal.snapshot_lock:
+                Memory._write_snapshot(abs_dir, index_data, store_data, meta)
+            journal.clear()  # snapshot contains everything journaled so far
+
+    @staticmethod
+    def _compact_db(db: MyFaiss, memory_subdir: str):
+        journal = db.journal
+        if not journal:
+            return
+        # serialize under the lock so the snapshot matches the rotated journal exactly
+        with journal.lock:
+            if not journal.rotate():
+                return  # compaction already in progress
+            journal.generation += 1
+            generation = journal.generation
+            index_data, store_data = Memory._serialize_db(db)
+
+        abs_dir = Memory._abs_db_dir(memory_subdir)
+
+        async def write_snapshot():
+            try:
+                with journal.snapshot_lock:
+                    if generation != journal.generation:
+                        return  # a newer snapshot has been written meanwhile
+                    Memory._write_snapshot(abs_dir, index_data, store_data)
+                journal.drop_rotated()
+            except Exception as e:
+                PrintStyle.error(f"Memory compaction failed in '{memory_subdir}': {e}")
+
+        # keep a reference, the task is cancelled when garbage collected
+        db._snapshot_task = DeferredTask(thread_name="MemoryCompaction").start_task(
+            write_snapshot
+        )
+
+    @staticmethod
+    def _serialize_db(db: MyFaiss) -> tuple[np.ndarray, bytes]:
+        with db.lock:
+            index_data = faiss.serialize_index(db.index)
+            store_data = pickle.dumps((db.docstore, db.index_to_docstore_id))
+        return index_data, store_data
+
+    @staticmethod
+    def _write_snapshot(
+        abs_dir: str, index_data: np.ndarray, store_data: bytes, meta: dict | None = None
+    ):
+        # write the files aside first, the marker makes the swap recoverable after a crash
+        os.makedirs(abs_dir, exist_ok=True)
+        with open(os.path.join(abs_dir, "index.faiss.tmp"), "wb") as f:
+            f.write(index_data.tobytes())
+        with open(os.path.join(abs_dir, "index.pkl.tmp"), "wb") as f:
+            f.write(store_data)
+        if meta is not None:
+            # vectors of another model must never be loaded with the previous meta file
+            files.write_file(os.path.join(abs_dir, "embedding.json.tmp"), json.dumps(meta))
+        files.write_file(os.path.join(abs_dir, "snapshot.pending"), "")
+        Memory._recover_snapshot(abs_dir)
+
+    @staticmethod
+    def _recover_snapshot(abs_dir: str):
+        marker = os.path.join(abs_dir, "snapshot.pending")
+        for name in ("index.faiss", "index.pkl", "embedding.json"):
+            tmp = os.path.join(abs_dir, name + ".tmp")
+            if os.path.exists(tmp):
+                if os.path.exists(marker):
+                    os.replace(tmp, os.path.join(abs_dir, name))
+                else:
+                    os.remove(tmp)  # incomplete snapshot, previous one is still valid
+        if os.path.exists(marker):
+            os.remove(marker)
+
+    @staticmethod
+    def _replay_journal(log_item: LogItem | None, db: MyFaiss, journal: MemoryJournal):
+        PrintStyle.standard("Replaying memory journal...")
+        if log_item:
+            log_item.stream(progress="\nReplaying memory journal")
+
+        existing = set(db.index_to_docstore_id.values())
+        pending: list[dict] = []
+
+        def flush_adds():
+            if pending:
+                db.add_vectors(
+                    [rec["text"] for rec in pending],
+                    np.stack([rec["vector"] for rec in pending]),
+                    metadatas=[rec["metadata"] for rec in pending],
+                    ids=[rec["id"] for rec in pending],
+                )
+                pending.clear()
+
+        for rec in journal.read():
+            if rec["op"] == "add":
+                if rec["id"] not in existing:  # already in snapshot
+                    existing.add(rec["id"])
+                    pending.append(rec)
+            elif rec["op"] == "del":
+                flush_adds()
+                ids = [id for id in rec["ids"] if id in existing]
+                if ids:
+                    db.delete(ids)
+                    existing.difference_update(ids)
+        flush_adds()
+
+    @staticmethod
+    def _apply_journal_to_docs(docs: dict[str, Document], journal: MemoryJournal):
+        for rec in journal.read():
+            if rec["op"] == "add":
+                docs[rec["id"]] = Document(
+                    id=rec["id"], page_content=rec["text"], metadata=rec["metadata"]
+                )
+            elif rec["op"] == "del":
+                for id in rec["ids"]:
+                    docs.pop(id, None)
+
+    @staticmethod
+    def _rebuild_index_if_needed(log_item: LogItem | None, db: MyFaiss) -> bool:
+        config = settings.get_settings()["memory_index_type"]
+        if not memory_index.needs_rebuild(db.index, config):
+            return False
+        index_type = memory_index.resolve_index_type(config, db.index.ntotal)
+        PrintStyle.standard(f"Rebuilding memory index as '{index_type}'...")
+        if log_item:
+            log_item.stream(progress=f"\nRebuilding memory index as '{index_type}'")
+        return db.rebuild_index(index_type)
+
+    @staticmethod
+    def _save_meta_file(
+        db: MyFaiss,
+        memory_subdir: str,
+        model_config: models.ModelConfig | None = None,
+    ):
+        meta_file_path = files.get_abs_path(
+            Memory._abs_db_dir(memory_subdir), "embedding.json"
+        )
+        files.write_file(meta_file_path, json.dumps(Memory._meta(db, memory_subdir, model_config)))
+
+    @staticmethod
+    def _meta(
+        db: MyFaiss, memory_subdir: str, model_config: models.ModelConfig | None = None
+    ) -> dict[str, Any]:
+        meta_file_path = files.get_abs_path(
+            Memory._abs_db_dir(memory_subdir), "embedding.json"
+        )
+        meta = {}
+        if files.exists(meta_file_path):
+            meta = json.loads(files.read_file(meta_file_path))
+        if model_config:
+            meta["model_provider"] = model_config.provider
+            meta["model_name"] = model_config.name
+        meta["index_type"] = memory_index.get_index_type(db.index)
+        return meta
+
+    @staticmethod
+    def _journal_enabled() -> bool:
+        return settings.get_settings()["memory_journal_enabled"]
+
+    @staticmethod
+    def _journal_compact_size() -> int:
+        return settings.get_settings()["memory_journal_compact_mb"] * 1024 * 1024
+
+    @staticmethod
+    def _docstore_lazy() -> bool:
+        return settings.get_settings()["memory_docstore_lazy"]
+
+    @staticmethod
+    def _create_docstore(db_dir: str, in_memory: bool) -> InMemoryDocstore | SQLiteDocstore:
+        if in_memory or not Memory._docstore_lazy():
+            return InMemoryDocstore()
+        return SQLiteDocstore(os.path.join(db_dir, DOCSTORE_FILE))
+
+    @staticmethod
+    def _prepare_docstore(db: MyFaiss, db_dir: str, in_memory: bool) -> bool:
+        """Open a loaded SQLite docstore or move in-memory documents to one, True when moved."""
+        if isinstance(db.docstore, SQLiteDocstore):
+            db.docstore.open(os.path.join(db_dir, DOCSTORE_FILE))
+            return False
+        if in_memory or not Memory._docstore_lazy():
+            return False
+        PrintStyle.standard("Moving memory documents to the SQLite docstore...")
+        docstore = SQLiteDocstore(os.path.join(db_dir, DOCSTORE_FILE))
+        docstore.add(db.docstore._dict)  # type: ignore
+        db.docstore = docstore
+        return True
+
+    @staticmethod
+    def _remove_docstore_file(db_dir: str):
+        for suffix in ("", "-wal", "-shm"):
+            path = os.path.join(db_dir, DOCSTORE_FILE + suffix)
+            if os.path.exists(path):
+                os.remove(path)
+
+    @staticmethod
+    def _knowledge_watch_enabled() -> bool:
+        return settings.get_settings()["memory_knowledge_watch"]
+
+    @staticmethod
+    def _knowledge_import_workers() -> int:
+        return settings.get_settings()["memory_knowledge_import_workers"]
+
+    @staticmethod
+    def _index_mmap() -> bool:
+        return settings.get_settings()["memory_index_mmap"]
+
+    @staticmethod
+    def _compaction_ratio() -> float:
+        return settings.get_settings()["memory_compaction_ratio"]
+
+    @staticmethod
+    def _retention_policies() -> dict[str, Any]:
+        return settings.get_settings()["memory_retention"]
+
+    @staticmethod
+    def _lexical_search_enabled() -> bool:
+        return settings.get_settings()["memory_lexical_search"]
+
+    @staticmethod
+    def _reindex_batch_size() -> int:
+        return settings.get_settings()["memory_reindex_batch_size"]
+
+    @staticmethod
+    def _reindex_workers() -> int:
+        return settings.get_settings()["memory_reindex_workers"]
+
+    @staticmethod
+    def _get_filter(condition: str) -> MetadataFilter | None:
+        return MetadataFilter(condition, Memory._get_comparator(condition)) if condition else None
+
+    @staticmethod
+    def _doc_key(doc: Document) -> str:
+        return doc.metadata.get("id") or doc.id or doc.page_content
 
     @staticmethod
     def _get_comparator(condition: str):
@@ -415,6 +1775,11 @@ class Memory:
         )  # float precision can cause values like 1.0000000596046448
         return res
 
+    @staticmethod
+    def _cosine_score(relevance: float) -> float:
+        # inverse of _cosine_normalizer, relevance threshold to raw inner product score
+        return 2 * relevance - 1
+
     @staticmethod
     def _abs_db_dir(memory_subdir: str) -> str:
         return files.get_abs_path("memory", memory_subdir)
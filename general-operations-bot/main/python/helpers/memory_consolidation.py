@@ -32,8 +32,6 @@ class ConsolidationConfig:
     consolidation_sys_prompt: str = "memory.consolidation.sys.md"
     consolidation_msg_prompt: str = "memory.consolidation.msg.md"
     max_llm_context_memories: int = 5
-    keyword_extraction_sys_prompt: str = "memory.keyword_extraction.sys.md"
-    keyword_extraction_msg_prompt: str = "memory.keyword_extraction.msg.md"
     processing_timeout_seconds: int = 60
     # Add safety threshold for REPLACE actions
     replace_similarity_threshold: float = 0.9  # Higher threshold for replacement safety
@@ -336,127 +334,33 @@ class MemoryConsolidator:
         """
         db = await Memory.get(self.agent)
 
-        # Step 1: Extract keywords/queries for enhanced search
-        search_queries = await self._extract_search_keywords(new_memory, log_item)
-
-        all_similar = []
-
-        # Step 2: Semantic similarity search with scores
-        semantic_similar = await db.search_similarity_threshold(
-            query=new_memory,
-            limit=self.config.max_similar_memories,
+        # Step 1 + 2: Semantic similarity and keyword (BM25) matches of the memory itself,
+        # fused into a single ranking, keyword matches are held to the same similarity threshold
+        results = await db.search_hybrid_multi_with_scores(
+            queries=[new_memory],
+            groups={
+                "area": (f"area == '{area}'", self.config.max_similar_memories)
+            },
             threshold=self.config.similarity_threshold,
-            filter=f"area == '{area}'"
         )
-        all_similar.extend(semantic_similar)
-
-        # Step 3: Keyword-based searches
-        for query in search_queries:
-            if query.strip():
-                # Fix division by zero: ensure len(search_queries) > 0
-                queries_count = max(1, len(search_queries))  # Prevent division by zero
-                keyword_similar = await db.search_similarity_threshold(
-                    query=query.strip(),
-                    limit=max(3, self.config.max_similar_memories // queries_count),
-                    threshold=self.config.similarity_threshold,
-                    filter=f"area == '{area}'"
-                )
-                all_similar.extend(keyword_similar)
+        all_similar = results["area"][0]
 
-        # Step 4: Deduplicate by document ID and store similarity info
+        # Step 3: Deduplicate by document ID and store similarity info
         seen_ids = set()
         unique_similar = []
-        for doc in all_similar:
+        for doc, similarity in all_similar:
             doc_id = doc.metadata.get('id')
             if doc_id and doc_id not in seen_ids:
                 seen_ids.add(doc_id)
+                # Step 4: Keep the cosine similarity to the new memory for replacement validation
+                doc.metadata['_consolidation_similarity'] = similarity
                 unique_similar.append(doc)
 
-        # Step 5: Calculate similarity scores for replacement validation
-        # Since FAISS doesn't directly expose similarity scores, use ranking-based estimation
-        # CRITICAL: All documents must have similarity >= search_threshold since FAISS returned them
-        # FIXED: Use conservative scoring that keeps all scores in safe consolidation range
-        similarity_scores = {}
-        total_docs = len(unique_similar)
-        search_threshold = self.config.similarity_threshold
-        safety_threshold = self.config.replace_similarity_threshold
-
-        for i, doc in enumerate(unique_similar):
-            doc_id = doc.metadata.get('id')
-            if doc_id:
-                # Convert ranking to similarity score with conservative distribution
-                if total_docs == 1:
-                    ranking_similarity = 1.0  # Single document gets perfect score
-                else:
-                    # Use conservative scoring: distribute between safety_threshold and 1.0
-                    # This ensures all scores are suitable for consolidation
-                    # First document gets 1.0, last gets safety_threshold (0.9 by default)
-                    ranking_factor = 1.0 - (i / (total_docs - 1))
-                    score_range = 1.0 - safety_threshold  # e.g., 1.0 - 0.9 = 0.1
-                    ranking_similarity = safety_threshold + (score_range * ranking_factor)
-
-                    # Ensure minimum score is search_threshold for logical consistency
-                    ranking_similarity = max(ranking_similarity, search_threshold)
-
-                similarity_scores[doc_id] = ranking_similarity
-
-        # Step 6: Add similarity score to document metadata for LLM analysis
-        for doc in unique_similar:
-            doc_id = doc.metadata.get('id')
-            estimated_similarity = similarity_scores.get(doc_id, 0.7)
-            # Store for later validation
-            doc.metadata['_consolidation_similarity'] = estimated_similarity
-
-        # Step 7: Limit to max context for LLM
+        # Step 6: Limit to max context for LLM
         limited_similar = unique_similar[:self.config.max_llm_context_memories]
 
         return limited_similar
 
-    async def _extract_search_keywords(
-        self,
-        new_memory: str,
-        log_item: Optional[LogItem] = None
-    ) -> List[str]:
-        """Extract search keywords/queries from new memory using utility LLM."""
-
-        try:
-            system_prompt = self.agent.read_prompt(
-                self.config.keyword_extraction_sys_prompt,
-            )
-
-            message_prompt = self.agent.read_prompt(
-                self.config.keyword_extraction_msg_prompt,
-                memory_content=new_memory
-            )
-
-            # Call utility LLM to extract search queries
-            keywords_response = await self.agent.call_utility_model(
-                system=system_prompt,
-                message=message_prompt,
-                background=True
-            )
-
-            # Parse the response - expect JSON array of strings
-            keywords_json = DirtyJson.parse_string(keywords_response.strip())
-
-            if isinstance(keywords_json, list):
-                return [str(k) for k in keywords_json if k]
-            elif isinstance(keywords_json, str):
-                return [keywords_json]
-            else:
-                return []
-
-        except Exception as e:
-            PrintStyle().warning(f"Keyword extraction failed: {str(e)}")
-            # Fallback: use intelligent truncation for search
-            # Take first 200 chars if short, or first sentence if longer, but cap at 200 chars
-            if len(new_memory) <= 200:
-                fallback_content = new_memory
-            else:
-                first_sentence = new_memory.split('.')[0]
-                fallback_content = first_sentence[:200] if len(first_sentence) <= 200 else new_memory[:200]
-            return [fallback_content.strip()]
-
     async def _analyze_memory_consolidation(
         self,
         context: MemoryAnalysisContext,
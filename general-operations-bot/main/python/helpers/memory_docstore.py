@@ -0,0 +1,166 @@
+import json
+import os
+import sqlite3
+import threading
+from typing import Any, Iterable, Iterator, Mapping
+
+from langchain_community.docstore.base import AddableMixin, Docstore
+from langchain_core.documents import Document
+
+DOCSTORE_FILE = "docstore.sqlite"
+READ_BATCH = 500
+
+
+class SQLiteDocstore(Docstore, AddableMixin):
+    """
+    Docstore keeping only ids and metadata in memory.
+    Page content lives in a SQLite file next to the index and is read on demand for search hits.
+    Pickling stores no documents, the file is reopened with open() after loading a snapshot.
+    """
+
+    def __init__(self, path: str | None = None):
+        self.path = path
+        self.lock = threading.RLock()
+        self.conn: sqlite3.Connection | None = None
+        self.metadata: dict[str, dict[str, Any]] = {}
+        if path:
+            self.open(path)
+
+    def open(self, path: str):
+        with self.lock:
+            if self.conn:
+                self.conn.close()
+            self.path = path
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute(
+                """CREATE TABLE IF NOT EXISTS docs (
+                    id TEXT PRIMARY KEY,
+                    content TEXT NOT NULL,
+                    metadata TEXT NOT NULL
+                )"""
+            )
+            self.metadata = {
+                id: json.loads(metadata)
+                for id, metadata in self.conn.execute("SELECT id, metadata FROM docs")
+            }
+
+    def __getstate__(self):
+        return {"path": self.path}
+
+    def __setstate__(self, state):
+        self.__init__()
+        self.path = state.get("path")
+
+    def __contains__(self, id: object) -> bool:
+        return id in self.metadata
+
+    def __len__(self) -> int:
+        return len(self.metadata)
+
+    def add(self, texts: dict[str, Document]) -> None:
+        rows = [
+            (id, doc.page_content, json.dumps(doc.metadata, ensure_ascii=False, default=str))
+            for id, doc in texts.items()
+        ]
+        with self.lock:
+            self._transaction(
+                "INSERT OR REPLACE INTO docs (id, content, metadata) VALUES (?, ?, ?)", rows
+            )
+            for id, doc in texts.items():
+                self.metadata[id] = doc.metadata
+
+    def delete(self, ids: list) -> None:
+        with self.lock:
+            self._transaction("DELETE FROM docs WHERE id = ?", [(id,) for id in ids])
+            for id in ids:
+                self.metadata.pop(id, None)
+
+    def retain(self, ids: set[str]):
+        """Delete documents not referenced by the index, left behind by an interrupted snapshot."""
+        orphans = [id for id in self.metadata if id not in ids]
+        if orphans:
+            self.delete(orphans)
+
+    def search(self, search: str) -> str | Document:
+        docs = self.mget([search])
+        return docs[0] if docs else f"ID {search} not found."
+
+    def mget(self, ids: Iterable[str]) -> list[Document]:
+        ids = [id for id in ids if id in self.metadata]
+        contents: dict[str, str] = {}
+        with self.lock:
+            for i in range(0, len(ids), READ_BATCH):
+                chunk = ids[i : i + READ_BATCH]
+                contents.update(
+                    self._conn().execute(
+                        f"SELECT id, content FROM docs WHERE id IN ({','.join('?' * len(chunk))})",
+                        chunk,
+                    )
+                )
+        return [self._document(id, contents[id]) for id in ids if id in contents]
+
+    def iter_documents(self) -> Iterator[tuple[str, Document]]:
+        # only one batch of contents is held in memory, the lock is released while it is consumed
+        with self.lock:
+            cursor = self._conn().execute("SELECT id, content FROM docs")
+        try:
+            while True:
+                with self.lock:
+                    rows = cursor.fetchmany(READ_BATCH)
+                if not rows:
+                    break
+                for id, content in rows:
+                    if id in self.metadata:
+                        yield id, self._document(id, content)
+        finally:
+            cursor.close()
+
+    def _document(self, id: str, content: str) -> Document:
+        # metadata is shared with the in-memory copy, like InMemoryDocstore shares documents
+        return Document(id=id, page_content=content, metadata=self.metadata[id])
+
+    def _transaction(self, sql: str, rows: list[tuple]):
+        conn = self._conn()
+        conn.execute("BEGIN")
+        try:
+            conn.executemany(sql, rows)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _conn(self) -> sqlite3.Connection:
+        if not self.conn:
+            raise RuntimeError(f"Docstore {self.path} is not open")
+        return self.conn
+
+
+class LazyDocuments(Mapping[str, Document]):
+    """Read-only id -> document view over a SQLiteDocstore, content is loaded when accessed."""
+
+    def __init__(self, docstore: SQLiteDocstore):
+        self.docstore = docstore
+
+    def __getitem__(self, id: str) -> Document:
+        doc = self.docstore.search(id)
+        if not isinstance(doc, Document):
+            raise KeyError(id)
+        return doc
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(list(self.docstore.metadata))
+
+    def __len__(self) -> int:
+        return len(self.docstore)
+
+    def __contains__(self, id: object) -> bool:
+        return id in self.docstore
+
+    def items(self):  # type: ignore
+        # one sequential read instead of a query per document
+        return self.docstore.iter_documents()
+
+    def values(self):  # type: ignore
+        return (doc for _, doc in self.docstore.iter_documents())
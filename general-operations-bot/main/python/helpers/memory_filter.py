@@ -0,0 +1,255 @@
+import ast
+import bisect
+from typing import Any, Callable, Hashable, Iterable
+
+# metadata fields kept in the inverted index, filters on other fields use the evaluator
+INDEXED_FIELDS = ("area", "knowledge_source", "source_file", "source_path", "document_uri")
+# fields that additionally support range comparisons (string timestamps sort chronologically)
+RANGE_FIELDS = ("timestamp",)
+
+_MISSING = object()
+
+
+class MetadataIndex:
+    """
+    Inverted index over common metadata fields of the documents in a vector store.
+    Resolves filter expressions to candidate document ids before the vector search.
+    """
+
+    def __init__(self):
+        self.values: dict[str, dict[Hashable, set[str]]] = {
+            field: {} for field in INDEXED_FIELDS + RANGE_FIELDS
+        }
+        self.present: dict[str, set[str]] = {
+            field: set() for field in INDEXED_FIELDS + RANGE_FIELDS
+        }
+        self.ranges: dict[str, list[tuple[str, str]]] = {field: [] for field in RANGE_FIELDS}
+        self._ranges_dirty = False
+
+    @staticmethod
+    def from_metadata(items: Iterable[tuple[str, dict[str, Any]]]) -> "MetadataIndex":
+        index = MetadataIndex()
+        index.add(items)
+        return index
+
+    def add(self, items: Iterable[tuple[str, dict[str, Any]]]):
+        for id, metadata in items:
+            for field in INDEXED_FIELDS:
+                value = metadata.get(field, _MISSING)
+                if value is _MISSING:
+                    continue
+                self.present[field].add(id)
+                if isinstance(value, Hashable):
+                    self.values[field].setdefault(value, set()).add(id)
+            for field in RANGE_FIELDS:
+                value = metadata.get(field)
+                if isinstance(value, str):
+                    self.present[field].add(id)
+                    self.values[field].setdefault(value, set()).add(id)
+                    self.ranges[field].append((value, id))
+                    self._ranges_dirty = True
+
+    def remove(self, items: Iterable[tuple[str, dict[str, Any]]]):
+        removed_ranges = False
+        for id, metadata in items:
+            for field in INDEXED_FIELDS + RANGE_FIELDS:
+                if id not in self.present[field]:
+                    continue
+                self.present[field].discard(id)
+                value = metadata.get(field)
+                if isinstance(value, Hashable) and value in self.values[field]:
+                    ids = self.values[field][value]
+                    ids.discard(id)
+                    if not ids:
+                        del self.values[field][value]
+                if field in RANGE_FIELDS:
+                    removed_ranges = True
+        if removed_ranges:
+            for field in RANGE_FIELDS:
+                present = self.present[field]
+                self.ranges[field] = [r for r in self.ranges[field] if r[1] in present]
+
+    def resolve(self, plan: "FilterPlan") -> set[str]:
+        return self._eval(plan.node)
+
+    def _eval(self, node: tuple) -> set[str]:
+        kind = node[0]
+        if kind == "and":
+            result = self._eval(node[1][0])
+            for child in node[1][1:]:
+                result = result & self._eval(child)
+            return result
+        if kind == "or":
+            # simple_eval stops at the first true operand and fails (no match) when an operand
+            # before it references a missing field, later operands only count where all earlier ones were false
+            result: set[str] = set()
+            falsy: set[str] | None = None
+            for i, child in enumerate(node[1]):
+                matched = self._eval(child)
+                result |= matched if falsy is None else matched & falsy
+                if i < len(node[1]) - 1:
+                    false = self._defined(child) - matched
+                    falsy = false if falsy is None else falsy & false
+            return result
+        if kind == "not":
+            return self._defined(node[1]) - self._eval(node[1])
+        field = node[1]
+        if kind == "eq":
+            return set(self.values[field].get(node[2], ()))
+        if kind == "ne":
+            return self.present[field] - self.values[field].get(node[2], set())
+        if kind == "truthy":
+            return {id for value, ids in self.values[field].items() if value for id in ids}
+        if kind == "range":
+            return self._range(field, node[2], node[3])
+        raise ValueError(f"Unknown filter node {kind}")
+
+    def _defined(self, node: tuple) -> set[str]:
+        """Documents for which the evaluator computes the node without an error such as a missing field."""
+        kind = node[0]
+        if kind in ("and", "or"):
+            # operands after the deciding one are not evaluated
+            result: set[str] = set()
+            reached: set[str] | None = None
+            for i, child in enumerate(node[1]):
+                defined = self._defined(child)
+                if reached is not None:
+                    defined = defined & reached
+                if i == len(node[1]) - 1:
+                    return result | defined
+                matched = self._eval(child)
+                # "and" stops at a false operand, "or" at a true one
+                stops = defined - matched if kind == "and" else defined & matched
+                result |= stops
+                reached = defined - stops
+            return result
+        if kind == "not":
+            return self._defined(node[1])
+        return self.present[node[1]]
+
+    def _range(self, field: str, op: str, bound: str) -> set[str]:
+        if self._ranges_dirty:
+            for f in RANGE_FIELDS:
+                self.ranges[f].sort()
+            self._ranges_dirty = False
+        entries = self.ranges[field]
+        if op == "<":
+            return {id for _, id in entries[: bisect.bisect_left(entries, (bound,))]}
+        if op == "<=":
+            return {id for _, id in entries[: bisect.bisect_right(entries, (bound, "\uffff"))]}
+        if op == ">":
+            return {id for _, id in entries[bisect.bisect_right(entries, (bound, "\uffff")) :]}
+        return {id for _, id in entries[bisect.bisect_left(entries, (bound,)) :]}
+
+
+class FilterPlan:
+    """Indexed part of a filter expression, exact when it covers the whole expression."""
+
+    def __init__(self, node: tuple, exact: bool):
+        self.node = node
+        self.exact = exact
+
+
+class MetadataFilter:
+    """
+    Filter condition passed to the vector store.
+    Callable like a plain comparator, but carries a plan for the metadata index when the condition allows it.
+    """
+
+    def __init__(self, condition: str, comparator: Callable[[dict[str, Any]], bool]):
+        self.condition = condition
+        self.comparator = comparator
+        self.plan = compile_filter(condition)
+
+    def __call__(self, metadata: dict[str, Any]) -> bool:
+        return self.comparator(metadata)
+
+
+def compile_filter(condition: str) -> FilterPlan | None:
+    """Translate a filter expression to an index plan, None when nothing in it is indexable."""
+    try:
+        tree = ast.parse(condition.strip(), mode="eval")
+    except SyntaxError:
+        return None
+    result = _compile(tree.body)
+    if result is None:
+        return None
+    node, exact = result
+    return FilterPlan(node, exact)
+
+
+def _compile(node: ast.AST) -> tuple[tuple, bool] | None:
+    if isinstance(node, ast.BoolOp):
+        children = [_compile(value) for value in node.values]
+        if isinstance(node.op, ast.And):
+            # indexed conjuncts narrow the candidates, the rest is checked by the evaluator
+            compiled = [c for c in children if c is not None]
+            if not compiled:
+                return None
+            exact = len(compiled) == len(children) and all(c[1] for c in compiled)
+            return ("and", [c[0] for c in compiled]), exact
+        if any(c is None or not c[1] for c in children):
+            return None
+        return ("or", [c[0] for c in children]), True  # type: ignore
+
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.Not):
+        child = _compile(node.operand)
+        if child is None or not child[1]:
+            return None
+        return ("not", child[0]), True
+
+    if isinstance(node, ast.Name) and node.id in INDEXED_FIELDS:
+        return ("truthy", node.id), True
+
+    if isinstance(node, ast.Compare):
+        parts = []
+        left = node.left
+        for op, right in zip(node.ops, node.comparators):
+            part = _compile_comparison(left, op, right)
+            if part is None:
+                return None
+            parts.append(part)
+            left = right
+        if len(parts) == 1:
+            return parts[0], True
+        return ("and", parts), True
+
+    return None
+
+
+def _compile_comparison(left: ast.AST, op: ast.cmpop, right: ast.AST) -> tuple | None:
+    # normalize to "field op constant"
+    if isinstance(right, ast.Name) and not isinstance(left, ast.Name):
+        swapped = {ast.Lt: ast.Gt, ast.LtE: ast.GtE, ast.Gt: ast.Lt, ast.GtE: ast.LtE}
+        if isinstance(op, (ast.Eq, ast.NotEq)):
+            left, right = right, left
+        elif type(op) in swapped:
+            left, right, op = right, left, swapped[type(op)]()
+        else:
+            return None
+    if not isinstance(left, ast.Name):
+        return None
+    field = left.id
+    if field not in INDEXED_FIELDS and field not in RANGE_FIELDS:
+        return None
+
+    # membership tests are left to the evaluator, it rejects list, tuple and set literals
+    value = _constant(right)
+    if value is _MISSING:
+        return None
+    if isinstance(op, ast.Eq):
+        return ("eq", field, value)
+    if isinstance(op, ast.NotEq):
+        return ("ne", field, value)
+    if field in RANGE_FIELDS and isinstance(value, str):
+        ops = {ast.Lt: "<", ast.LtE: "<=", ast.Gt: ">", ast.GtE: ">="}
+        if type(op) in ops:
+            return ("range", field, ops[type(op)], value)
+    return None
+
+
+def _constant(node: ast.AST) -> Any:
+    if isinstance(node, ast.Constant) and isinstance(node.value, Hashable):
+        return node.value
+    return _MISSING
+
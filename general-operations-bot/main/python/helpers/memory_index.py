@@ -0,0 +1,281 @@
+import math
+from typing import Literal
+
+import numpy as np
+
+# faiss needs to be patched for python 3.12 on arm #TODO remove once not needed
+from python.helpers import faiss_monkey_patch
+import faiss
+
+IndexType = Literal["flat", "hnsw", "ivf_flat", "ivf_pq"]
+IndexConfig = Literal["auto", "flat", "hnsw", "ivf_flat", "ivf_pq"]
+
+FLAT: IndexType = "flat"
+HNSW: IndexType = "hnsw"
+IVF_FLAT: IndexType = "ivf_flat"
+IVF_PQ: IndexType = "ivf_pq"
+INDEX_CONFIGS = ["auto", FLAT, HNSW, IVF_FLAT, IVF_PQ]
+
+AUTO_HNSW_MIN_DOCS = 50_000  # "auto" switches from flat to HNSW above this size
+IVF_MIN_DOCS = 20_000  # IVF needs enough vectors to train, flat is used below
+IVF_TRAIN_SAMPLE_PER_LIST = 256
+IVF_NPROBE = 16
+HNSW_M = 32
+HNSW_EF_CONSTRUCTION = 80
+HNSW_EF_SEARCH = 64
+PQ_BITS = 8
+SUBSET_EXACT_MAX = 4096  # candidate sets up to this size are scored exactly instead of searching the index
+
+
+def resolve_index_type(config: str, ntotal: int) -> IndexType:
+    """Pick the concrete index type for a configured value and corpus size."""
+    if config == "auto":
+        return HNSW if ntotal >= AUTO_HNSW_MIN_DOCS else FLAT
+    if config in (IVF_FLAT, IVF_PQ):
+        return config if ntotal >= IVF_MIN_DOCS else FLAT  # type: ignore
+    if config == HNSW:
+        return HNSW
+    return FLAT
+
+
+def get_index_type(index: faiss.Index) -> IndexType:
+    if isinstance(index, faiss.IndexHNSW):
+        return HNSW
+    if isinstance(index, faiss.IndexIVFPQ):
+        return IVF_PQ
+    if isinstance(index, faiss.IndexIVF):
+        return IVF_FLAT
+    return FLAT
+
+
+def ivf_nlist(ntotal: int) -> int:
+    return max(16, min(65536, int(4 * math.sqrt(max(ntotal, 1)))))
+
+
+def needs_rebuild(index: faiss.Index, config: str) -> bool:
+    """True when the corpus crossed a size threshold and the index should be migrated or retrained."""
+    current = get_index_type(index)
+    if resolve_index_type(config, index.ntotal) != current:
+        return True
+    if current in (IVF_FLAT, IVF_PQ):
+        # retrain once the ideal list count doubled, i.e. the corpus grew ~4x since training
+        return ivf_nlist(index.ntotal) >= faiss.extract_index_ivf(index).nlist * 2
+    return False
+
+
+def is_lossy(index: faiss.Index) -> bool:
+    return get_index_type(index) == IVF_PQ
+
+
+def create_index(
+    index_type: IndexType, dim: int, vectors: np.ndarray | None = None
+) -> faiss.Index:
+    """Create an inner-product index of the given type, train it on the vectors if needed and add them."""
+    if vectors is None:
+        vectors = np.zeros((0, dim), dtype=np.float32)
+
+    if index_type == HNSW:
+        index = faiss.IndexHNSWFlat(dim, HNSW_M, faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+    elif index_type in (IVF_FLAT, IVF_PQ) and len(vectors) >= IVF_MIN_DOCS:
+        nlist = ivf_nlist(len(vectors))
+        quantizer = faiss.IndexFlatIP(dim)
+        if index_type == IVF_PQ:
+            index = faiss.IndexIVFPQ(
+                quantizer, dim, nlist, _pq_subquantizers(dim), PQ_BITS, faiss.METRIC_INNER_PRODUCT
+            )
+        else:
+            index = faiss.IndexIVFFlat(quantizer, dim, nlist, faiss.METRIC_INNER_PRODUCT)
+        index.train(_train_sample(vectors, nlist * IVF_TRAIN_SAMPLE_PER_LIST))
+    else:
+        index = faiss.IndexFlatIP(dim)
+
+    configure_index(index)
+    if len(vectors):
+        index.add(vectors)
+    return index
+
+
+def configure_index(index: faiss.Index):
+    """Apply search-time parameters, also needed after loading an index from disk."""
+    index_type = get_index_type(index)
+    if index_type == HNSW:
+        index.hnsw.efSearch = HNSW_EF_SEARCH
+    elif index_type in (IVF_FLAT, IVF_PQ):
+        ivf = faiss.extract_index_ivf(index)
+        ivf.nprobe = IVF_NPROBE
+        try:
+            ivf.make_direct_map()  # required to reconstruct vectors when rebuilding
+        except RuntimeError:
+            pass
+
+
+def empty_clone(index: faiss.Index) -> faiss.Index:
+    """Copy of the index keeping its training but no vectors."""
+    clone = faiss.clone_index(index)
+    clone.reset()
+    configure_index(clone)
+    return clone
+
+
+def read_index(path: str, mmap: bool = False) -> tuple[faiss.Index, bool]:
+    """
+    Read an index file, memory-mapped when requested and supported so that only touched pages are loaded.
+    Returns the index and whether it is mapped, mapped indexes must be copied with owned_copy before writing.
+    """
+    flag = getattr(faiss, "IO_FLAG_MMAP_IFC", None) if mmap else None
+    if flag is not None:
+        try:
+            return faiss.read_index(path, flag), True
+        except RuntimeError:
+            pass  # index type without mmap support
+    return faiss.read_index(path), False
+
+
+def owned_copy(index: faiss.Index) -> faiss.Index:
+    """Writable in-memory copy of a memory-mapped index, faiss aborts the process on writes to mapped storage."""
+    return faiss.deserialize_index(faiss.serialize_index(index))
+
+
+def reconstruct(index: faiss.Index, positions: list[int] | None = None) -> np.ndarray:
+    if positions is None:
+        positions = list(range(index.ntotal))
+    if not positions:
+        return np.zeros((0, index.d), dtype=np.float32)
+    if positions == list(range(positions[0], positions[0] + len(positions))):
+        return index.reconstruct_n(positions[0], len(positions))
+    return index.reconstruct_batch(np.array(positions, dtype=np.int64))
+
+
+def search_subset(
+    index: faiss.Index,
+    queries: np.ndarray,
+    positions: list[int] | None,
+    k: int,
+    exclude: set[int] | None = None,
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Search only the given positions (all when None) skipping excluded ones,
+    returns (scores, positions) like index.search.
+    """
+    queries = np.asarray(queries, dtype=np.float32).reshape(-1, index.d)
+    if positions is None and not exclude:
+        return index.search(queries, k)
+    if (positions is not None and not positions) or k <= 0:
+        return _empty_result(len(queries))
+
+    if positions is not None and len(positions) <= SUBSET_EXACT_MAX:
+        # small selections: score the stored vectors directly, ANN graphs lose recall with selective filters
+        scores = queries @ reconstruct(index, positions).T
+        return _top_k(scores, np.array(positions, dtype=np.int64), k)
+
+    selectors = _selectors(positions, exclude)
+    return index.search(queries, k, params=_search_params(index, selectors[-1], k))
+
+
+def range_search(
+    index: faiss.Index,
+    query: np.ndarray,
+    min_score: float,
+    positions: list[int] | None = None,
+    exclude: set[int] | None = None,
+) -> tuple[np.ndarray, np.ndarray]:
+    """All vectors (within positions when given) scoring at least min_score, returns (scores, positions)."""
+    query = np.asarray(query, dtype=np.float32).reshape(1, index.d)
+    if positions is not None and len(positions) <= SUBSET_EXACT_MAX:
+        if not positions:
+            return np.zeros(0, dtype=np.float32), np.zeros(0, dtype=np.int64)
+        scores = reconstruct(index, positions) @ query[0]
+        mask = scores >= min_score
+        return scores[mask], np.array(positions, dtype=np.int64)[mask]
+
+    if get_index_type(index) == HNSW:
+        # graph range search misses results, scan the flat storage instead
+        index = faiss.downcast_index(index.storage)
+    params = None
+    selectors = _selectors(positions, exclude)
+    if selectors:
+        params = _search_params(index, selectors[-1])
+    # faiss keeps inner product results strictly above the radius
+    radius = float(np.nextafter(np.float32(min_score), np.float32(-np.inf)))
+    _, scores, found = index.range_search(query, radius, params=params)
+    return scores, found
+
+
+def search_subsets(
+    index: faiss.Index,
+    queries: np.ndarray,
+    subsets: list[list[int] | None],
+    ks: list[int],
+    exclude: set[int] | None = None,
+) -> list[tuple[np.ndarray, np.ndarray]]:
+    """
+    Search the same queries against several position subsets.
+    Small subsets share a single exact scoring pass over the union of their vectors.
+    """
+    queries = np.asarray(queries, dtype=np.float32).reshape(-1, index.d)
+    results: list[tuple[np.ndarray, np.ndarray] | None] = [None] * len(subsets)
+
+    small = [i for i, subset in enumerate(subsets) if subset and len(subset) <= SUBSET_EXACT_MAX]
+    union = sorted(set().union(*(subsets[i] for i in small)))  # type: ignore
+    if len(small) > 1 and len(union) <= SUBSET_EXACT_MAX:
+        scores = queries @ reconstruct(index, union).T
+        column = {pos: col for col, pos in enumerate(union)}
+        for i in small:
+            cols = np.array([column[pos] for pos in subsets[i]], dtype=np.int64)  # type: ignore
+            results[i] = _top_k(scores[:, cols], np.array(subsets[i], dtype=np.int64), ks[i])
+
+    return [
+        result if result is not None else search_subset(index, queries, subset, k, exclude)
+        for result, subset, k in zip(results, subsets, ks)
+    ]
+
+
+def _selectors(positions: list[int] | None, exclude: set[int] | None) -> list:
+    # faiss selectors only keep raw pointers, the caller holds the list until the search is done
+    if positions is not None:
+        return [faiss.IDSelectorBatch(np.array(positions, dtype=np.int64))]
+    if exclude:
+        excluded = faiss.IDSelectorBatch(np.fromiter(exclude, dtype=np.int64, count=len(exclude)))
+        return [excluded, faiss.IDSelectorNot(excluded)]
+    return []
+
+
+def _search_params(index: faiss.Index, selector, k: int = 0) -> faiss.SearchParameters:
+    # each index family rejects search parameters of another family
+    index_type = get_index_type(index)
+    if index_type == HNSW:
+        return faiss.SearchParametersHNSW(sel=selector, efSearch=max(HNSW_EF_SEARCH, k))
+    if index_type in (IVF_FLAT, IVF_PQ):
+        return faiss.SearchParametersIVF(sel=selector, nprobe=IVF_NPROBE)
+    return faiss.SearchParameters(sel=selector)
+
+
+def _top_k(scores: np.ndarray, positions: np.ndarray, k: int) -> tuple[np.ndarray, np.ndarray]:
+    k = min(k, scores.shape[1])
+    if k <= 0:
+        return _empty_result(len(scores))
+    top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    top_scores = np.take_along_axis(scores, top, axis=1)
+    order = np.argsort(-top_scores, axis=1)
+    top = np.take_along_axis(top, order, axis=1)
+    return np.take_along_axis(top_scores, order, axis=1), positions[top]
+
+
+def _empty_result(nq: int) -> tuple[np.ndarray, np.ndarray]:
+    return np.zeros((nq, 0), dtype=np.float32), np.zeros((nq, 0), dtype=np.int64)
+
+
+def _train_sample(vectors: np.ndarray, size: int) -> np.ndarray:
+    if len(vectors) <= size:
+        return vectors
+    rng = np.random.default_rng(0)
+    return vectors[rng.choice(len(vectors), size=size, replace=False)]
+
+
+def _pq_subquantizers(dim: int) -> int:
+    # largest common sub-quantizer count that divides the dimension, 4+ dims per sub-vector
+    for m in (64, 48, 32, 24, 16, 12, 8, 4, 2):
+        if dim % m == 0 and dim // m >= 4:
+            return m
+    return 1
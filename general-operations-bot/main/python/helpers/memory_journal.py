@@ -0,0 +1,156 @@
+import base64
+import json
+import os
+import threading
+from typing import Any, Iterator, Sequence
+
+import numpy as np
+
+from langchain_core.documents import Document
+
+from python.helpers.print_style import PrintStyle
+
+JOURNAL_FILE = "journal.jsonl"
+ROTATED_JOURNAL_FILE = "journal.old.jsonl"
+TAIL_BLOCK_SIZE = 64 * 1024
+
+
+class MemoryJournal:
+    """
+    Append-only write-ahead log for a memory subdir.
+    Inserts are stored with their vectors, deletes as tombstones.
+    The journal is replayed on top of the last snapshot (index.faiss + index.pkl)
+    and truncated once a fresh snapshot has been written.
+    """
+
+    def __init__(self, db_dir: str):
+        self.db_dir = db_dir
+        self.path = os.path.join(db_dir, JOURNAL_FILE)
+        self.rotated_path = os.path.join(db_dir, ROTATED_JOURNAL_FILE)
+        self.lock = threading.RLock()  # guards appends and rotation
+        self.snapshot_lock = threading.Lock()  # serializes snapshot writers
+        self.generation = 0  # incremented for every snapshot taken
+        # a record torn by a crash would swallow the next append into the same line
+        _truncate_torn_record(self.path)
+
+    def append_add(
+        self, ids: Sequence[str], documents: Sequence[Document], vectors: np.ndarray
+    ):
+        records = []
+        for id, doc, vector in zip(ids, documents, vectors):
+            records.append(
+                {
+                    "op": "add",
+                    "id": id,
+                    "text": doc.page_content,
+                    "metadata": doc.metadata,
+                    "vector": _encode_vector(vector),
+                }
+            )
+        self._append(records)
+
+    def append_delete(self, ids: Sequence[str]):
+        if ids:
+            self._append([{"op": "del", "ids": list(ids)}])
+
+    def _append(self, records: list[dict[str, Any]]):
+        lines = "".join(
+            json.dumps(rec, ensure_ascii=False, default=str) + "\n" for rec in records
+        )
+        with self.lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(lines)
+                f.flush()
+                os.fsync(f.fileno())
+
+    def size(self) -> int:
+        with self.lock:
+            return _file_size(self.path) + _file_size(self.rotated_path)
+
+    def is_empty(self) -> bool:
+        return self.size() == 0
+
+    def read(self) -> Iterator[dict[str, Any]]:
+        # rotated journal is older than the current one, replay it first
+        for path in (self.rotated_path, self.path):
+            if not os.path.exists(path):
+                continue
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        rec = json.loads(line)
+                    except json.JSONDecodeError:
+                        # torn write at the end of the file after a crash
+                        PrintStyle.warning(f"Skipping corrupted journal record in {path}")
+                        continue
+                    if rec.get("op") == "add":
+                        rec["vector"] = _decode_vector(rec["vector"])
+                    yield rec
+
+    def rotate(self) -> bool:
+        """Move the current journal aside so a snapshot can be written while new records keep coming."""
+        with self.lock:
+            if os.path.exists(self.rotated_path):
+                return False  # previous compaction still pending
+            if os.path.exists(self.path):
+                os.replace(self.path, self.rotated_path)
+            return True
+
+    def has_rotated(self) -> bool:
+        return os.path.exists(self.rotated_path)
+
+    def drop_rotated(self):
+        with self.lock:
+            if os.path.exists(self.rotated_path):
+                os.remove(self.rotated_path)
+
+    def clear(self):
+        with self.lock:
+            for path in (self.rotated_path, self.path):
+                if os.path.exists(path):
+                    os.remove(path)
+
+
+def _encode_vector(vector: np.ndarray) -> str:
+    return base64.b64encode(np.asarray(vector, dtype=np.float32).tobytes()).decode("ascii")
+
+
+def _decode_vector(data: str) -> np.ndarray:
+    return np.frombuffer(base64.b64decode(data), dtype=np.float32)
+
+
+def _truncate_torn_record(path: str):
+    try:
+        with open(path, "rb+") as f:
+            size = f.seek(0, os.SEEK_END)
+            if not size:
+                return
+            f.seek(size - 1)
+            if f.read(1) == b"\n":
+                return
+            # cut the file after the last complete record
+            end = size
+            while end > 0:
+                start = max(0, end - TAIL_BLOCK_SIZE)
+                f.seek(start)
+                newline = f.read(end - start).rfind(b"\n")
+                if newline >= 0:
+                    end = start + newline + 1
+                    break
+                end = start
+            f.truncate(end)
+            f.flush()
+            os.fsync(f.fileno())
+    except FileNotFoundError:
+        return
+    PrintStyle.warning(f"Removed a torn record at the end of {path}")
+
+
+def _file_size(path: str) -> int:
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
@@ -0,0 +1,105 @@
+import math
+import re
+from collections import Counter
+from typing import Callable, Hashable, Iterable, Sequence, TypeVar
+
+T = TypeVar("T")
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+RRF_K = 60  # rank offset of reciprocal rank fusion, damps the influence of top ranks
+LEXICAL_MIN_RELATIVE_SCORE = 0.5  # lexical hits scoring below this fraction of the best one are dropped
+LEXICAL_MAX_DOC_FRACTION = 0.5  # terms in more than this fraction of the documents are ignored like stopwords
+
+_TOKEN_RE = re.compile(r"\w{2,}")
+
+
+def tokenize(text: str) -> list[str]:
+    return _TOKEN_RE.findall(text.lower())
+
+
+class LexicalIndex:
+    """
+    Inverted term index with BM25 scoring over the documents of a vector store.
+    Complements the vector search with exact term matches like names, ids or error codes.
+    """
+
+    def __init__(self):
+        self.postings: dict[str, dict[str, int]] = {}  # term -> id -> term frequency
+        self.doc_terms: dict[str, tuple[str, ...]] = {}  # id -> distinct terms, for removal
+        self.doc_len: dict[str, int] = {}
+        self.total_len = 0
+
+    @staticmethod
+    def from_texts(items: Iterable[tuple[str, str]]) -> "LexicalIndex":
+        index = LexicalIndex()
+        index.add(items)
+        return index
+
+    def add(self, items: Iterable[tuple[str, str]]):
+        for id, text in items:
+            if id in self.doc_len:
+                self.remove([id])
+            counts = Counter(tokenize(text))
+            for term, tf in counts.items():
+                self.postings.setdefault(term, {})[id] = tf
+            self.doc_terms[id] = tuple(counts)
+            length = sum(counts.values())
+            self.doc_len[id] = length
+            self.total_len += length
+
+    def remove(self, ids: Iterable[str]):
+        for id in ids:
+            terms = self.doc_terms.pop(id, None)
+            if terms is None:
+                continue
+            for term in terms:
+                docs = self.postings.get(term)
+                if docs is not None:
+                    docs.pop(id, None)
+                    if not docs:
+                        del self.postings[term]
+            self.total_len -= self.doc_len.pop(id)
+
+    def __len__(self) -> int:
+        return len(self.doc_len)
+
+    def search(self, query: str, candidates: set[str] | None = None) -> list[tuple[str, float]]:
+        """All documents (within candidates when given) sharing a distinctive term with the query, best first."""
+        count = len(self.doc_len)
+        if not count:
+            return []
+        avg_len = self.total_len / count
+        scores: dict[str, float] = {}
+        for term in set(tokenize(query)):
+            docs = self.postings.get(term)
+            if not docs or len(docs) > count * LEXICAL_MAX_DOC_FRACTION:
+                continue
+            idf = math.log(1 + (count - len(docs) + 0.5) / (len(docs) + 0.5))
+            for id, tf in docs.items():
+                if candidates is not None and id not in candidates:
+                    continue
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * self.doc_len[id] / avg_len)
+                scores[id] = scores.get(id, 0.0) + idf * tf * (BM25_K1 + 1) / (tf + norm)
+        if not scores:
+            return []
+        cutoff = max(scores.values()) * LEXICAL_MIN_RELATIVE_SCORE
+        return sorted(
+            ((id, score) for id, score in scores.items() if score >= cutoff),
+            key=lambda r: -r[1],
+        )
+
+
+def fuse_rankings(
+    rankings: Sequence[Sequence[T]], key: Callable[[T], Hashable], limit: int
+) -> list[T]:
+    """Merge ranked lists by reciprocal rank fusion, items are matched by key."""
+    scores: dict[Hashable, float] = {}
+    items: dict[Hashable, T] = {}
+    for ranking in rankings:
+        for rank, item in enumerate(ranking):
+            k = key(item)
+            scores[k] = scores.get(k, 0.0) + 1 / (RRF_K + rank + 1)
+            items.setdefault(k, item)
+    ordered = sorted(scores, key=lambda k: -scores[k])
+    return [items[k] for k in ordered[:limit]]
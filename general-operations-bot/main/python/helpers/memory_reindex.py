@@ -0,0 +1,153 @@
+import asyncio
+import json
+import os
+import shutil
+from typing import Any, Callable
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from python.helpers.log import LogItem
+from python.helpers.print_style import PrintStyle
+
+REINDEX_DIR = "reindex"
+STATE_FILE = "state.json"
+VECTORS_FILE = "vectors.f32"
+IDS_FILE = "ids.txt"
+
+
+class ReindexCheckpoint:
+    """
+    Progress of a re-embedding run, stored next to the index.
+    Vectors are appended as raw float32 rows with their ids in a parallel text file,
+    a torn write after a crash is cut off to the number of complete rows in both files.
+    """
+
+    def __init__(self, db_dir: str, target: dict[str, Any]):
+        self.dir = os.path.join(db_dir, REINDEX_DIR)
+        self.target = target  # model provider, name and vector dimension
+        self.dim = int(target["dim"])
+
+    def load(self) -> tuple[list[str], np.ndarray]:
+        """Ids and vectors embedded so far, an empty checkpoint when it was made for another model."""
+        state_path = os.path.join(self.dir, STATE_FILE)
+        state = None
+        if os.path.exists(state_path):
+            try:
+                with open(state_path, "r", encoding="utf-8") as f:
+                    state = json.load(f)
+            except (OSError, ValueError):
+                pass
+        if state != self.target:
+            self.clear()
+            os.makedirs(self.dir, exist_ok=True)
+            with open(state_path, "w", encoding="utf-8") as f:
+                json.dump(self.target, f)
+            return [], np.zeros((0, self.dim), dtype=np.float32)
+
+        ids_path = os.path.join(self.dir, IDS_FILE)
+        vectors_path = os.path.join(self.dir, VECTORS_FILE)
+        ids: list[str] = []
+        if os.path.exists(ids_path):
+            with open(ids_path, "r", encoding="utf-8") as f:
+                content = f.read()
+            # the last line is incomplete unless it ends with a newline
+            ids = content.split("\n")[:-1]
+        row_bytes = self.dim * 4
+        rows = _file_size(vectors_path) // row_bytes
+        count = min(len(ids), rows)
+        self._truncate(ids_path, len("".join(id + "\n" for id in ids[:count]).encode("utf-8")))
+        self._truncate(vectors_path, count * row_bytes)
+        if not count:
+            return [], np.zeros((0, self.dim), dtype=np.float32)
+        vectors = np.fromfile(vectors_path, dtype=np.float32, count=count * self.dim)
+        return ids[:count], vectors.reshape(count, self.dim)
+
+    def append(self, ids: list[str], vectors: np.ndarray):
+        # vectors first, ids mark the rows as complete
+        with open(os.path.join(self.dir, VECTORS_FILE), "ab") as f:
+            f.write(np.asarray(vectors, dtype=np.float32).reshape(len(ids), self.dim).tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        with open(os.path.join(self.dir, IDS_FILE), "a", encoding="utf-8") as f:
+            f.write("".join(id + "\n" for id in ids))
+            f.flush()
+            os.fsync(f.fileno())
+
+    def clear(self):
+        ReindexCheckpoint.remove(os.path.dirname(self.dir))
+
+    @staticmethod
+    def remove(db_dir: str):
+        path = os.path.join(db_dir, REINDEX_DIR)
+        if os.path.exists(path):
+            shutil.rmtree(path, ignore_errors=True)
+
+    @staticmethod
+    def _truncate(path: str, size: int):
+        if _file_size(path) > size:
+            with open(path, "r+b") as f:
+                f.truncate(size)
+
+
+async def embed_batches(
+    embedder: Embeddings,
+    ids: list[str],
+    get_texts: Callable[[list[str]], list[str | None]],
+    checkpoint: ReindexCheckpoint | None,
+    batch_size: int,
+    workers: int,
+    log_item: LogItem | None = None,
+    done: int = 0,
+    total: int | None = None,
+) -> tuple[list[str], np.ndarray]:
+    """
+    Embed documents in batches with up to `workers` batches in flight.
+    Every finished batch is appended to the checkpoint, ids without a document are skipped.
+    Returns the embedded ids and their vectors in completion order.
+    """
+    batch_size = max(1, batch_size)
+    total = total if total is not None else done + len(ids)
+    semaphore = asyncio.Semaphore(max(1, workers))
+    embedded_ids: list[str] = []
+    embedded: list[np.ndarray] = []
+    progress = done
+
+    async def run(batch: list[str]):
+        nonlocal progress
+        async with semaphore:
+            texts = get_texts(batch)
+            found = [(id, text) for id, text in zip(batch, texts) if text is not None]
+            if found:
+                # local models release the GIL while encoding, threads keep the event loop free
+                vectors = await asyncio.to_thread(
+                    embedder.embed_documents, [text for _, text in found]
+                )
+                vectors = np.array(vectors, dtype=np.float32).reshape(len(found), -1)
+                batch_ids = [id for id, _ in found]
+                if checkpoint:
+                    checkpoint.append(batch_ids, vectors)
+                embedded_ids.extend(batch_ids)
+                embedded.append(vectors)
+            progress += len(batch)
+            _report(log_item, progress, total)
+
+    await asyncio.gather(
+        *(run(ids[i : i + batch_size]) for i in range(0, len(ids), batch_size))
+    )
+    dim = checkpoint.dim if checkpoint else (embedded[0].shape[1] if embedded else 0)
+    vectors = np.concatenate(embedded) if embedded else np.zeros((0, dim), dtype=np.float32)
+    return embedded_ids, vectors
+
+
+def _report(log_item: LogItem | None, done: int, total: int):
+    PrintStyle.standard(f"Re-embedding memories: {done}/{total}")
+    if log_item:
+        log_item.stream(progress=f"\nRe-embedding memories: {done}/{total}")
+
+
+def _file_size(path: str) -> int:
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
@@ -0,0 +1,168 @@
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Iterable
+
+from python.helpers.print_style import PrintStyle
+
+ACCESS_FILE = "access.sqlite"
+REPORT_FILE = "retention_report.json"
+FLUSH_PENDING = 1000  # recorded hits kept in memory before they are written
+MAINTENANCE_INTERVAL = 3600  # seconds between retention runs
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+REPORT_SAMPLES = 20  # evicted documents listed per area in the report
+
+_last_maintenance = 0.0
+
+
+@dataclass
+class RetentionPolicy:
+    """Limits for one memory area, 0 = unlimited."""
+    max_documents: int = 0
+    max_age_days: float = 0
+
+    def is_limited(self) -> bool:
+        return self.max_documents > 0 or self.max_age_days > 0
+
+
+def parse_policies(config: dict[str, Any]) -> dict[str, RetentionPolicy]:
+    policies = {}
+    for area, values in config.items():
+        if not isinstance(values, dict):
+            PrintStyle.warning(f"Ignoring invalid memory retention policy for '{area}'")
+            continue
+        policy = RetentionPolicy(
+            max_documents=int(values.get("max_documents", 0) or 0),
+            max_age_days=float(values.get("max_age_days", 0) or 0),
+        )
+        if policy.is_limited():
+            policies[area] = policy
+    return policies
+
+
+def maintenance_due() -> bool:
+    global _last_maintenance
+    now = time.time()
+    if now - _last_maintenance < MAINTENANCE_INTERVAL:
+        return False
+    _last_maintenance = now
+    return True
+
+
+class AccessLog:
+    """
+    Recall counters of memories in a SQLite file next to the index.
+    Search hits are collected in memory and written in batches, counts lost in a crash only affect eviction order.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        self.pending: dict[str, tuple[int, float]] = {}  # id -> (hits, last hit)
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            """CREATE TABLE IF NOT EXISTS access (
+                id TEXT PRIMARY KEY,
+                count INTEGER NOT NULL,
+                last REAL NOT NULL
+            )"""
+        )
+
+    def record(self, ids: Iterable[str]):
+        now = time.time()
+        with self.lock:
+            for id in ids:
+                count, _ = self.pending.get(id, (0, now))
+                self.pending[id] = (count + 1, now)
+            if len(self.pending) < FLUSH_PENDING:
+                return
+        self.flush()
+
+    def flush(self):
+        with self.lock:
+            rows = [(id, count, last) for id, (count, last) in self.pending.items()]
+            self.pending.clear()
+            if not rows:
+                return
+            self.conn.execute("BEGIN")
+            try:
+                self.conn.executemany(
+                    """INSERT INTO access (id, count, last) VALUES (?, ?, ?)
+                    ON CONFLICT(id) DO UPDATE SET count = count + excluded.count, last = excluded.last""",
+                    rows,
+                )
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+
+    def get_all(self) -> dict[str, tuple[int, float]]:
+        self.flush()
+        with self.lock:
+            return {
+                id: (count, last)
+                for id, count, last in self.conn.execute("SELECT id, count, last FROM access")
+            }
+
+    def retain(self, ids: set[str]):
+        """Drop counters of documents that are no longer stored."""
+        stale = [(id,) for id in self.get_all() if id not in ids]
+        if not stale:
+            return
+        with self.lock:
+            self.conn.execute("BEGIN")
+            self.conn.executemany("DELETE FROM access WHERE id = ?", stale)
+            self.conn.execute("COMMIT")
+
+
+def plan_evictions(
+    items: Iterable[tuple[str, dict[str, Any]]],
+    policies: dict[str, RetentionPolicy],
+    access: dict[str, tuple[int, float]],
+    now: datetime | None = None,
+) -> dict[str, dict[str, Any]]:
+    """
+    Documents to evict per area as {area: {"documents": n, "evict": [(id, reason)]}}.
+    Expired documents go first, then the least recently recalled until the area fits max_documents.
+    Knowledge documents are never evicted.
+    """
+    now = now or datetime.now()
+    by_area: dict[str, list[tuple[str, float | None]]] = {area: [] for area in policies}
+    for id, metadata in items:
+        area = metadata.get("area")
+        if area not in policies or metadata.get("knowledge_source"):
+            continue
+        by_area[area].append((id, _parse_timestamp(metadata.get("timestamp"))))
+
+    plan = {}
+    for area, docs in by_area.items():
+        policy = policies[area]
+        evict: list[tuple[str, str]] = []
+        kept = docs
+        if policy.max_age_days > 0:
+            cutoff = now.timestamp() - policy.max_age_days * 86400
+            evict = [(id, "max_age") for id, ts in docs if ts is not None and ts < cutoff]
+            expired = {id for id, _ in evict}
+            kept = [doc for doc in docs if doc[0] not in expired]
+        if policy.max_documents > 0 and len(kept) > policy.max_documents:
+            # last use is the last recall, or the creation time when never recalled
+            def last_use(doc: tuple[str, float | None]) -> tuple[float, int]:
+                count, last = access.get(doc[0], (0, doc[1] or 0.0))
+                return last, count
+
+            kept = sorted(kept, key=last_use)
+            evict.extend((id, "max_documents") for id, _ in kept[: len(kept) - policy.max_documents])
+        plan[area] = {"documents": len(docs), "policy": policy, "evict": evict}
+    return plan
+
+
+def _parse_timestamp(value: Any) -> float | None:
+    if not isinstance(value, str):
+        return None
+    try:
+        return datetime.strptime(value, TIMESTAMP_FORMAT).timestamp()
+    except ValueError:
+        return None
@@ -0,0 +1,192 @@
+import json
+import os
+from datetime import datetime
+from typing import Any, Callable, Iterator, Sequence
+
+import numpy as np
+import zstandard
+from langchain_core.documents import Document
+
+# faiss needs to be patched for python 3.12 on arm #TODO remove once not needed
+from python.helpers import faiss_monkey_patch
+import faiss
+
+from python.helpers import memory_index
+
+FORMAT = "memory-snapshot"
+VERSION = 1
+MANIFEST_FILE = "manifest.json"
+VECTORS_FILE = "vectors.npy"
+INDEX_FILE = "vectors.faiss"
+DOCUMENTS_FILE = "documents.jsonl.zst"
+OFFSETS_FILE = "documents.offsets.npy"
+SNAPSHOT_FILES = (MANIFEST_FILE, VECTORS_FILE, INDEX_FILE, DOCUMENTS_FILE, OFFSETS_FILE)
+DTYPES = ("float32", "float16")
+FRAME_DOCS = 256  # documents per compressed frame, the unit of random access
+COPY_ROWS = 16_384  # vectors converted per step when building an index from the matrix
+ZSTD_LEVEL = 3
+
+
+def is_snapshot(path: str) -> bool:
+    return os.path.isfile(os.path.join(path, MANIFEST_FILE))
+
+
+def write_snapshot(
+    out_dir: str,
+    index: faiss.Index,
+    positions: Sequence[int],
+    ids: Sequence[str],
+    get_documents: Callable[[list[str]], list[Document]],
+    info: dict[str, Any],
+    dtype: str = "float32",
+    include_index: bool = False,
+) -> dict[str, Any]:
+    """
+    Write the documents at the given index positions as a snapshot directory:
+    one .npy vector matrix, zstd frames of JSONL documents with an offset table and a manifest.
+    Documents missing from the docstore (deleted meanwhile) are left out.
+    The index itself is added for ANN types whose structure is expensive to rebuild,
+    it is only valid when the positions are exactly the rows of the index.
+    """
+    if dtype not in DTYPES:
+        raise ValueError(f"Unsupported snapshot dtype '{dtype}', use one of {DTYPES}")
+    os.makedirs(out_dir, exist_ok=True)
+    compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL)
+
+    rows: list[int] = []  # positions of the written documents
+    offsets = [0]
+    with open(os.path.join(out_dir, DOCUMENTS_FILE), "wb") as f:
+        pending: list[str] = []
+
+        def write_frame():
+            # every frame but the last holds FRAME_DOCS documents, rows are located by division
+            data = compressor.compress("".join(pending[:FRAME_DOCS]).encode("utf-8"))
+            offsets.append(offsets[-1] + f.write(data))
+            del pending[:FRAME_DOCS]
+
+        for start in range(0, len(ids), FRAME_DOCS):
+            batch = list(ids[start : start + FRAME_DOCS])
+            docs = {doc.id: doc for doc in get_documents(batch)}
+            for pos, id in zip(positions[start : start + FRAME_DOCS], batch):
+                if id in docs:
+                    rows.append(pos)
+                    pending.append(_dump_document(id, docs[id]))
+            if len(pending) >= FRAME_DOCS:
+                write_frame()
+        while pending:
+            write_frame()
+    np.save(os.path.join(out_dir, OFFSETS_FILE), np.array(offsets, dtype=np.int64))
+
+    vectors = np.lib.format.open_memmap(
+        os.path.join(out_dir, VECTORS_FILE), mode="w+", dtype=dtype, shape=(len(rows), index.d)
+    )
+    for start in range(0, len(rows), COPY_ROWS):
+        chunk = rows[start : start + COPY_ROWS]
+        vectors[start : start + len(chunk)] = memory_index.reconstruct(index, chunk)
+    vectors.flush()
+    del vectors
+
+    index_file = None
+    if include_index and len(rows) == index.ntotal:
+        faiss.write_index(index, os.path.join(out_dir, INDEX_FILE))
+        index_file = INDEX_FILE
+
+    manifest = {
+        "format": FORMAT,
+        "version": VERSION,
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "count": len(rows),
+        "dim": int(index.d),
+        "dtype": dtype,
+        "frame_docs": FRAME_DOCS,
+        "index_type": memory_index.get_index_type(index),
+        "files": {
+            "vectors": VECTORS_FILE,
+            "documents": DOCUMENTS_FILE,
+            "offsets": OFFSETS_FILE,
+            "index": index_file,
+        },
+        **info,
+    }
+    # the manifest is written last, a directory without one is an incomplete export
+    with open(os.path.join(out_dir, MANIFEST_FILE), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+class SnapshotReader:
+    """
+    Read access to a snapshot directory.
+    Vectors are memory-mapped and documents are decompressed one frame at a time,
+    so only the pages and frames that are used are read from disk.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(os.path.join(path, MANIFEST_FILE), "r", encoding="utf-8") as f:
+            self.manifest: dict[str, Any] = json.load(f)
+        if self.manifest.get("format") != FORMAT or self.manifest.get("version", 0) > VERSION:
+            raise ValueError(f"Unsupported memory snapshot in {path}")
+        self.count = int(self.manifest["count"])
+        self.dim = int(self.manifest["dim"])
+        self.frame_docs = int(self.manifest["frame_docs"])
+        self.offsets = np.load(os.path.join(path, self.manifest["files"]["offsets"]))
+        self._decompressor = zstandard.ZstdDecompressor()
+
+    def vectors(self) -> np.ndarray:
+        """The (count, dim) vector matrix, memory-mapped read-only in the stored dtype."""
+        return np.load(os.path.join(self.path, self.manifest["files"]["vectors"]), mmap_mode="r")
+
+    def index_path(self) -> str | None:
+        name = self.manifest["files"].get("index")
+        return os.path.join(self.path, name) if name else None
+
+    def build_index(self) -> faiss.Index:
+        """Flat index of all vectors, filled from the mapped matrix in chunks."""
+        vectors = self.vectors()
+        index = memory_index.create_index(memory_index.FLAT, self.dim)
+        for start in range(0, self.count, COPY_ROWS):
+            index.add(np.ascontiguousarray(vectors[start : start + COPY_ROWS], dtype=np.float32))
+        return index
+
+    def read_documents(self, rows: Sequence[int]) -> list[Document]:
+        """Documents at the given rows, each needed frame is decompressed once."""
+        frames: dict[int, list[Document]] = {}
+        result = []
+        for row in rows:
+            if not 0 <= row < self.count:
+                raise IndexError(f"Snapshot row {row} out of range")
+            frame = row // self.frame_docs
+            if frame not in frames:
+                frames[frame] = self._read_frame(frame)
+            result.append(frames[frame][row % self.frame_docs])
+        return result
+
+    def iter_documents(self) -> Iterator[list[Document]]:
+        """All documents in row order, one frame per batch."""
+        for frame in range(len(self.offsets) - 1):
+            yield self._read_frame(frame)
+
+    def remove(self):
+        for name in SNAPSHOT_FILES:
+            path = os.path.join(self.path, name)
+            if os.path.exists(path):
+                os.remove(path)
+
+    def _read_frame(self, frame: int) -> list[Document]:
+        start, end = int(self.offsets[frame]), int(self.offsets[frame + 1])
+        with open(os.path.join(self.path, self.manifest["files"]["documents"]), "rb") as f:
+            f.seek(start)
+            data = self._decompressor.decompress(f.read(end - start))
+        # split on newlines only, splitlines() would also break at unicode separators inside texts
+        return [_load_document(line) for line in data.decode("utf-8").split("\n")[:-1]]
+
+
+def _dump_document(id: str, doc: Document) -> str:
+    record = {"id": id, "text": doc.page_content, "metadata": doc.metadata}
+    return json.dumps(record, ensure_ascii=False, default=str) + "\n"
+
+
+def _load_document(line: str) -> Document:
+    record = json.loads(line)
+    return Document(id=record["id"], page_content=record["text"], metadata=record["metadata"])
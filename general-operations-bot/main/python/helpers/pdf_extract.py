@@ -0,0 +1,194 @@
+import asyncio
+import io
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import Executor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import AsyncIterator, Iterable
+
+import fitz  # PyMuPDF
+import xxhash
+
+from python.helpers import files
+from python.helpers.document_cache import CACHE_FOLDER
+from python.helpers.knowledge_import import create_executor
+from python.helpers.print_style import PrintStyle
+
+PAGES_FILE = "pdf_pages.sqlite"
+MIN_TEXT_CHARS = 16  # pages with less extractable text are treated as scans and OCRed
+OCR_DPI = 300
+HASH_BLOCK_SIZE = 1024 * 1024
+EVICTION_TARGET = 0.9  # evict down to this fraction of the size limit
+
+
+def extract_page(path: str, number: int) -> str:
+    """
+    Text of one PDF page with its tables as markdown.
+    Pages without a text layer are rendered and OCRed with Tesseract.
+    Runs in a worker process, so it only takes picklable arguments.
+    """
+    with fitz.open(path) as pdf:
+        page = pdf[number]
+        text = page.get_text("text")
+        if len(text.strip()) >= MIN_TEXT_CHARS:
+            try:
+                tables = [table.to_markdown() for table in page.find_tables().tables]
+            except Exception:
+                tables = []  # table detection is best effort
+            return "\n".join([text, *tables]) if tables else text
+
+        import pytesseract
+        from PIL import Image
+
+        pixmap = page.get_pixmap(dpi=OCR_DPI)
+        image = Image.open(io.BytesIO(pixmap.tobytes("png")))
+        return pytesseract.image_to_string(image)
+
+
+def page_count(path: str) -> int:
+    with fitz.open(path) as pdf:
+        return pdf.page_count
+
+
+async def extract_pages(
+    path: str, workers: int, cache: "PdfPageCache | None" = None
+) -> AsyncIterator[tuple[int, str | None]]:
+    """
+    Extract the pages of a PDF in a bounded process pool and yield (page number, text) as pages complete.
+    Cached pages of the same file are yielded first without extracting them again.
+    The text of a page that could not be extracted is None, it is not cached.
+    """
+    checksum = await asyncio.to_thread(file_checksum, path) if cache else ""
+    count = await asyncio.to_thread(page_count, path)
+
+    cached = cache.get_pages(checksum, range(count)) if cache else {}
+    for number, text in sorted(cached.items()):
+        yield number, text
+    missing = [number for number in range(count) if number not in cached]
+    if not missing:
+        return
+
+    executor = create_executor(min(workers, len(missing)))
+    fallback: Executor | None = None
+    try:
+        loop = asyncio.get_running_loop()
+        futures = {
+            loop.run_in_executor(executor, extract_page, path, number): number
+            for number in missing
+        }
+        pending = set(futures)
+        while pending:
+            finished, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for future in finished:
+                number = futures.pop(future)
+                try:
+                    text = future.result()
+                except BrokenProcessPool:
+                    # workers could not start or crashed, extract the remaining pages in a thread
+                    if not fallback:
+                        PrintStyle.warning("PDF extraction workers failed, extracting in a thread")
+                        fallback = ThreadPoolExecutor(max_workers=1)
+                    retry = loop.run_in_executor(fallback, extract_page, path, number)
+                    futures[retry] = number
+                    pending.add(retry)
+                    continue
+                except Exception as e:
+                    # a broken page should not fail the whole document
+                    PrintStyle.error(f"Error extracting page {number + 1} of {path}: {e}")
+                    yield number, None
+                    continue
+                if cache:
+                    cache.put_page(checksum, number, text)
+                yield number, text
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+        if fallback:
+            fallback.shutdown(wait=False, cancel_futures=True)
+
+
+def file_checksum(path: str) -> str:
+    hasher = xxhash.xxh3_128()
+    with open(path, "rb") as f:
+        while block := f.read(HASH_BLOCK_SIZE):
+            hasher.update(block)
+    return hasher.hexdigest()
+
+
+class PdfPageCache:
+    """
+    Extracted PDF page texts keyed by file hash and page number, so OCR runs once per page.
+    Least recently used pages are evicted above the size limit.
+    """
+
+    _instance: "PdfPageCache | None" = None
+    _instance_lock = threading.Lock()
+
+    @staticmethod
+    def get(max_bytes: int) -> "PdfPageCache":
+        with PdfPageCache._instance_lock:
+            if not PdfPageCache._instance:
+                folder = files.get_abs_path(CACHE_FOLDER)
+                os.makedirs(folder, exist_ok=True)
+                PdfPageCache._instance = PdfPageCache(os.path.join(folder, PAGES_FILE))
+            PdfPageCache._instance.max_bytes = max_bytes
+        return PdfPageCache._instance
+
+    def __init__(self, path: str, max_bytes: int = 0):
+        self.max_bytes = max_bytes  # 0 = unlimited
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            """CREATE TABLE IF NOT EXISTS pages (
+                checksum TEXT NOT NULL,
+                page INTEGER NOT NULL,
+                text TEXT NOT NULL,
+                accessed REAL NOT NULL,
+                PRIMARY KEY (checksum, page)
+            )"""
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS pages_accessed ON pages (accessed)")
+        self.total_bytes = self.conn.execute(
+            "SELECT COALESCE(SUM(LENGTH(text)), 0) FROM pages"
+        ).fetchone()[0]
+
+    def get_pages(self, checksum: str, pages: Iterable[int]) -> dict[int, str]:
+        wanted = set(pages)
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT page, text FROM pages WHERE checksum = ?", (checksum,)
+            ).fetchall()
+            if rows:
+                self.conn.execute(
+                    "UPDATE pages SET accessed = ? WHERE checksum = ?", (time.time(), checksum)
+                )
+        return {page: text for page, text in rows if page in wanted}
+
+    def put_page(self, checksum: str, page: int, text: str):
+        with self.lock:
+            old = self.conn.execute(
+                "SELECT LENGTH(text) FROM pages WHERE checksum = ? AND page = ?", (checksum, page)
+            ).fetchone()
+            self.conn.execute(
+                "INSERT OR REPLACE INTO pages (checksum, page, text, accessed) VALUES (?, ?, ?, ?)",
+                (checksum, page, text, time.time()),
+            )
+            self.total_bytes += len(text) - (old[0] if old else 0)
+            if self.max_bytes and self.total_bytes > self.max_bytes:
+                self._evict(int(self.max_bytes * EVICTION_TARGET))
+
+    def _evict(self, target_bytes: int):
+        # drop least recently used pages until the cache fits the target size
+        removed = 0
+        keys = []
+        for checksum, page, size in self.conn.execute(
+            "SELECT checksum, page, LENGTH(text) FROM pages ORDER BY accessed"
+        ).fetchall():
+            if self.total_bytes - removed <= target_bytes:
+                break
+            keys.append((checksum, page))
+            removed += size
+        self.conn.executemany("DELETE FROM pages WHERE checksum = ? AND page = ?", keys)
+        self.total_bytes -= removed
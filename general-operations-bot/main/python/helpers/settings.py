@@ -24,6 +24,7 @@ class Settings(TypedDict):
     chat_model_kwargs: dict[str, Any]
     chat_model_ctx_length: int
     chat_model_ctx_history: float
+    chat_model_token_estimate: bool
     chat_model_vision: bool
     chat_model_rl_requests: int
     chat_model_rl_input: int
@@ -74,6 +75,24 @@ class Settings(TypedDict):
     memory_memorize_enabled: bool
     memory_memorize_consolidation: bool
     memory_memorize_replace_threshold: float
+    memory_journal_enabled: bool
+    memory_journal_compact_mb: int
+    memory_index_type: str
+    memory_embedding_cache_mb: int
+    memory_compaction_ratio: float
+    memory_docstore_lazy: bool
+    memory_reindex_batch_size: int
+    memory_reindex_workers: int
+    memory_lexical_search: bool
+    memory_retention: dict[str, Any]
+    memory_retention_dry_run: bool
+    memory_index_mmap: bool
+    memory_knowledge_import_workers: int
+    memory_knowledge_watch: bool
+    memory_document_cache_mb: int
+    memory_document_cache_persist: bool
+    memory_document_fetch_cache_mb: int
+    memory_document_pdf_workers: int
 
     api_keys: dict[str, str]
 
@@ -221,6 +240,16 @@ def convert_out(settings: Settings) -> SettingsOutput:
         }
     )
 
+    chat_model_fields.append(
+        {
+            "id": "chat_model_token_estimate",
+            "title": "Estimate chat history tokens",
+            "description": "Estimate the size of chat history messages from their length instead of tokenizing each of them. The estimate is calibrated against exact counts while the chat runs. Faster with long chats, history limits become less precise.",
+            "type": "switch",
+            "value": settings["chat_model_token_estimate"],
+        }
+    )
+
     chat_model_fields.append(
         {
             "id": "chat_model_vision",
@@ -825,6 +854,196 @@ def convert_out(settings: Settings) -> SettingsOutput:
         }
     )
 
+    memory_fields.append(
+        {
+            "id": "memory_journal_enabled",
+            "title": "Memory journal persistence",
+            "description": "Append memory inserts and deletions to a journal file instead of rewriting the whole vector database after every change. The journal is compacted into a fresh snapshot in the background.",
+            "type": "switch",
+            "value": settings["memory_journal_enabled"],
+        }
+    )
+
+    memory_fields.append(
+        {
+            "id": "memory_journal_compact_mb",
+            "title": "Memory journal compaction size",
+            "description": "Size of the memory journal (in MB) after which it is compacted into a new database snapshot.",
+            "type": "number",
+            "value": settings["memory_journal_compact_mb"],
+        }
+    )
+
+    memory_fields.append(
+        {
+            "id": "memory_index_type",
+            "title": "Memory index type",
+            "description": "Vector index used for the memory subdirectory. Flat is exact but scans all memories, HNSW and IVF are approximate and scale to large memories. Auto switches from flat to HNSW as memory grows. IVF indexes fall back to flat until there is enough data to train them and are retrained as memory grows.",
+            "type": "select",
+            "value": settings["memory_index_type"],
+            "options": [
+                {"value": "flat", "label": "Flat (exact)"},
+                {"value": "auto", "label": "Auto"},
+                {"value": "hnsw", "label": "HNSW"},
+                {"value": "ivf_flat", "label": "IVF-Flat"},
+                {"value": "ivf_pq", "label": "IVF-PQ"},
+            ],
+        }
+    )
+
+    memory_fields.append(
+        {
+            "id": "memory_embedding_cache_mb",
+            "title": "Embedding cache size",
+            "description": "Maximum size (in MB) of the embedding cache file. Least recently used embeddings are evicted when it grows larger. Set to 0 for unlimited.",
+            "type": "number",
+            "value": settings["memory_embedding_cache_mb"],
+        }
+    )
+
+    memory_fields.append(
+        {
+            "id": "memory_compaction_ratio",
+            "title": "Memory index compaction ratio",
+            "description": "Deleted memories are only marked as removed in the vector index. Once this fraction of the index is deleted entries, it is rebuilt in the background. Set to 0 to disable.",
+            "type": "range",
+            "min": 0,
+            "max": 0.9,
+            "step": 0.05,
+            "value": settings["memory_compaction_ratio"],
+        }
+    )
+
+    memory_fields.append(
+        {
+            "id": "memory_docstore_lazy",
+            "title": "Keep memory texts on disk",
+            "description": "Store memory texts in a SQLite file and only load them for search results. Only ids and metadata are kept in RAM. Disable to keep all texts in memory.",
+            "type": "switch",
+            "value": settings["memory_docstore_lazy"],
+        }
+    )
+
+    memory_fields.append(
+        {
+            "id": "memory_reindex_batch_size",
+            "title": "Memory re-index batch size",
+            "description": "Number of memories embedded per batch when the embedding model changes. Progress is saved after every batch so an interrupted re-index resumes where it stopped.",
+            "type": "number",
+            "value": settings["memory_reindex_batch_size"],
+        }
+    )
+
+    memory_fields.append(
+        {
+            "id": "memory_reindex_workers",
+            "title": "Memory re-index workers",
+            "description": "Number of batches embedded in parallel when the embedding model changes. The old index keeps serving searches until the new one is ready.",
+            "type": "number",
+            "value": settings["memory_reindex_workers"],
+        }
+    )
+
+    memory_fields.append(
+        {
+            "id": "memory_lexical_search",
+            "title": "Keyword search in memory",
+            "description": "Combine keyword (BM25) matches with vector similarity when recalling and consolidating memories. Helps with exact names, identifiers and error messages that embeddings miss.",
+            "type": "switch",
+            "value": settings["memory_lexical_search"],
+        }
+    )
+
+    memory_fields.append(
+        {
+            "id": "memory_retention",
+            "title": "Memory retention policies",
+            "description": "Limits per memory area, one area per line as area={\"max_documents\": 20000, \"max_age_days\": 365}. Above max_documents the least recently recalled memories are evicted first. Knowledge imported from files is never evicted.",
+            "type": "textarea",
+            "value": _dict_to_env(settings["memory_retention"]),
+        }
+    )
+
+    memory_fields.append(
+        {
+            "id": "memory_retention_dry_run",
+            "title": "Memory retention dry run",
+            "description": "Only report memories exceeding the retention policies in retention_report.json in the memory folder instead of deleting them.",
+            "type": "switch",
+            "value": settings["memory_retention_dry_run"],
+        }
+    )
+
+    memory_fields.append(
+        {
+            "id": "memory_index_mmap",
+            "title": "Memory-mapped memory index",
+            "description": "Open the vector index file memory-mapped so startup only reads the parts that are searched. The index is copied to RAM on the first insert.",
+            "type": "switch",
+            "value": settings["memory_index_mmap"],
+        }
+    )
+
+    memory_fields.append(
+        {
+            "id": "memory_knowledge_import_workers",
+            "title": "Knowledge import workers",
+            "description": "Number of processes parsing knowledge files in parallel when they are imported. Set to 1 to parse in a single background thread.",
+            "type": "number",
+            "value": settings["memory_knowledge_import_workers"],
+        }
+    )
+
+    memory_fields.append(
+        {
+            "id": "memory_knowledge_watch",
+            "title": "Watch knowledge folders",
+            "description": "Import files added to, changed in or removed from the knowledge and instruments folders in the background, without a restart.",
+            "type": "switch",
+            "value": settings["memory_knowledge_watch"],
+        }
+    )
+
+    memory_fields.append(
+        {
+            "id": "memory_document_cache_mb",
+            "title": "Document query cache size (MB)",
+            "description": "Size limit of the text of documents kept indexed for the document query tool. Least recently used documents are removed above it.",
+            "type": "number",
+            "value": settings["memory_document_cache_mb"],
+        }
+    )
+
+    memory_fields.append(
+        {
+            "id": "memory_document_cache_persist",
+            "title": "Keep document query cache on disk",
+            "description": "Save indexed documents of the document query tool in tmp/document_query so they are not fetched and embedded again after a restart.",
+            "type": "switch",
+            "value": settings["memory_document_cache_persist"],
+        }
+    )
+
+    memory_fields.append(
+        {
+            "id": "memory_document_fetch_cache_mb",
+            "title": "Web document cache size (MB)",
+            "description": "Size limit of web documents downloaded by the document query tool and kept in tmp/document_cache. Cached documents are revalidated following their HTTP caching headers.",
+            "type": "number",
+            "value": settings["memory_document_fetch_cache_mb"],
+        }
+    )
+
+    memory_fields.append(
+        {
+            "id": "memory_document_pdf_workers",
+            "title": "PDF extraction workers",
+            "description": "Number of processes extracting and OCRing PDF pages in parallel for the document query tool. Set to 1 to extract in a single background thread.",
+            "type": "number",
+            "value": settings["memory_document_pdf_workers"],
+        }
+    )
+
     memory_section: SettingsSection = {
         "id": "memory",
         "title": "Memory",
@@ -1291,7 +1510,10 @@ def convert_in(settings: dict) -> Settings:
 
                 if not should_skip:
                     # Special handling for browser_http_headers
-                    if field["id"] == "browser_http_headers" or field["id"].endswith("_kwargs"):
+                    if (
+                        field["id"] in ("browser_http_headers", "memory_retention")
+                        or field["id"].endswith("_kwargs")
+                    ):
                         current[field["id"]] = _env_to_dict(field["value"])
                     elif field["id"].startswith("api_key_"):
                         current["api_keys"][field["id"]] = field["value"]
@@ -1423,6 +1645,7 @@ def get_default_settings() -> Settings:
         chat_model_kwargs={"temperature": "0"},
         chat_model_ctx_length=100000,
         chat_model_ctx_history=0.7,
+        chat_model_token_estimate=False,
         chat_model_vision=True,
         chat_model_rl_requests=0,
         chat_model_rl_input=0,
@@ -1465,6 +1688,27 @@ def get_default_settings() -> Settings:
         memory_memorize_enabled=True,
         memory_memorize_consolidation=True,
         memory_memorize_replace_threshold=0.9,
+        memory_journal_enabled=True,
+        memory_journal_compact_mb=64,
+        memory_index_type="flat",
+        memory_embedding_cache_mb=1024,
+        memory_compaction_ratio=0.2,
+        memory_docstore_lazy=True,
+        memory_reindex_batch_size=256,
+        memory_reindex_workers=2,
+        memory_lexical_search=True,
+        memory_retention={
+            "fragments": {"max_documents": 20000, "max_age_days": 365},
+            "solutions": {"max_documents": 10000},
+        },
+        memory_retention_dry_run=True,
+        memory_index_mmap=True,
+        memory_knowledge_import_workers=4,
+        memory_knowledge_watch=True,
+        memory_document_cache_mb=256,
+        memory_document_cache_persist=True,
+        memory_document_fetch_cache_mb=1024,
+        memory_document_pdf_workers=4,
         api_keys={},
         auth_login="",
         auth_password="",
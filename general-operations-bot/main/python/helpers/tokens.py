@@ -1,44 +1,137 @@
-from typing import Literal
+import math
+from functools import lru_cache
+from typing import Literal, Sequence
 import tiktoken
 
 APPROX_BUFFER = 1.1
-TRIM_BUFFER = 0.8
+DEFAULT_ENCODING = "cl100k_base"
+BATCH_THREADS = 8
+CHARS_PER_TOKEN = 4.0  # starting ratio of the estimator before any exact count calibrates it
+CALIBRATION_WEIGHT = 0.05  # weight of each exact count in the moving ratio
+CALIBRATION_MIN_CHARS = 64  # shorter texts say too little about the ratio
+CALIBRATION_INTERVAL = 20  # when estimating, every n-th text is still counted exactly
+TRIM_STEP = 16  # initial step in characters when searching around the trim guess
 
+_estimate = False
+_estimated = 0
 
-def count_tokens(text: str, encoding_name="cl100k_base") -> int:
+
+@lru_cache(maxsize=None)
+def get_encoding(encoding_name: str = DEFAULT_ENCODING) -> tiktoken.Encoding:
+    return tiktoken.get_encoding(encoding_name)
+
+
+class TokenEstimator:
+    """Token count from text length in constant time, the characters per token ratio follows exact counts."""
+
+    def __init__(self, chars_per_token: float = CHARS_PER_TOKEN):
+        self.chars_per_token = chars_per_token
+
+    def estimate(self, text: str) -> int:
+        return math.ceil(len(text) / self.chars_per_token)
+
+    def calibrate(self, chars: int, tokens: int):
+        if chars < CALIBRATION_MIN_CHARS or not tokens:
+            return
+        self.chars_per_token += CALIBRATION_WEIGHT * (chars / tokens - self.chars_per_token)
+
+
+estimator = TokenEstimator()
+
+
+def set_estimation(enabled: bool):
+    """Make approximate_tokens estimate from text length instead of encoding every text."""
+    global _estimate
+    _estimate = enabled
+
+
+def count_tokens(text: str, encoding_name=DEFAULT_ENCODING) -> int:
     if not text:
         return 0
 
-    # Get the encoding
-    encoding = tiktoken.get_encoding(encoding_name)
+    # special token markers in the text are counted as plain text instead of raising
+    token_count = len(get_encoding(encoding_name).encode_ordinary(text))
+    estimator.calibrate(len(text), token_count)
+    return token_count
 
-    # Encode the text and count the tokens
-    tokens = encoding.encode(text)
-    token_count = len(tokens)
 
-    return token_count
+def count_tokens_batch(texts: Sequence[str], encoding_name=DEFAULT_ENCODING) -> list[int]:
+    """Exact counts of many texts, encoded in parallel threads by tiktoken."""
+    encoded = get_encoding(encoding_name).encode_ordinary_batch(
+        list(texts), num_threads=BATCH_THREADS
+    )
+    counts = [len(tokens) for tokens in encoded]
+    for text, token_count in zip(texts, counts):
+        estimator.calibrate(len(text), token_count)
+    return counts
+
+
+def estimate_tokens(text: str) -> int:
+    return estimator.estimate(text)
 
 
 def approximate_tokens(
     text: str,
 ) -> int:
+    global _estimated
+    if _estimate and text:
+        _estimated += 1
+        # keep the ratio calibrated to the texts of this chat
+        if _estimated % CALIBRATION_INTERVAL:
+            return int(estimate_tokens(text) * APPROX_BUFFER)
     return int(count_tokens(text) * APPROX_BUFFER)
 
 
+def approximate_tokens_batch(texts: Sequence[str]) -> list[int]:
+    if _estimate:
+        return [approximate_tokens(text) for text in texts]
+    return [int(count * APPROX_BUFFER) for count in count_tokens_batch(texts)]
+
+
 def trim_to_tokens(
     text: str,
     max_tokens: int,
     direction: Literal["start", "end"],
     ellipsis: str = "...",
 ) -> str:
-    chars = len(text)
-    tokens = count_tokens(text)
+    encoding = get_encoding()
+    tokens = encoding.encode_ordinary(text)
 
-    if tokens <= max_tokens:
+    if len(tokens) <= max_tokens:
         return text
 
-    approx_chars = int(chars * (max_tokens / tokens) * TRIM_BUFFER)
+    chars = len(text)
+
+    def cut(length: int) -> str:
+        return text[:length] if direction == "start" else text[chars - length :]
+
+    def fits(length: int) -> bool:
+        return len(encoding.encode_ordinary(cut(length))) <= max_tokens
+
+    # the text of the first or last max_tokens tokens is close to the cut, search the exact one around it
+    kept = tokens[:max_tokens] if direction == "start" else tokens[len(tokens) - max_tokens :]
+    guess = min(len(encoding.decode(kept)), chars - 1)
+    low, high = 0, chars  # cut(low) fits, cut(high) does not
+    step = TRIM_STEP
+    if fits(guess):
+        low = guess
+        while low + step < high and fits(low + step):
+            low += step
+            step *= 2
+        high = min(high, low + step)
+    else:
+        high = guess
+        while high - step > low and not fits(high - step):
+            high -= step
+            step *= 2
+        low = max(low, high - step)
+    while high - low > 1:
+        middle = (low + high) // 2
+        if fits(middle):
+            low = middle
+        else:
+            high = middle
 
     if direction == "start":
-        return text[:approx_chars] + ellipsis
-    return ellipsis + text[chars - approx_chars : chars]
+        return cut(low) + ellipsis
+    return ellipsis + cut(low)
@@ -1,5 +1,9 @@
-from typing import Any, List, Sequence
+import os
+import pickle
+from typing import Any, Callable, List, Sequence
 import uuid
+
+import numpy as np
 from langchain_community.vectorstores import FAISS
 
 # faiss needs to be patched for python 3.12 on arm #TODO remove once not needed
@@ -56,10 +60,24 @@ class VectorDB:
             )
         return VectorDB._cached_embeddings[namespace]
 
-    def __init__(self, agent: Agent, cache: bool = True):
+    def __init__(self, agent: Agent, cache: bool = True, folder: str = ""):
         self.agent = agent
         self.cache = cache  # store cache preference
+        self._positions: dict[str, int] | None = None  # index position of each id, reset on changes
         self.embeddings = self._get_embeddings(agent, cache=cache)
+
+        # reopen a database written by save()
+        if folder and os.path.exists(os.path.join(folder, "index.faiss")):
+            self.db = MyFaiss.load_local(
+                folder_path=folder,
+                embeddings=self.embeddings,
+                allow_dangerous_deserialization=True,
+                distance_strategy=DistanceStrategy.COSINE,
+                relevance_score_fn=cosine_normalizer,
+            )
+            self.index = self.db.index
+            return
+
         self.index = faiss.IndexFlatIP(len(self.embeddings.embed_query("example")))
 
         self.db = MyFaiss(
@@ -85,6 +103,94 @@ class VectorDB:
             filter=comparator,
         )
 
+    def search_by_vector(
+        self,
+        embedding: list[float],
+        limit: int,
+        threshold: float,
+        filter: str | Callable[[dict[str, Any]], bool] = "",
+    ) -> list[Document]:
+        """Similarity search with an already embedded query."""
+        return self.search_by_vectors([embedding], limit, threshold, filter)[0]
+
+    def search_by_vectors(
+        self,
+        embeddings: Sequence[Sequence[float]],
+        limit: int,
+        threshold: float,
+        filter: str | Callable[[dict[str, Any]], bool] = "",
+    ) -> list[list[Document]]:
+        """Similarity search of several embedded queries in one index pass, results per query."""
+        return [
+            [doc for doc, _ in found]
+            for found in self.search_by_vectors_with_scores(embeddings, limit, threshold, filter)
+        ]
+
+    def search_by_vectors_with_scores(
+        self,
+        embeddings: Sequence[Sequence[float]],
+        limit: int,
+        threshold: float,
+        filter: str | Callable[[dict[str, Any]], bool] = "",
+        ids: Sequence[str] | None = None,
+    ) -> list[list[tuple[Document, float]]]:
+        """
+        Like search_by_vectors, with the relevance score (0-1) of each document.
+        When ids are given, only those documents are searched.
+        """
+        if not self.index.ntotal or not len(embeddings):
+            return [[] for _ in embeddings]
+        comparator = get_comparator(filter) if isinstance(filter, str) and filter else filter or None
+        vectors = np.array(embeddings, dtype=np.float32).reshape(-1, self.index.d)
+        params = None
+        candidates = self.index.ntotal
+        if ids is not None:
+            selected = self.get_positions(ids)
+            if not selected:
+                return [[] for _ in embeddings]
+            # faiss only scores the selected positions, the selector must live until the search is done
+            selector = faiss.IDSelectorBatch(np.array(selected, dtype=np.int64))
+            params = faiss.SearchParameters(sel=selector)
+            candidates = len(selected)
+        # the filter is applied to the search results, search all candidates so that matches are not cut off
+        k = candidates if comparator else min(limit, candidates)
+        scores, positions = self.index.search(vectors, k, params=params)
+
+        relevance_fn = self.db._select_relevance_score_fn()
+        results = []
+        for row_scores, row_positions in zip(scores, positions):
+            found = []
+            for score, position in zip(row_scores, row_positions):
+                relevance = relevance_fn(float(score))
+                if position < 0 or relevance < threshold:
+                    continue
+                doc = self.db.docstore.search(self.db.index_to_docstore_id[int(position)])
+                if not isinstance(doc, Document) or (comparator and not comparator(doc.metadata)):
+                    continue
+                found.append((doc, relevance))
+                if len(found) >= limit:
+                    break
+            results.append(found)
+        return results
+
+    def get_vectors(self, ids: Sequence[str]) -> np.ndarray:
+        """Stored embeddings of the given document ids, one row per id."""
+        positions = self._position_map()
+        return np.array(
+            [self.index.reconstruct(positions[id]) for id in ids], dtype=np.float32
+        ).reshape(-1, self.index.d)
+
+    def get_positions(self, ids: Sequence[str]) -> list[int]:
+        """Index positions of the given document ids, unknown ids are skipped."""
+        positions = self._position_map()
+        return [positions[id] for id in ids if id in positions]
+
+    def _position_map(self) -> dict[str, int]:
+        # deletes shift the positions of later vectors, the map is rebuilt after every change
+        if self._positions is None:
+            self._positions = {id: pos for pos, id in self.db.index_to_docstore_id.items()}
+        return self._positions
+
     async def search_by_metadata(self, filter: str, limit: int = 0) -> list[Document]:
         comparator = get_comparator(filter)
         all_docs = self.db.get_all_docs()
@@ -105,8 +211,50 @@ class VectorDB:
                 doc.metadata["id"] = id  # add ids to documents metadata
 
             self.db.add_documents(documents=docs, ids=ids)
+            self._positions = None
         return ids
 
+    def insert_embeddings(self, docs: list[Document], vectors: list[list[float]]) -> list[str]:
+        """Insert documents with embeddings computed beforehand."""
+        ids = [str(uuid.uuid4()) for _ in range(len(docs))]
+        for doc, id in zip(docs, ids):
+            doc.metadata["id"] = id  # add ids to documents metadata
+        if ids:
+            self.db.add_embeddings(
+                zip([doc.page_content for doc in docs], vectors),
+                metadatas=[doc.metadata for doc in docs],
+                ids=ids,
+            )
+            self._positions = None
+        return ids
+
+    def delete_ids(self, ids: list[str]) -> int:
+        # missing ids make faiss raise, only delete existing ones
+        existing = [id for id in ids if id in self.db.get_all_docs()]
+        if existing:
+            self.db.delete(ids=existing)
+            self._positions = None
+        return len(existing)
+
+    def save(self, folder: str):
+        self.write(folder, *self.serialize())
+
+    def serialize(self) -> tuple[np.ndarray, bytes]:
+        """In-memory copy of the files written by save, so they can be written without holding a lock."""
+        return faiss.serialize_index(self.db.index), pickle.dumps(
+            (self.db.docstore, self.db.index_to_docstore_id)
+        )
+
+    @staticmethod
+    def write(folder: str, index_data: np.ndarray, store_data: bytes):
+        # same files as FAISS.save_local, each replaced atomically
+        os.makedirs(folder, exist_ok=True)
+        for name, data in (("index.faiss", index_data.tobytes()), ("index.pkl", store_data)):
+            path = os.path.join(folder, name)
+            with open(path + ".tmp", "wb") as f:
+                f.write(data)
+            os.replace(path + ".tmp", path)
+
     async def delete_documents_by_ids(self, ids: list[str]):
         # aget_by_ids is not yet implemented in faiss, need to do a workaround
         rem_docs = await self.db.aget_by_ids(
@@ -115,6 +263,7 @@ class VectorDB:
         if rem_docs:
             rem_ids = [doc.metadata["id"] for doc in rem_docs]  # ids to remove
             await self.db.adelete(ids=rem_ids)
+            self._positions = None
         return rem_docs
 
 
@@ -0,0 +1,47 @@
+import sys, os
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+from python.helpers.chunk_selection import group, mmr_order, pack
+
+RELEVANCE = [0.9, 0.89, 0.85, 0.5]
+VECTORS = np.array(
+    [
+        [1.0, 0.0],
+        [2.0, 0.0],  # same direction as the first one
+        [0.8, 0.6],
+        [0.0, 1.0],
+    ]
+)
+
+
+def test_mmr_order_prefers_diverse_candidates():
+    # the dissimilar last candidate comes before the more relevant similar one
+    assert mmr_order(RELEVANCE, VECTORS, lambda_mult=0.5, duplicate_similarity=0.95) == [0, 3, 2]
+    # ordered by relevance alone, near duplicates are still left out
+    assert mmr_order(RELEVANCE, VECTORS, lambda_mult=1.0, duplicate_similarity=0.95) == [0, 2, 3]
+    assert mmr_order(RELEVANCE, VECTORS, lambda_mult=1.0, duplicate_similarity=1.1) == [0, 1, 2, 3]
+    assert mmr_order([], np.zeros((0, 2)), lambda_mult=0.5, duplicate_similarity=0.95) == []
+
+
+def test_pack_skips_candidates_over_budget():
+    assert pack([0, 1, 2, 3], [5, 8, 3, 2], budget=10) == [0, 2, 3]
+    assert pack([3, 2, 1, 0], [5, 8, 3, 2], budget=10) == [3, 2, 0]
+    assert pack([0], [11], budget=10) == []
+
+
+def test_group_splits_consecutive_candidates():
+    sizes = [4, 4, 4, 9, 20]
+    assert group(range(5), sizes, budget=10, max_groups=3) == [[0, 1], [2], [3]]
+    # a candidate larger than the budget gets a group of its own
+    assert group(range(5), sizes, budget=10, max_groups=5) == [[0, 1], [2], [3], [4]]
+    assert group([], sizes, budget=10, max_groups=3) == []
+
+
+if __name__ == "__main__":
+    test_mmr_order_prefers_diverse_candidates()
+    test_pack_skips_candidates_over_budget()
+    test_group_splits_consecutive_candidates()
+    print("ok")
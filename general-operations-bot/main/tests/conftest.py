@@ -0,0 +1,148 @@
+"""
+Helpers shared by the tests and the memory benchmark.
+Memory subdirs and the embedding cache are kept in temporary folders, never in the repository's memory folder.
+"""
+
+import sys, os
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import random
+import tempfile
+import uuid
+import zlib
+from contextlib import contextmanager
+from typing import Iterator
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+import models
+from python.helpers import files, settings
+from python.helpers.embedding_cache import CACHE_FILE, EmbeddingCache
+from python.helpers.memory import Memory
+
+PROVIDER = "test"
+DIM = 32
+AREAS = [area.value for area in Memory.Area]
+WORDS = [f"w{i}" for i in range(5000)]
+
+
+class FakeEmbeddings(Embeddings):
+    """Hashed bag of words, deterministic and fast, texts sharing words are similar."""
+
+    def __init__(self, dim: int):
+        self.dim = dim
+
+    def _embed(self, text: str) -> list[float]:
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for word in text.split():
+            h = zlib.crc32(word.encode("utf-8"))
+            vector[h % self.dim] += 1.0 if h & 0x80000000 else -1.0
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> list[float]:
+        return self._embed(text)
+
+
+def fake_model_config(dim: int, name: str = "") -> models.ModelConfig:
+    return models.ModelConfig(
+        type=models.ModelType.EMBEDDING,
+        provider=PROVIDER,
+        name=name or f"fake-{dim}",
+        api_base="",
+        ctx_length=0,
+        vision=False,
+        limit_requests=0,
+        limit_input=0,
+        limit_output=0,
+        kwargs={},
+    )
+
+
+def make_text(rng: random.Random, words: int = 40) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(words))
+
+
+def make_docs(rng: random.Random, count: int) -> list[Document]:
+    return [
+        Document(
+            make_text(rng),
+            metadata={"area": rng.choice(AREAS), "tag": f"t{rng.randrange(10)}"},
+        )
+        for _ in range(count)
+    ]
+
+
+@contextmanager
+def memory_folder(folder: str) -> Iterator[str]:
+    """Resolve memory subdirs and the embedding cache below the given folder."""
+    get_abs_path = files.get_abs_path
+
+    def redirected(*relative_paths):
+        if relative_paths and relative_paths[0].split("/")[0] == "memory":
+            return os.path.join(folder, *relative_paths)
+        return get_abs_path(*relative_paths)
+
+    files.get_abs_path = redirected
+    try:
+        yield folder
+    finally:
+        files.get_abs_path = get_abs_path
+        cache = EmbeddingCache._instances.pop(
+            os.path.join(folder, "memory", "embeddings", CACHE_FILE), None
+        )
+        if cache:
+            cache.conn.close()
+
+
+@contextmanager
+def settings_overrides(**overrides) -> Iterator[dict]:
+    """Default settings with the given overrides."""
+    previous = settings._settings
+    settings._settings = {**settings.get_default_settings(), **overrides}  # type: ignore
+    try:
+        yield settings._settings  # type: ignore
+    finally:
+        settings._settings = previous
+
+
+@contextmanager
+def fake_embedding_model(dim: int = DIM) -> Iterator[FakeEmbeddings]:
+    embeddings = FakeEmbeddings(dim)
+    get_embedding_model = models.get_embedding_model
+    models.get_embedding_model = lambda *a, **k: embeddings  # type: ignore
+    try:
+        yield embeddings
+    finally:
+        models.get_embedding_model = get_embedding_model
+
+
+def open_memory(subdir: str, in_memory: bool = False, model_config: models.ModelConfig | None = None) -> Memory:
+    """Load a subdir like a new process, anything loaded before is dropped without saving."""
+    Memory.index.pop(subdir, None)
+    db, _ = Memory.initialize(None, model_config or fake_model_config(DIM), subdir, in_memory=in_memory)
+    Memory.index[subdir] = db
+    return Memory(None, db, subdir)  # type: ignore
+
+
+@contextmanager
+def temp_memory(in_memory: bool = True, **overrides) -> Iterator[Memory]:
+    """Memory in a temporary folder with a local embedder and the given settings."""
+    subdir = f"_test_{uuid.uuid4().hex[:8]}"
+    with (
+        tempfile.TemporaryDirectory() as folder,
+        memory_folder(folder),
+        settings_overrides(**overrides),
+        fake_embedding_model(),
+    ):
+        try:
+            yield open_memory(subdir, in_memory)
+        finally:
+            Memory._stop_reindex(subdir)
+            Memory.index.pop(subdir, None)
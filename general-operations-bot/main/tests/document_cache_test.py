@@ -0,0 +1,147 @@
+import sys, os
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import asyncio
+import tempfile
+from collections import Counter
+
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from python.helpers import document_cache
+from python.helpers.document_cache import DocumentCache
+
+BODY = "<html><body>" + "<p>cached paragraph</p>" * 100 + "</body></html>"
+
+
+def serve(check):
+    """Run check(cache, url, hits) against a local server with responses of every caching kind."""
+    hits: Counter[str] = Counter()
+
+    async def fresh(request):
+        hits["fresh"] += 1
+        return web.Response(text=BODY, content_type="text/html", headers={"Cache-Control": "max-age=60"})
+
+    async def etag(request):
+        hits["etag"] += 1
+        if request.headers.get("If-None-Match") == '"v1"':
+            return web.Response(status=304, headers={"ETag": '"v1"'})
+        return web.Response(
+            text=BODY, content_type="text/html", headers={"ETag": '"v1"', "Cache-Control": "no-cache"}
+        )
+
+    async def no_store(request):
+        hits["no_store"] += 1
+        return web.Response(text=BODY, content_type="text/html", headers={"Cache-Control": "no-store"})
+
+    async def missing(request):
+        hits["missing"] += 1
+        return web.Response(status=404)
+
+    async def flaky(request):
+        hits["flaky"] += 1
+        if hits["flaky"] == 1:
+            return web.Response(status=503)
+        return web.Response(text=BODY, content_type="text/html")
+
+    async def run():
+        app = web.Application()
+        for name, handler in [
+            ("fresh", fresh), ("etag", etag), ("no-store", no_store), ("missing", missing), ("flaky", flaky)
+        ]:
+            app.router.add_get("/" + name, handler)
+        server = TestServer(app)
+        await server.start_server()
+        try:
+            with tempfile.TemporaryDirectory() as folder:
+                cache = DocumentCache(folder)
+                try:
+                    await check(cache, lambda path: str(server.make_url(path)), hits)
+                finally:
+                    cache.conn.close()
+        finally:
+            await document_cache.get_session().close()
+            await server.close()
+
+    asyncio.run(run())
+
+
+def cached_keys(cache: DocumentCache) -> list[str]:
+    return [row[0] for row in cache.conn.execute("SELECT key FROM documents")]
+
+
+def test_fresh_document_is_served_from_cache():
+    async def check(cache, url, hits):
+        first = await cache.fetch(url("/fresh"))
+        second = await cache.fetch(url("/fresh"))
+        assert hits["fresh"] == 1
+        assert first == second
+        with open(first["path"], encoding="utf-8") as f:
+            assert f.read() == BODY
+
+    serve(check)
+
+
+def test_stale_document_is_revalidated():
+    async def check(cache, url, hits):
+        first = await cache.fetch(url("/etag"))
+        cache.store_text(url("/etag"), "extracted")
+        second = await cache.fetch(url("/etag"))
+        assert hits["etag"] == 2  # no-cache, revalidated on every use
+        assert second["checksum"] == first["checksum"]
+        assert second["text"] == "extracted"
+
+    serve(check)
+
+
+def test_no_store_body_is_removed_after_release():
+    async def check(cache, url, hits):
+        first = await cache.fetch(url("/no-store"))
+        second = await cache.fetch(url("/no-store"))
+        assert hits["no_store"] == 2
+        assert first["temporary"] and os.path.exists(first["path"])
+        assert first["path"] != second["path"]
+        assert not cached_keys(cache)
+        cache.release(first)
+        cache.release(second)
+        assert not os.listdir(os.path.join(cache.folder, document_cache.NO_STORE_FOLDER))
+
+        # cached bodies stay after release
+        fresh = await cache.fetch(url("/fresh"))
+        cache.release(fresh)
+        assert os.path.exists(fresh["path"])
+
+    serve(check)
+
+
+def test_client_errors_are_not_retried():
+    async def check(cache, url, hits):
+        try:
+            await cache.fetch(url("/missing"))
+        except ValueError as e:
+            assert "404" in str(e)
+        else:
+            assert False, "404 did not raise"
+        assert hits["missing"] == 1
+
+    serve(check)
+
+
+def test_server_errors_are_retried():
+    async def check(cache, url, hits):
+        document = await cache.fetch(url("/flaky"))
+        assert hits["flaky"] == 2
+        assert cached_keys(cache) == [url("/flaky")]
+        assert not document["temporary"]
+
+    serve(check)
+
+
+if __name__ == "__main__":
+    test_fresh_document_is_served_from_cache()
+    test_stale_document_is_revalidated()
+    test_no_store_body_is_removed_after_release()
+    test_client_errors_are_not_retried()
+    test_server_errors_are_retried()
+    print("ok")
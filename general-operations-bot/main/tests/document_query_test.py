@@ -0,0 +1,139 @@
+import sys, os
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import asyncio
+import tempfile
+import types
+from contextlib import contextmanager
+
+from python.helpers import document_query
+from python.helpers.document_query import DocumentQueryStore
+from conftest import DIM, FakeEmbeddings, settings_overrides
+
+URI = "file:///documents/report.pdf"
+SOURCE_CHECKSUM = "source"
+PAGES = [f"Page {number}" + " report text" * 50 for number in range(3)]
+
+
+class RecordingEmbeddings(FakeEmbeddings):
+    model_name = "recording"  # vector dbs share wrapped embedders by model name
+
+    def __init__(self, dim: int):
+        super().__init__(dim)
+        self.queries: list[str] = []
+
+    def embed_query(self, text: str) -> list[float]:
+        self.queries.append(text)
+        return super().embed_query(text)
+
+
+@contextmanager
+def temp_store(embeddings: FakeEmbeddings | None = None, folder: str = "", **overrides):
+    """Document store with a local embedder, kept in memory or saved below the given folder."""
+    embeddings = embeddings or FakeEmbeddings(DIM)
+    store_folder = document_query.STORE_FOLDER
+    document_query.STORE_FOLDER = folder or store_folder
+    try:
+        with settings_overrides(memory_document_cache_persist=bool(folder), **overrides):
+            agent = types.SimpleNamespace(get_embedding_model=lambda: embeddings)
+            yield DocumentQueryStore(agent, "_test")  # type: ignore
+    finally:
+        document_query.STORE_FOLDER = store_folder
+
+
+async def pages(texts: list[str | None]):
+    # pages complete out of order
+    for number in reversed(range(len(texts))):
+        yield number, texts[number]
+
+
+def test_document_with_failed_page_is_not_reused():
+    with temp_store() as store:
+        success, ids, text, complete = asyncio.run(
+            store.add_document_pages(pages([PAGES[0], None, PAGES[2]]), URI, source_checksum=SOURCE_CHECKSUM)
+        )
+        assert success and ids and not complete
+        assert text == "\n".join([PAGES[0], "", PAGES[2]])
+        # the next query extracts the document again
+        assert asyncio.run(store.get_cached_document(URI, SOURCE_CHECKSUM)) is None
+
+        success, ids, text, complete = asyncio.run(
+            store.add_document_pages(pages(PAGES), URI, source_checksum=SOURCE_CHECKSUM)
+        )
+        assert success and complete
+        assert asyncio.run(store.get_cached_document(URI, SOURCE_CHECKSUM)) == "\n".join(PAGES)
+
+
+def test_multi_question_search():
+    embeddings = RecordingEmbeddings(DIM)
+    with temp_store(embeddings) as store:
+        other = "file:///documents/other.pdf"
+        for uri, topic in ((URI, "alpha"), (other, "beta")):
+            texts = [f"{topic} chapter {number}" + f" {topic} text" * 50 for number in range(3)]
+            assert asyncio.run(store.add_document_pages(pages(texts), uri))[0]
+        embeddings.queries.clear()
+
+        queries = ["alpha text", "beta text", "alpha text"]
+        results = asyncio.run(store.search_documents_multi(queries, limit=3, threshold=0))
+        # each distinct question is embedded once, as a query
+        assert sorted(embeddings.queries) == ["alpha text", "beta text"]
+        assert [len(found) for found in results] == [3, 3, 3]
+        assert all(doc.metadata["document_uri"] == URI for doc, _ in results[0])
+        assert all(doc.metadata["document_uri"] == other for doc, _ in results[1])
+        assert results[2] == results[0]
+
+        # limited to one document
+        results = asyncio.run(store.search_document_multi(other, queries[:1], limit=3, threshold=0))
+        assert all(doc.metadata["document_uri"] == other for doc, _ in results[0])
+
+
+def text_of(word: str, size: int = 1000) -> str:
+    return " ".join([word] * (size // (len(word) + 1)))
+
+
+def test_least_recently_used_documents_are_evicted():
+    names = ["alpha", "bravo", "charlie"]
+    uris = [f"file:///documents/{name}.txt" for name in names]
+    size = 400 * 1024  # two documents fit into one megabyte
+    with temp_store(memory_document_cache_mb=1) as store:
+        for name, uri in zip(names[:2], uris):
+            assert asyncio.run(store.add_document(text_of(name, size), uri))[0]
+        # the same content again only counts as a use
+        assert asyncio.run(store.add_document(text_of("alpha", size), uris[0]))[0]
+        assert asyncio.run(store.add_document(text_of("charlie", size), uris[2]))[0]
+
+        assert asyncio.run(store.list_documents()) == [uris[0], uris[2]]
+        assert asyncio.run(store.document_exists(uris[1])) is False
+        found = asyncio.run(store.search_documents_multi([text_of("bravo")], limit=1000, threshold=0))
+        assert {doc.metadata["document_uri"] for doc, _ in found[0]} == {uris[0], uris[2]}
+
+
+def test_store_is_saved_and_loaded():
+    save_delay = document_query.SAVE_DELAY
+    document_query.SAVE_DELAY = 0.05
+    try:
+        with tempfile.TemporaryDirectory() as folder:
+            with temp_store(folder=folder) as store:
+                other = "file:///documents/other.txt"
+                assert asyncio.run(store.add_document(text_of("kept"), URI, source_checksum="v1"))[0]
+                assert asyncio.run(store.add_document(text_of("gone"), other))[0]
+                assert asyncio.run(store.delete_document(other))
+                store.save_task.result_sync(10)  # type: ignore
+
+            with temp_store(folder=folder) as store:
+                assert asyncio.run(store.list_documents()) == [URI]
+                assert asyncio.run(store.get_cached_document(URI, "v1")) == text_of("kept")
+                assert asyncio.run(store.get_cached_document(URI, "v2")) is None
+                found = asyncio.run(store.search_documents_multi([text_of("kept")], limit=5, threshold=0.9))
+                assert [doc.metadata["document_uri"] for doc, _ in found[0]] == [URI]
+    finally:
+        document_query.SAVE_DELAY = save_delay
+
+
+if __name__ == "__main__":
+    test_document_with_failed_page_is_not_reused()
+    test_multi_question_search()
+    test_least_recently_used_documents_are_evicted()
+    test_store_is_saved_and_loaded()
+    print("ok")
@@ -0,0 +1,71 @@
+import sys, os
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import json
+import tempfile
+import time
+
+import numpy as np
+
+from python.helpers.embedding_cache import CACHE_FILE, EmbeddingCache, EmbeddingCacheStore
+
+
+def vector(seed: int, dim: int = 4) -> list[float]:
+    return [float(seed + i) for i in range(dim)]
+
+
+def test_file_store_is_migrated():
+    with tempfile.TemporaryDirectory() as cache_dir:
+        # entries of the previous LocalFileStore cache, one JSON file per embedding
+        legacy = EmbeddingCacheStore(None, "provider_model")  # type: ignore
+        texts = [f"text {i}" for i in range(5)]
+        for i, text in enumerate(texts):
+            with open(os.path.join(cache_dir, legacy.encode_key(text)), "w") as f:
+                f.write(json.dumps(vector(i)))
+        with open(os.path.join(cache_dir, "broken"), "w") as f:
+            f.write("{not json")
+
+        cache = EmbeddingCache.get(cache_dir, 0)
+        try:
+            assert os.listdir(cache_dir) and all(name.startswith(CACHE_FILE) for name in os.listdir(cache_dir))
+            store = EmbeddingCacheStore(cache, "provider_model")
+            assert store.mget(texts + ["unknown"]) == [vector(i) for i in range(5)] + [None]
+            assert len(list(store.yield_keys())) == 5
+            assert cache.total_bytes == 5 * 4 * 4
+        finally:
+            EmbeddingCache._instances.pop(os.path.join(cache_dir, CACHE_FILE), None)
+            cache.conn.close()
+
+
+def test_least_recently_used_entries_are_evicted():
+    with tempfile.TemporaryDirectory() as cache_dir:
+        row = 4 * 4
+        cache = EmbeddingCache(os.path.join(cache_dir, CACHE_FILE), max_bytes=10 * row)
+        try:
+            for i in range(10):
+                cache.mset([(f"key{i}", vector(i))])
+                time.sleep(0.002)
+            cache.mget(["key0"])  # recently used, kept
+            time.sleep(0.002)
+
+            # over the limit, evicted down to 90% of it
+            cache.mset([("key10", vector(10))])
+            found = cache.mget([f"key{i}" for i in range(11)])
+            assert [i for i, v in enumerate(found) if v is None] == [1, 2]
+            assert np.array_equal(found[0], np.array(vector(0), dtype=np.float32))  # type: ignore
+            assert cache.total_bytes == 9 * row
+
+            # replacing and deleting keep the size in sync with the stored rows
+            cache.mset([("key3", vector(3, dim=8))])
+            cache.mdelete(["key4", "missing"])
+            stored = cache.conn.execute("SELECT SUM(LENGTH(vector)) FROM embeddings").fetchone()[0]
+            assert cache.total_bytes == stored == 9 * row
+        finally:
+            cache.conn.close()
+
+
+if __name__ == "__main__":
+    test_file_store_is_migrated()
+    test_least_recently_used_entries_are_evicted()
+    print("ok")
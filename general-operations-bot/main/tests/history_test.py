@@ -0,0 +1,67 @@
+import sys, os
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from python.helpers import tokens
+from python.helpers.history import History, Topic, deserialize_history
+from tokens_test import local_encoding
+
+
+def fresh_tokens(history: History) -> int:
+    """Token count of the history computed from scratch, without any cached counts."""
+
+    def topic_tokens(topic: Topic) -> int:
+        if topic.summary:
+            return tokens.approximate_tokens(topic.summary)
+        return sum(tokens.approximate_tokens(msg.output_text()) for msg in topic.messages)
+
+    return sum(topic_tokens(topic) for topic in history.topics) + topic_tokens(history.current)
+
+
+def make_history() -> History:
+    history = History(None)
+    for topic in range(3):
+        for i in range(4):
+            history.add_message(i % 2 == 1, f"topic {topic} message {i} " + "with some words " * (i + 1))
+        history.new_topic()
+    history.add_message(False, "current question " * 10)
+    return history
+
+
+def test_message_edit_invalidates_cached_tokens():
+    with local_encoding():
+        history = make_history()
+        assert history.get_tokens() == fresh_tokens(history)
+
+        # a large message in a past topic is replaced by a short summary
+        history.topics[1].messages[3].set_summary("short")
+        assert history.get_tokens() == fresh_tokens(history)
+
+        # a message of the current topic is edited
+        history.current.messages[0].set_summary("edited current question")
+        assert history.get_tokens() == fresh_tokens(history)
+
+        # a past topic is summarized
+        history.topics[0].summary = "summary of the first topic"
+        assert history.get_tokens() == fresh_tokens(history)
+
+        history.add_message(True, "answer " * 20)
+        assert history.get_tokens() == fresh_tokens(history)
+
+
+def test_cached_tokens_survive_serialization():
+    with local_encoding():
+        history = make_history()
+        history.topics[2].messages[0].set_summary("short")
+        total = history.get_tokens()
+        loaded = deserialize_history(history.serialize(), None)
+        assert loaded.get_tokens() == total == fresh_tokens(loaded)
+
+        loaded.topics[2].messages[1].set_summary("short as well")
+        assert loaded.get_tokens() == fresh_tokens(loaded) < total
+
+
+if __name__ == "__main__":
+    test_message_edit_invalidates_cached_tokens()
+    test_cached_tokens_survive_serialization()
+    print("ok")
@@ -0,0 +1,193 @@
+import sys, os
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import asyncio
+import hashlib
+import tempfile
+from concurrent.futures import Executor, Future
+from concurrent.futures.process import BrokenProcessPool
+
+from langchain_core.documents import Document
+
+from python.helpers import knowledge_import
+from python.helpers.knowledge_import import (
+    KnowledgeImport,
+    chunk_hash,
+    load_knowledge,
+    match_chunks,
+    parse_files,
+)
+from python.helpers.knowledge_index import KnowledgeImportIndex
+from conftest import temp_memory
+
+FILE = "/knowledge/default/main/guide.md"
+
+
+def make_chunks(texts: list[str]) -> list[Document]:
+    return [Document(page_content=text, metadata={"source": FILE, "area": "main"}) for text in texts]
+
+
+def changed_entry(store: KnowledgeImportIndex, documents: list[Document]) -> KnowledgeImport:
+    entry: KnowledgeImport = {
+        "file": FILE,
+        "checksum": "xxh3:changed",
+        "size": 100,
+        "mtime_ns": 1,
+        "state": "changed",
+        "documents": documents,
+        "metadata": {},
+    }  # type: ignore
+    store.load_chunks([entry])
+    return entry
+
+
+def test_edited_file_reuses_unchanged_chunks():
+    texts = [f"paragraph {i} of the knowledge guide" for i in range(5)]
+    with temp_memory(memory_compaction_ratio=0) as memory, tempfile.TemporaryDirectory() as folder:
+        store = KnowledgeImportIndex(folder)
+        asyncio.run(memory._insert_knowledge([changed_entry(store, make_chunks(texts))], store))
+        first = changed_entry(store, [])
+        assert len(first["ids"]) == len(first["chunks"]) == 5
+
+        # one paragraph edited, the last one removed and a new one appended
+        edited = texts[:2] + ["paragraph 2 rewritten"] + texts[3:4] + ["a new paragraph"]
+        inserted = memory.db.index.ntotal
+        asyncio.run(memory._insert_knowledge([changed_entry(store, make_chunks(edited))], store))
+        second = changed_entry(store, [])
+
+        assert memory.db.index.ntotal - inserted == 2  # only the edited and the new chunk are embedded
+        assert [second["ids"][i] for i in (0, 1, 3)] == [first["ids"][i] for i in (0, 1, 3)]
+        assert second["ids"][2] not in first["ids"] and second["ids"][4] not in first["ids"]
+        assert second["chunks"] == [chunk_hash(doc) for doc in make_chunks(edited)]
+        for id in (first["ids"][2], first["ids"][4]):
+            assert memory.db.get_metadata(id) is None
+        assert set(memory.db.index_to_docstore_id.values()) == set(second["ids"])
+        store.close()
+
+
+def test_duplicate_and_deleted_chunks():
+    docs = make_chunks(["same", "same", "other"])
+    hashes = [chunk_hash(doc) for doc in docs]
+    entry: KnowledgeImport = {"file": FILE, "ids": ["a", "b", "c"], "chunks": hashes}  # type: ignore
+
+    # equal chunks are matched one to one
+    ids, vanished = match_chunks(entry, hashes[:2], lambda id: True)
+    assert ids == ["a", "b"] and vanished == ["c"]
+
+    # a chunk deleted from memory meanwhile is inserted again
+    ids, vanished = match_chunks(entry, hashes, lambda id: id != "c")
+    assert ids == ["a", "b", None] and vanished == ["c"]
+
+
+class BrokenPool(Executor):
+    """Process pool whose workers could not start."""
+
+    def submit(self, fn, /, *args, **kwargs):
+        future: Future = Future()
+        future.set_exception(BrokenProcessPool("workers died"))
+        return future
+
+
+def parse_entries(folder: str, names: list[str]) -> list[KnowledgeImport]:
+    entries = []
+    for name in names:
+        path = os.path.join(folder, name)
+        with open(path, "w") as f:
+            f.write(f"# {name}\n\ncontent of {name}")
+        entries.append({"file": path, "metadata": {"area": "main"}})  # type: ignore
+    return entries
+
+
+def parse_all(entries: list[KnowledgeImport], workers: int) -> dict[str, list[Document] | None]:
+    async def collect():
+        return {entry["file"]: docs async for entry, docs in parse_files(None, entries, workers)}
+
+    return asyncio.run(collect())
+
+
+def test_parse_files_falls_back_to_a_thread():
+    create_executor = knowledge_import.create_executor
+    knowledge_import.create_executor = lambda workers: BrokenPool()
+    try:
+        with tempfile.TemporaryDirectory() as folder:
+            entries = parse_entries(folder, ["a.md", "b.md"])
+            entries.append({"file": os.path.join(folder, "missing.txt"), "metadata": {}})  # type: ignore
+            results = parse_all(entries, workers=4)
+    finally:
+        knowledge_import.create_executor = create_executor
+
+    # every file is parsed once in the fallback thread, a file that cannot be loaded yields None
+    assert len(results) == 3
+    for entry in entries[:2]:
+        docs = results[entry["file"]]
+        assert docs and "content of" in docs[0].page_content and docs[0].metadata["area"] == "main"
+    assert results[entries[2]["file"]] is None
+
+
+def test_parse_files_in_worker_processes():
+    with tempfile.TemporaryDirectory() as folder:
+        entries = parse_entries(folder, [f"doc{i}.md" for i in range(4)])
+        results = parse_all(entries, workers=2)
+    assert {file: docs[0].page_content.split()[-1] for file, docs in results.items()} == {  # type: ignore
+        entry["file"]: os.path.basename(entry["file"]) for entry in entries
+    }
+
+
+def test_unchanged_files_are_not_hashed():
+    hashed: list[str] = []
+    calculate_checksum = knowledge_import.calculate_checksum
+
+    def counting_checksum(file_path: str, legacy: bool = False):
+        hashed.append(os.path.basename(file_path))
+        return calculate_checksum(file_path, legacy)
+
+    def scan(folder: str, index: dict) -> dict[str, str]:
+        hashed.clear()
+        for entry in index.values():
+            entry.pop("state", None)  # entries are stored without a state
+        load_knowledge(None, folder, index)
+        return {os.path.basename(file): entry["state"] for file, entry in index.items()}
+
+    knowledge_import.calculate_checksum = counting_checksum
+    try:
+        with tempfile.TemporaryDirectory() as folder:
+            for name in ("a.md", "b.md", "c.md", "d.md"):
+                with open(os.path.join(folder, name), "w") as f:
+                    f.write(f"content of {name}")
+            index: dict = {}
+            assert set(scan(folder, index).values()) == {"changed"}
+            assert sorted(hashed) == ["a.md", "b.md", "c.md", "d.md"]
+
+            assert set(scan(folder, index).values()) == {"original"}
+            assert hashed == []
+
+            # touched but equal, rewritten with the same size, and an md5 checksum of an older index
+            path = lambda name: os.path.join(folder, name)
+            stat = os.stat(path("a.md"))
+            os.utime(path("a.md"), ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+            with open(path("b.md"), "w") as f:
+                f.write("CONTENT of b.md")
+            os.utime(path("b.md"), ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+            with open(path("c.md"), "rb") as f:
+                legacy = {"checksum": hashlib.md5(f.read()).hexdigest(), "size": -1, "mtime_ns": -1}
+            index[path("c.md")].update(legacy)
+            states = scan(folder, index)
+            assert states == {"a.md": "original", "b.md": "changed", "c.md": "original", "d.md": "original"}
+            assert sorted(hashed) == ["a.md", "b.md", "c.md"]
+            assert index[path("c.md")]["checksum"].startswith(knowledge_import.CHECKSUM_PREFIX)
+
+            os.remove(path("d.md"))
+            assert scan(folder, index)["d.md"] == "removed"
+            assert hashed == []
+    finally:
+        knowledge_import.calculate_checksum = calculate_checksum
+
+
+if __name__ == "__main__":
+    test_edited_file_reuses_unchanged_chunks()
+    test_duplicate_and_deleted_chunks()
+    test_parse_files_falls_back_to_a_thread()
+    test_parse_files_in_worker_processes()
+    test_unchanged_files_are_not_hashed()
+    print("ok")
@@ -0,0 +1,82 @@
+import sys, os
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import json
+import tempfile
+
+from langchain_core.documents import Document
+
+from python.helpers import knowledge_index
+from python.helpers.knowledge_import import chunk_hash, match_chunks
+from python.helpers.knowledge_index import KnowledgeImportIndex
+
+FILE = "/knowledge/default/main/guide.md"
+
+
+def test_migrate_legacy_index():
+    with tempfile.TemporaryDirectory() as folder:
+        legacy_path = os.path.join(folder, knowledge_index.LEGACY_FILE)
+        with open(legacy_path, "w") as f:
+            # entries of older versions have md5 checksums and no chunk hashes or stat fields
+            json.dump({FILE: {"file": FILE, "checksum": "0cc175b9c0f1b6a8", "ids": ["a", "b"]}}, f)
+
+        store = KnowledgeImportIndex(folder)
+        assert not os.path.exists(legacy_path)
+        entries = store.entries()
+        assert entries[FILE]["checksum"] == "0cc175b9c0f1b6a8"
+        assert entries[FILE]["size"] == -1 and entries[FILE]["mtime_ns"] == -1
+        store.load_chunks(entries.values())
+        assert entries[FILE]["ids"] == ["a", "b"] and entries[FILE]["chunks"] == []
+
+        # without chunk hashes nothing is reused, the old chunks are replaced
+        hashes = [chunk_hash(Document(page_content=text)) for text in ("x", "y")]
+        assert match_chunks(entries[FILE], hashes, lambda id: True) == ([None, None], ["a", "b"])
+        store.close()
+
+        # the migration runs once, a later legacy file does not overwrite newer rows
+        with open(legacy_path, "w") as f:
+            json.dump({FILE: {"file": FILE, "checksum": "stale", "ids": []}}, f)
+        store = KnowledgeImportIndex(folder)
+        assert store.entries()[FILE]["checksum"] == "0cc175b9c0f1b6a8"
+        store.close()
+
+
+def test_migrate_unreadable_legacy_index():
+    with tempfile.TemporaryDirectory() as folder:
+        legacy_path = os.path.join(folder, knowledge_index.LEGACY_FILE)
+        with open(legacy_path, "w") as f:
+            f.write('{"truncated": ')
+        store = KnowledgeImportIndex(folder)
+        assert not os.path.exists(legacy_path)
+        assert store.entries() == {}  # knowledge is imported again
+        store.close()
+
+
+def test_entries_below_paths():
+    with tempfile.TemporaryDirectory() as folder:
+        store = KnowledgeImportIndex(folder)
+        for path in ["/kn/a.md", "/kn/sub/b.md", "/kn/sub/deep/c.md", "/kn/subway.md", "/other/d.md"]:
+            store.put({"file": path, "checksum": "x", "size": 1, "mtime_ns": 1, "ids": [path], "chunks": ["h"]})  # type: ignore
+
+        assert sorted(store.entries(["/kn/sub"])) == ["/kn/sub/b.md", "/kn/sub/deep/c.md"]
+        assert sorted(store.entries(["/kn/a.md", "/other"])) == ["/kn/a.md", "/other/d.md"]
+        assert len(store.entries()) == 5
+
+        # stat updates keep the chunks, deletes remove the rows
+        entry = store.entries(["/kn/a.md"])["/kn/a.md"]
+        entry.update(checksum="y", size=2, mtime_ns=2)
+        store.update_stat(entry)
+        store.delete(["/kn/subway.md"])
+        entries = store.entries()
+        store.load_chunks(entries.values())
+        assert entries["/kn/a.md"]["checksum"] == "y" and entries["/kn/a.md"]["ids"] == ["/kn/a.md"]
+        assert "/kn/subway.md" not in entries
+        store.close()
+
+
+if __name__ == "__main__":
+    test_migrate_legacy_index()
+    test_migrate_unreadable_legacy_index()
+    test_entries_below_paths()
+    print("ok")
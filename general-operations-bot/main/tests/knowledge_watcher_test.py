@@ -0,0 +1,108 @@
+import sys, os
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ctypes
+import errno
+import tempfile
+import threading
+import time
+import types
+
+from python.helpers import knowledge_watcher
+from python.helpers.knowledge_watcher import KnowledgeWatcher, _InotifyBackend
+
+
+def failing_add_watch(code: int):
+    def add_watch(fd, path, mask):
+        ctypes.set_errno(code)
+        return -1
+
+    return types.SimpleNamespace(inotify_add_watch=add_watch)
+
+
+def read_until(backend, predicate, timeout: float = 5.0) -> set[str]:
+    changed: set[str] = set()
+    deadline = time.monotonic() + timeout
+    while not predicate(changed) and time.monotonic() < deadline:
+        changed |= backend.read(0.1)
+    return changed
+
+
+def test_changes_are_reported_in_one_debounced_batch():
+    batches: list[set[str]] = []
+    done = threading.Event()
+
+    async def on_change(paths: set[str]):
+        batches.append(paths)
+        done.set()
+
+    read_timeout = knowledge_watcher.READ_TIMEOUT
+    knowledge_watcher.READ_TIMEOUT = 0.05
+    with tempfile.TemporaryDirectory() as root:
+        watcher = KnowledgeWatcher("test", [root], on_change, debounce=0.3).start()
+        try:
+            time.sleep(0.2)  # the backend starts in the watcher thread
+            paths = [os.path.join(root, f"doc{i}.md") for i in range(5)]
+            for path in paths:
+                with open(path, "w") as f:
+                    f.write("text")
+                time.sleep(0.05)  # closer together than the debounce
+            # hidden and backup files are ignored
+            for name in (".doc.md.swp", "doc0.md~"):
+                with open(os.path.join(root, name), "w") as f:
+                    f.write("text")
+            assert done.wait(10)
+            time.sleep(0.5)
+            assert batches == [set(paths)]
+        finally:
+            watcher.stop()
+            knowledge_watcher.READ_TIMEOUT = read_timeout
+
+
+def test_removed_folder_is_skipped():
+    with tempfile.TemporaryDirectory() as root:
+        backend = _InotifyBackend([root])
+        try:
+            libc = backend.libc
+            # the new folder is gone before it is watched
+            backend.libc = failing_add_watch(errno.ENOENT)
+            os.mkdir(os.path.join(root, "gone"))
+            changed = read_until(backend, lambda changed: bool(changed))
+            assert changed == {os.path.join(root, "gone")}
+            assert backend.polling is None
+
+            backend.libc = libc
+            path = os.path.join(root, "doc.md")
+            with open(path, "w") as f:
+                f.write("text")
+            assert path in read_until(backend, lambda changed: path in changed)
+        finally:
+            backend.close()
+
+
+def test_watch_limit_falls_back_to_polling():
+    with tempfile.TemporaryDirectory() as root:
+        backend = _InotifyBackend([root])
+        try:
+            backend.libc = failing_add_watch(errno.ENOSPC)
+            os.mkdir(os.path.join(root, "new"))
+            changed = read_until(backend, lambda changed: bool(changed))
+            assert root in changed  # everything is rescanned
+            assert backend.polling is not None and backend.fd == -1
+
+            # changes below the folder that could not be watched are found by polling
+            path = os.path.join(root, "new", "doc.md")
+            with open(path, "w") as f:
+                f.write("text")
+            backend.polling.next_scan = 0
+            assert backend.read(0.1) == {path}
+        finally:
+            backend.close()
+
+
+if __name__ == "__main__":
+    test_changes_are_reported_in_one_debounced_batch()
+    test_removed_folder_is_skipped()
+    test_watch_limit_falls_back_to_polling()
+    print("ok")
@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+"""
+Memory subsystem benchmark on synthetic corpora.
+
+Builds temporary memory subdirs with a deterministic local embedder and times
+inserts, searches, deletes, snapshots and cold loads. Results are written as JSON
+so runs before and after a change can be compared.
+
+    python tests/memory_benchmark.py --sizes 10000,100000 --output bench.json
+"""
+
+import sys, os
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import argparse
+import asyncio
+import json
+import platform
+import random
+import resource
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+import models
+from python.helpers import files
+from python.helpers.memory import Memory
+from conftest import fake_embedding_model, fake_model_config, make_docs, memory_folder
+
+
+def make_query(rng: random.Random, text: str) -> str:
+    # a subset of a stored text, so searches have real matches
+    words = text.split()
+    return " ".join(rng.sample(words, k=len(words) // 2))
+
+
+def stats(samples: list[float]) -> dict:
+    ms = np.array(samples, dtype=np.float64) * 1000
+    return {
+        "count": len(samples),
+        "mean_ms": float(ms.mean()),
+        "p50_ms": float(np.percentile(ms, 50)),
+        "p90_ms": float(np.percentile(ms, 90)),
+        "p99_ms": float(np.percentile(ms, 99)),
+        "max_ms": float(ms.max()),
+    }
+
+
+def peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on linux, bytes on macos
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+async def timed(samples: list[float], coro):
+    start = time.perf_counter()
+    result = await coro
+    samples.append(time.perf_counter() - start)
+    return result
+
+
+async def bench_size(size: int, args, model_config: models.ModelConfig) -> dict:
+    rng = random.Random(args.seed)
+    subdir = f"_benchmark_{size}"
+    Memory.index.pop(subdir, None)
+    result: dict = {"docs": size, "operations": {}, "peak_rss_mb": {}}
+    ops = result["operations"]
+
+    db, _ = Memory.initialize(None, model_config, subdir)
+    memory = Memory(None, db, subdir)  # type: ignore
+
+    # insert in batches, the corpus is generated per batch to keep memory flat
+    samples: list[float] = []
+    sample_texts: list[str] = []
+    for start in range(0, size, args.batch):
+        docs = make_docs(rng, min(args.batch, size - start))
+        sample_texts.extend(doc.page_content for doc in docs[: max(1, args.queries // 10)])
+        await timed(samples, memory.insert_documents(docs))
+    ops["insert_documents"] = stats(samples)
+    ops["insert_documents"]["batch"] = args.batch
+    ops["insert_documents"]["docs_per_s"] = size / sum(samples)
+    result["peak_rss_mb"]["after_insert"] = peak_rss_mb()
+
+    queries = [make_query(rng, rng.choice(sample_texts)) for _ in range(args.queries)]
+    filters = {
+        "search": "",
+        "search_indexed_filter": f"area == '{Memory.Area.MAIN.value}'",
+        "search_evaluated_filter": "tag == 't3'",
+    }
+    for name, condition in filters.items():
+        samples = []
+        for query in queries:
+            await timed(
+                samples,
+                memory.search_similarity_threshold(
+                    query, args.limit, args.threshold, filter=condition
+                ),
+            )
+        ops[name] = stats(samples)
+    result["peak_rss_mb"]["after_search"] = peak_rss_mb()
+
+    samples = []
+    deleted = 0
+    # full stored texts, each call removes its document and near duplicates
+    for query in rng.sample(sample_texts, k=min(args.deletes, len(sample_texts))):
+        removed = await timed(
+            samples, memory.delete_documents_by_query(query, args.delete_threshold)
+        )
+        deleted += len(removed)
+    ops["delete_documents_by_query"] = stats(samples)
+    ops["delete_documents_by_query"]["deleted"] = deleted
+
+    samples = []
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        Memory._save_db_file(db, subdir)
+        samples.append(time.perf_counter() - start)
+    ops["save_db_file"] = stats(samples)
+    result["peak_rss_mb"]["after_save"] = peak_rss_mb()
+
+    samples = []
+    for _ in range(args.repeat):
+        Memory.index.pop(subdir, None)
+        start = time.perf_counter()
+        db, _ = Memory.initialize(None, model_config, subdir)
+        samples.append(time.perf_counter() - start)
+    ops["initialize_cold"] = stats(samples)
+    result["peak_rss_mb"]["after_load"] = peak_rss_mb()
+    result["index_size"] = db.index.ntotal  # includes tombstones of deleted documents
+    result["live_documents"] = len(db.index_to_docstore_id)
+
+    if not args.keep:
+        shutil.rmtree(files.get_abs_path("memory", subdir), ignore_errors=True)
+    return result
+
+
+async def run(args) -> dict:
+    model_config = fake_model_config(args.dim)
+    # subdirs and the embedding cache live in a temporary folder, never in the real memory folder
+    folder = tempfile.mkdtemp(prefix="memory_benchmark_")
+    results = []
+    try:
+        with memory_folder(folder), fake_embedding_model(args.dim):
+            for size in args.sizes:
+                print(f"Benchmarking {size} documents...", file=sys.stderr)
+                results.append(await bench_size(size, args, model_config))
+    finally:
+        if args.keep:
+            print(f"Benchmark subdirs kept in {folder}", file=sys.stderr)
+        else:
+            shutil.rmtree(folder, ignore_errors=True)
+    return {
+        "config": {k: v for k, v in vars(args).items() if k != "output"},
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+        },
+        "results": results,
+    }
+
+
+def parse_args(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument(
+        "--sizes",
+        type=lambda s: [int(x) for x in s.split(",")],
+        default=[10_000, 100_000, 1_000_000],
+        help="comma separated corpus sizes",
+    )
+    parser.add_argument("--dim", type=int, default=384, help="embedding dimension")
+    parser.add_argument("--batch", type=int, default=1000, help="documents per insert call")
+    parser.add_argument("--queries", type=int, default=200, help="searches per variant")
+    parser.add_argument("--deletes", type=int, default=20, help="delete_documents_by_query calls")
+    parser.add_argument("--limit", type=int, default=10)
+    parser.add_argument("--threshold", type=float, default=0.6)
+    parser.add_argument("--delete-threshold", type=float, default=0.9)
+    parser.add_argument("--repeat", type=int, default=3, help="runs of save and cold load")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--keep", action="store_true", help="keep the benchmark subdirs")
+    parser.add_argument("--output", help="write JSON here instead of stdout")
+    return parser.parse_args(argv)
+
+
+def main():
+    args = parse_args()
+    report = asyncio.run(run(args))
+    data = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(data)
+    else:
+        print(data)
+
+
+if __name__ == "__main__":
+    main()
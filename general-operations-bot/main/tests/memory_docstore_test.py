@@ -0,0 +1,88 @@
+import sys, os
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pickle
+import tempfile
+
+from langchain_core.documents import Document
+
+from python.helpers import memory_docstore
+from python.helpers.memory_docstore import LazyDocuments, SQLiteDocstore
+
+DOCS = memory_docstore.READ_BATCH * 2 + 10  # spans several read batches
+
+
+def make_docs(count: int, start: int = 0) -> dict[str, Document]:
+    return {
+        f"id{i}": Document(page_content=f"content {i}", metadata={"id": f"id{i}", "area": "main"})
+        for i in range(start, start + count)
+    }
+
+
+def test_add_get_delete():
+    with tempfile.TemporaryDirectory() as folder:
+        store = SQLiteDocstore(os.path.join(folder, memory_docstore.DOCSTORE_FILE))
+        store.add(make_docs(DOCS))
+        assert len(store) == DOCS and "id3" in store
+
+        found = store.search("id3")
+        assert isinstance(found, Document)
+        assert found.page_content == "content 3" and found.metadata["area"] == "main"
+        assert store.search("missing") == "ID missing not found."
+        ids = [f"id{i}" for i in range(DOCS - 1, -1, -1)] + ["missing"]
+        assert [doc.id for doc in store.mget(ids)] == ids[:-1]
+
+        store.delete(["id1", "id2"])
+        store.retain({f"id{i}" for i in range(3, DOCS - 1)})
+        assert len(store) == DOCS - 4
+        assert "id0" not in store and f"id{DOCS - 1}" not in store
+        assert store.mget(["id0", "id1", "id3"])[0].id == "id3"
+        store.conn.close()  # type: ignore
+
+
+def test_iterate_in_batches_while_writing():
+    with tempfile.TemporaryDirectory() as folder:
+        store = SQLiteDocstore(os.path.join(folder, memory_docstore.DOCSTORE_FILE))
+        store.add(make_docs(DOCS))
+
+        seen = []
+        for id, doc in store.iter_documents():
+            seen.append(id)
+            assert doc.page_content == "content " + id.removeprefix("id")
+            if len(seen) == 1:
+                # documents deleted after the iteration started are skipped
+                store.delete([f"id{DOCS - 1}"])
+                store.add(make_docs(1, DOCS))
+        assert len(seen) >= DOCS - 1
+        assert f"id{DOCS - 1}" not in seen
+        assert set(seen) <= set(store.metadata)
+
+        lazy = LazyDocuments(store)
+        assert dict(lazy.items()).keys() == store.metadata.keys()
+        assert lazy["id5"].page_content == "content 5"
+        store.conn.close()  # type: ignore
+
+
+def test_reopen_after_pickle():
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, memory_docstore.DOCSTORE_FILE)
+        store = SQLiteDocstore(path)
+        store.add(make_docs(10))
+        data = pickle.dumps(store)
+        store.conn.close()  # type: ignore
+
+        # the pickle holds the path only, the documents are read from the file again
+        loaded: SQLiteDocstore = pickle.loads(data)
+        assert loaded.path == path and not loaded.metadata
+        loaded.open(path)
+        assert len(loaded) == 10
+        assert loaded.search("id9").page_content == "content 9"  # type: ignore
+        loaded.conn.close()  # type: ignore
+
+
+if __name__ == "__main__":
+    test_add_get_delete()
+    test_iterate_in_batches_while_writing()
+    test_reopen_after_pickle()
+    print("ok")
@@ -0,0 +1,138 @@
+import sys, os
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import random
+
+from simpleeval import simple_eval
+
+from python.helpers.memory_filter import MetadataIndex, compile_filter
+
+AREAS = ["main", "fragments", "solutions", "instruments"]
+SOURCES = ["", "guide.md", "notes.txt"]
+
+# exact plans, the index alone decides the result
+EXACT = [
+    "area == 'main'",
+    "'main' == area",
+    "area != 'main'",
+    "area == 'main' or area == 'fragments'",
+    # earlier operands reference fields some documents lack
+    "source_file == 'guide.md' or area == 'main'",
+    "knowledge_source or source_file == 'notes.txt' or area != 'main'",
+    "area == 'main' and source_file == '' or knowledge_source",
+    "area == 'main' and knowledge_source",
+    "not area == 'main'",
+    "not (area == 'main' or knowledge_source)",
+    "not (area == 'main' and source_file == 'guide.md')",
+    "knowledge_source",
+    "source_file == 'guide.md'",
+    "timestamp < '2024-06-01'",
+    "timestamp >= '2024-03-15 12:00:00'",
+    "'2024-02-01' <= timestamp < '2024-09-01'",
+    "area == 'main' and timestamp > '2024-10-01'",
+]
+# inexact plans, the index narrows the candidates and the evaluator checks the rest
+INEXACT = [
+    "area == 'main' and importance > 2",
+    "area == 'solutions' and 'x' in tags",
+    "importance > 2 and timestamp < '2024-05-01'",
+]
+# nothing indexable, every document is evaluated
+UNPLANNED = [
+    "importance > 2",
+    "area == 'main' or importance > 2",
+    "area.startswith('m')",
+    # the evaluator has no collection literals, these match nothing
+    "area in ['main', 'solutions']",
+    "area not in ('main', 'fragments')",
+    "not importance",
+    "area ==",
+]
+
+
+def make_metadata(count: int, seed: int = 0) -> dict[str, dict]:
+    rng = random.Random(seed)
+    result = {}
+    for i in range(count):
+        metadata: dict = {"importance": rng.randint(0, 4), "tags": rng.choice(["x", "y", "xy"])}
+        # some fields are missing, like in memories saved by older versions
+        if rng.random() < 0.9:
+            metadata["area"] = rng.choice(AREAS)
+        if rng.random() < 0.5:
+            metadata["knowledge_source"] = rng.random() < 0.5
+        if rng.random() < 0.3:
+            metadata["source_file"] = rng.choice(SOURCES)
+        if rng.random() < 0.95:
+            metadata["timestamp"] = f"2024-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d} 12:00:00"
+        result[f"id{i}"] = metadata
+    return result
+
+
+def matches(condition: str, metadata: dict[str, dict]) -> set[str]:
+    # same semantics as the comparator of Memory, errors such as missing names do not match
+    result = set()
+    for id, data in metadata.items():
+        try:
+            if simple_eval(condition, names=data):
+                result.add(id)
+        except Exception:
+            pass
+    return result
+
+
+def test_exact_plans_match_evaluator():
+    metadata = make_metadata(500)
+    index = MetadataIndex.from_metadata(metadata.items())
+    for condition in EXACT:
+        plan = compile_filter(condition)
+        assert plan and plan.exact, condition
+        assert index.resolve(plan) == matches(condition, metadata), condition
+
+
+def test_inexact_plans_cover_evaluator():
+    metadata = make_metadata(500)
+    index = MetadataIndex.from_metadata(metadata.items())
+    for condition in INEXACT:
+        plan = compile_filter(condition)
+        assert plan and not plan.exact, condition
+        candidates = index.resolve(plan)
+        assert matches(condition, metadata) <= candidates, condition
+        assert len(candidates) < len(metadata), condition
+    for condition in UNPLANNED:
+        assert compile_filter(condition) is None, condition
+    assert not matches("area in ['main', 'solutions']", metadata)
+
+
+def test_missing_field_in_first_operand():
+    # the evaluator fails on the missing source_file before it gets to the area
+    metadata = {"only_area": {"area": "main"}, "both": {"area": "main", "source_file": "y"}}
+    index = MetadataIndex.from_metadata(metadata.items())
+    condition = "source_file == 'x' or area == 'main'"
+    assert matches(condition, metadata) == {"both"}
+    assert index.resolve(compile_filter(condition)) == {"both"}  # type: ignore
+
+    # a false operand stops "and" before the missing field is read
+    condition = "not (area == 'fragments' and source_file == 'x')"
+    assert matches(condition, metadata) == {"only_area", "both"}
+    assert index.resolve(compile_filter(condition)) == {"only_area", "both"}  # type: ignore
+
+
+def test_index_follows_removals():
+    metadata = make_metadata(500)
+    index = MetadataIndex.from_metadata(metadata.items())
+    removed = {id: metadata.pop(id) for id in list(metadata)[::3]}
+    index.remove(removed.items())
+    added = {f"new{id}": data for id, data in make_metadata(50, seed=1).items()}
+    index.add(added.items())
+    metadata.update(added)
+    for condition in EXACT:
+        assert index.resolve(compile_filter(condition)) == matches(condition, metadata), condition  # type: ignore
+
+
+if __name__ == "__main__":
+    test_exact_plans_match_evaluator()
+    test_inexact_plans_cover_evaluator()
+    test_missing_field_in_first_operand()
+    test_index_follows_removals()
+    print("ok")
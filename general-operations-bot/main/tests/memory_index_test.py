@@ -0,0 +1,81 @@
+import sys, os
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+from python.helpers import memory_index
+
+DIM = 16
+DOCS = 2000
+
+
+def make_vectors(count: int, seed: int = 0) -> np.ndarray:
+    vectors = np.random.default_rng(seed).standard_normal((count, DIM)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def make_index(index_type: memory_index.IndexType, vectors: np.ndarray):
+    ivf_min_docs = memory_index.IVF_MIN_DOCS
+    memory_index.IVF_MIN_DOCS = 0  # train IVF on a small corpus
+    try:
+        index = memory_index.create_index(index_type, DIM, vectors)
+    finally:
+        memory_index.IVF_MIN_DOCS = ivf_min_docs
+    assert memory_index.get_index_type(index) == index_type
+    return index
+
+
+def expected(vectors: np.ndarray, query: np.ndarray, min_score: float, allowed: set[int]) -> set[int]:
+    scores = vectors @ query
+    return {pos for pos in np.flatnonzero(scores >= min_score) if pos in allowed}
+
+
+def check_range_search(index_type: memory_index.IndexType):
+    vectors = make_vectors(DOCS)
+    index = make_index(index_type, vectors)
+    query = vectors[7]
+    min_score = 0.3
+
+    # excluded positions, as passed for tombstones
+    exclude = set(range(0, DOCS, 3))
+    scores, found = memory_index.range_search(index, query, min_score, exclude=exclude)
+    allowed = set(range(DOCS)) - exclude
+    assert 7 not in exclude
+    assert not exclude.intersection(found.tolist())
+    assert np.all(scores >= np.float32(min_score) - 1e-6)
+    if index_type != memory_index.IVF_FLAT:
+        assert set(found.tolist()) == expected(vectors, query, min_score, allowed)
+    else:
+        # IVF only probes some lists, the query vector itself is always found
+        assert 7 in found.tolist()
+
+    # positions above the exact scoring limit go through the index with a selector
+    positions = list(range(1, DOCS, 2))
+    exact_max = memory_index.SUBSET_EXACT_MAX
+    memory_index.SUBSET_EXACT_MAX = 0
+    try:
+        scores, found = memory_index.range_search(index, query, min_score, positions=positions)
+    finally:
+        memory_index.SUBSET_EXACT_MAX = exact_max
+    assert set(found.tolist()) <= set(positions)
+    assert 7 in found.tolist()
+
+
+def test_range_search_flat():
+    check_range_search(memory_index.FLAT)
+
+
+def test_range_search_hnsw():
+    check_range_search(memory_index.HNSW)
+
+
+def test_range_search_ivf():
+    check_range_search(memory_index.IVF_FLAT)
+
+
+if __name__ == "__main__":
+    test_range_search_flat()
+    test_range_search_hnsw()
+    test_range_search_ivf()
+    print("ok")
@@ -0,0 +1,69 @@
+import sys, os
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import asyncio
+import random
+
+import numpy as np
+from langchain_core.documents import Document
+
+from python.helpers.memory import Memory
+from python.helpers.memory_lexical import LexicalIndex
+from conftest import DIM, FakeEmbeddings, make_docs, make_text, temp_memory
+
+GROUPS = {"main": (f"area == '{Memory.Area.MAIN.value}'", 5)}
+
+
+def relevance(query: str, text: str) -> float:
+    embeddings = FakeEmbeddings(DIM)
+    return Memory._cosine_normalizer(
+        float(np.dot(embeddings.embed_query(query), embeddings.embed_query(text)))
+    )
+
+
+def test_common_terms_are_ignored():
+    index = LexicalIndex.from_texts(
+        (f"id{i}", f"the report number r{i}" + (" err4711" if i == 3 else "")) for i in range(10)
+    )
+    # "the" and "report" are in every document, only the error code is distinctive
+    assert [id for id, _ in index.search("the report err4711")] == ["id3"]
+    assert index.search("the report") == []
+
+
+def test_keyword_hits_are_held_to_the_threshold():
+    rng = random.Random(0)
+    with temp_memory() as memory:
+        docs = make_docs(rng, 200)
+        for doc in docs:
+            doc.metadata["area"] = Memory.Area.MAIN.value
+        # shares a rare term with the query but little else
+        keyword_doc = Document("err4711 " + make_text(rng), metadata={"area": Memory.Area.MAIN.value})
+        ids = asyncio.run(memory.insert_documents(docs + [keyword_doc]))
+        keyword_id = ids[-1]
+        query = "err4711"
+        similarity = relevance(query, keyword_doc.page_content)
+        assert similarity < 0.8
+
+        def found(threshold: float) -> dict[str, float]:
+            results = asyncio.run(memory.search_hybrid_multi_with_scores([query], GROUPS, threshold))
+            return {doc.metadata["id"]: score for doc, score in results["main"][0]}
+
+        # at or below its vector similarity the keyword hit is fused in with its real score
+        low = found(similarity - 0.01)
+        assert abs(low[keyword_id] - similarity) < 1e-5
+        assert all(score >= similarity - 0.01 for score in low.values())
+
+        # above it the keyword match alone does not bring it in
+        high = found(similarity + 0.01)
+        assert keyword_id not in high
+        assert all(score >= similarity + 0.01 for score in high.values())
+
+        plain = asyncio.run(memory.search_hybrid_multi([query], GROUPS, similarity + 0.01))
+        assert [doc.metadata["id"] for doc in plain["main"][0]] == list(high)
+
+
+if __name__ == "__main__":
+    test_common_terms_are_ignored()
+    test_keyword_hits_are_held_to_the_threshold()
+    print("ok")
@@ -0,0 +1,98 @@
+import sys, os
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import asyncio
+import json
+import random
+import tempfile
+
+import numpy as np
+
+import models
+from python.helpers.memory import Memory
+from python.helpers.memory_reindex import REINDEX_DIR
+from conftest import DIM, FakeEmbeddings, fake_model_config, make_docs, open_memory, temp_memory
+
+
+class RecordingEmbeddings(FakeEmbeddings):
+    def __init__(self, dim: int):
+        super().__init__(dim)
+        self.texts: list[str] = []
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        self.texts.extend(texts)
+        return super().embed_documents(texts)
+
+
+def test_reindex_resumes_from_checkpoint():
+    with temp_memory(in_memory=False, memory_reindex_batch_size=5) as memory:
+        subdir = memory.memory_subdir
+        db_dir = Memory._abs_db_dir(subdir)
+        docs = make_docs(random.Random(0), 40)
+        texts = [doc.page_content for doc in docs]
+        ids = asyncio.run(memory.insert_documents(docs))
+        Memory._save_db_file(memory.db, subdir)
+
+        # a run for the new model was interrupted after half of the documents
+        new_model = fake_model_config(DIM, name="new")
+        checkpoint = Memory._reindex_checkpoint(db_dir, FakeEmbeddings(DIM), new_model)
+        checkpoint.load()
+        checkpoint.append(ids[:20], np.array(FakeEmbeddings(DIM).embed_documents(texts[:20])))
+
+        new_embeddings = RecordingEmbeddings(DIM)
+        get_embedding_model = models.get_embedding_model
+        models.get_embedding_model = (  # type: ignore
+            lambda provider, name, **kwargs: new_embeddings if name == "new" else FakeEmbeddings(DIM)
+        )
+        try:
+            memory = open_memory(subdir, model_config=new_model)
+            Memory._reindex_tasks[subdir].result_sync(30)
+
+            # only the rest is embedded, the index and the meta file are switched together
+            assert sorted(new_embeddings.texts) == sorted(texts[20:])
+            with open(os.path.join(db_dir, "embedding.json")) as f:
+                assert json.load(f)["model_name"] == "new"
+            assert not os.path.exists(os.path.join(db_dir, REINDEX_DIR))
+            found = asyncio.run(memory.search_similarity_threshold(texts[5], 1, 0.99))
+            assert [doc.metadata["id"] for doc in found] == [ids[5]]
+
+            memory = open_memory(subdir, model_config=new_model)
+            assert subdir not in Memory._reindex_tasks
+            assert set(memory.db.index_to_docstore_id.values()) == set(ids)
+        finally:
+            models.get_embedding_model = get_embedding_model
+
+
+def test_meta_file_is_swapped_with_the_snapshot():
+    with tempfile.TemporaryDirectory() as db_dir:
+        def write(name: str, data: str):
+            with open(os.path.join(db_dir, name), "w") as f:
+                f.write(data)
+
+        write("index.faiss", "old index")
+        write("index.pkl", "old store")
+        write("embedding.json", '{"model_name": "old"}')
+
+        # the process died before the new meta file was moved in
+        write("index.faiss.tmp", "new index")
+        write("index.pkl.tmp", "new store")
+        write("embedding.json.tmp", '{"model_name": "new"}')
+        write("snapshot.pending", "")
+        Memory._recover_snapshot(db_dir)
+        with open(os.path.join(db_dir, "embedding.json")) as f:
+            assert json.load(f)["model_name"] == "new"
+        assert sorted(os.listdir(db_dir)) == ["embedding.json", "index.faiss", "index.pkl"]
+
+        # an incomplete snapshot keeps the meta file of the previous one
+        write("index.faiss.tmp", "partial index")
+        write("embedding.json.tmp", '{"model_name": "newer"}')
+        Memory._recover_snapshot(db_dir)
+        with open(os.path.join(db_dir, "embedding.json")) as f:
+            assert json.load(f)["model_name"] == "new"
+
+
+if __name__ == "__main__":
+    test_reindex_resumes_from_checkpoint()
+    test_meta_file_is_swapped_with_the_snapshot()
+    print("ok")
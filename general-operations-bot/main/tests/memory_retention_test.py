@@ -0,0 +1,82 @@
+import sys, os
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import tempfile
+from datetime import datetime, timedelta
+
+from python.helpers import memory_retention
+from python.helpers.memory_retention import AccessLog, RetentionPolicy, parse_policies, plan_evictions
+
+NOW = datetime(2025, 6, 1, 12, 0, 0)
+
+
+def timestamp(days_ago: float) -> str:
+    return (NOW - timedelta(days=days_ago)).strftime(memory_retention.TIMESTAMP_FORMAT)
+
+
+def test_parse_policies():
+    policies = parse_policies(
+        {
+            "main": {"max_documents": 100},
+            "fragments": {"max_age_days": "30", "max_documents": None},
+            "solutions": {},  # unlimited
+            "instruments": "100",  # invalid
+        }
+    )
+    assert policies == {
+        "main": RetentionPolicy(max_documents=100),
+        "fragments": RetentionPolicy(max_age_days=30),
+    }
+
+
+def test_expired_then_least_recently_recalled_are_evicted():
+    items = [
+        ("old", {"area": "fragments", "timestamp": timestamp(40)}),
+        ("recalled", {"area": "fragments", "timestamp": timestamp(10)}),
+        ("older", {"area": "fragments", "timestamp": timestamp(9)}),
+        ("newer", {"area": "fragments", "timestamp": timestamp(1)}),
+        ("undated", {"area": "fragments"}),
+        ("knowledge", {"area": "fragments", "timestamp": timestamp(50), "knowledge_source": True}),
+        ("main", {"area": "main", "timestamp": timestamp(50)}),
+    ]
+    policies = {"fragments": RetentionPolicy(max_documents=2, max_age_days=30)}
+    # recalled yesterday, so it counts as used more recently than its creation
+    access = {"recalled": (3, (NOW - timedelta(days=1, hours=1)).timestamp())}
+
+    plan = plan_evictions(items, policies, access, now=NOW)
+    assert list(plan) == ["fragments"]  # areas without a policy are not touched
+    assert plan["fragments"]["documents"] == 5  # knowledge is exempt
+    assert plan["fragments"]["evict"] == [
+        ("old", "max_age"),
+        ("undated", "max_documents"),
+        ("older", "max_documents"),
+    ]
+
+
+def test_access_log_counts_recalls():
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, memory_retention.ACCESS_FILE)
+        log = AccessLog(path)
+        log.record(["a", "b"])
+        log.record(["a"])
+        counts = log.get_all()
+        assert {id: count for id, (count, _) in counts.items()} == {"a": 2, "b": 1}
+        assert counts["a"][1] >= counts["b"][1]
+
+        # pending hits are added to the stored counts
+        log.record(["a", "c"])
+        log.flush()
+        log.retain({"a", "c"})
+        log.conn.close()
+
+        reopened = AccessLog(path)
+        assert {id: count for id, (count, _) in reopened.get_all().items()} == {"a": 3, "c": 1}
+        reopened.conn.close()
+
+
+if __name__ == "__main__":
+    test_parse_policies()
+    test_expired_then_least_recently_recalled_are_evicted()
+    test_access_log_counts_recalls()
+    print("ok")
@@ -0,0 +1,86 @@
+import sys, os
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import asyncio
+import random
+import tempfile
+
+import numpy as np
+
+from python.helpers import memory_snapshot
+from python.helpers.memory import Memory
+from python.helpers.memory_snapshot import SnapshotReader
+from conftest import make_docs, open_memory, temp_memory
+
+
+def stored(memory: Memory) -> dict[str, tuple[str, dict]]:
+    ids = list(memory.db.index_to_docstore_id.values())
+    return {doc.metadata["id"]: (doc.page_content, doc.metadata) for doc in memory.db.get_by_ids(ids)}
+
+
+def test_export_import_round_trip():
+    with temp_memory(in_memory=False) as memory, tempfile.TemporaryDirectory() as out_dir:
+        # more documents than fit in one compressed frame
+        docs = make_docs(random.Random(0), memory_snapshot.FRAME_DOCS + 50)
+        docs[0].page_content += " ünïcode separator"
+        ids = asyncio.run(memory.insert_documents(docs))
+        asyncio.run(memory.delete_documents_by_ids(ids[:10]))
+
+        manifest = Memory.export_snapshot(memory.memory_subdir, out_dir)
+        assert manifest["count"] == len(ids) - 10
+
+        reader = SnapshotReader(out_dir)
+        rows = [0, memory_snapshot.FRAME_DOCS + 5, 3]
+        assert [doc.id for doc in reader.read_documents(rows)] == [ids[10 + row] for row in rows]
+        assert reader.vectors().shape == (manifest["count"], manifest["dim"])
+
+        imported = f"{memory.memory_subdir}_imported"
+        try:
+            Memory.import_snapshot(out_dir, imported)
+            copy = open_memory(imported)
+            assert stored(copy) == stored(memory)
+            assert memory_snapshot.is_snapshot(out_dir)  # the export is left as it was
+            assert not memory_snapshot.is_snapshot(Memory._abs_db_dir(imported))
+            found = asyncio.run(copy.search_similarity_threshold(docs[20].page_content, 1, 0.99))
+            assert [doc.metadata["id"] for doc in found] == [ids[20]]
+        finally:
+            Memory.index.pop(imported, None)
+
+
+def test_float16_export():
+    with temp_memory() as memory, tempfile.TemporaryDirectory() as out_dir:
+        ids = asyncio.run(memory.insert_documents(make_docs(random.Random(1), 20)))
+        Memory.export_snapshot(memory.memory_subdir, out_dir, dtype="float16")
+        vectors = SnapshotReader(out_dir).vectors()
+        assert vectors.dtype == np.float16
+        original = memory.db.index.reconstruct_n(0, len(ids))
+        assert np.allclose(vectors.astype(np.float32), original, atol=1e-3)
+
+
+def test_memory_mapped_index_is_copied_before_writes():
+    with temp_memory(in_memory=False, memory_index_mmap=True, memory_journal_enabled=False) as memory:
+        docs = make_docs(random.Random(2), 100)
+        ids = asyncio.run(memory.insert_documents(docs))
+
+        memory = open_memory(memory.memory_subdir)
+        assert memory.db._index_mapped
+        found = asyncio.run(memory.search_similarity_threshold(docs[7].page_content, 1, 0.99))
+        assert [doc.metadata["id"] for doc in found] == [ids[7]]
+
+        more = make_docs(random.Random(3), 10)
+        more_ids = asyncio.run(memory.insert_documents(more))
+        assert not memory.db._index_mapped
+        asyncio.run(memory.delete_documents_by_ids(ids[:5]))
+
+        memory = open_memory(memory.memory_subdir)
+        assert set(memory.db.index_to_docstore_id.values()) == set(ids[5:] + more_ids)
+        found = asyncio.run(memory.search_similarity_threshold(more[0].page_content, 1, 0.99))
+        assert [doc.metadata["id"] for doc in found] == more_ids[:1]
+
+
+if __name__ == "__main__":
+    test_export_import_round_trip()
+    test_float16_export()
+    test_memory_mapped_index_is_copied_before_writes()
+    print("ok")
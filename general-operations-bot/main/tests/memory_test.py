@@ -0,0 +1,143 @@
+import sys, os
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import asyncio
+import random
+import tempfile
+
+from python.helpers import memory_index
+from python.helpers.memory import Memory
+from python.helpers.memory_journal import JOURNAL_FILE
+from conftest import make_docs, open_memory, temp_memory
+
+
+def test_journal_replay_after_crash():
+    with temp_memory(in_memory=False, memory_journal_enabled=True, memory_compaction_ratio=0) as memory:
+        docs = make_docs(random.Random(0), 50)
+        ids = asyncio.run(memory.insert_documents(docs))
+        asyncio.run(memory.delete_documents_by_ids(ids[:5]))
+        db_dir = Memory._abs_db_dir(memory.memory_subdir)
+        assert memory.db.journal and not memory.db.journal.is_empty()
+
+        # the process died while appending a record and while writing a snapshot
+        with open(os.path.join(db_dir, JOURNAL_FILE), "a", encoding="utf-8") as f:
+            f.write('{"op": "add", "id": "torn", "te')
+        with open(os.path.join(db_dir, "index.faiss.tmp"), "wb") as f:
+            f.write(b"incomplete")
+
+        memory = open_memory(memory.memory_subdir)
+        assert set(memory.db.index_to_docstore_id.values()) == set(ids[5:])
+        assert not os.path.exists(os.path.join(db_dir, "index.faiss.tmp"))
+        found = asyncio.run(memory.search_similarity_threshold(docs[7].page_content, 1, 0.99))
+        assert [doc.metadata["id"] for doc in found] == [ids[7]]
+
+        # changes after the replay are journaled on top of it
+        asyncio.run(memory.delete_documents_by_ids(ids[5:10]))
+        memory = open_memory(memory.memory_subdir)
+        assert set(memory.db.index_to_docstore_id.values()) == set(ids[10:])
+
+
+def test_recover_snapshot():
+    with tempfile.TemporaryDirectory() as db_dir:
+        def write(name: str, data: str):
+            with open(os.path.join(db_dir, name), "w") as f:
+                f.write(data)
+
+        def read(name: str) -> str:
+            with open(os.path.join(db_dir, name)) as f:
+                return f.read()
+
+        write("index.faiss", "old index")
+        write("index.pkl", "old store")
+
+        # both files of the new snapshot were written, only the swap is missing
+        write("index.faiss.tmp", "new index")
+        write("index.pkl.tmp", "new store")
+        write("snapshot.pending", "")
+        Memory._recover_snapshot(db_dir)
+        assert (read("index.faiss"), read("index.pkl")) == ("new index", "new store")
+        assert sorted(os.listdir(db_dir)) == ["index.faiss", "index.pkl"]
+
+        # without the marker the new snapshot may be incomplete, the previous one stays
+        write("index.faiss.tmp", "partial index")
+        Memory._recover_snapshot(db_dir)
+        assert (read("index.faiss"), read("index.pkl")) == ("new index", "new store")
+        assert sorted(os.listdir(db_dir)) == ["index.faiss", "index.pkl"]
+
+
+def test_delete_by_query_after_delete_on_ivf():
+    # a deleted document leaves a tombstone, later range searches exclude it with a selector
+    ivf_min_docs = memory_index.IVF_MIN_DOCS
+    memory_index.IVF_MIN_DOCS = 500
+    try:
+        with temp_memory(memory_index_type="ivf_flat", memory_compaction_ratio=0) as memory:
+            docs = make_docs(random.Random(0), 600)
+            ids = asyncio.run(memory.insert_documents(docs))
+            memory.db._rebuild.result_sync()  # IVF is built in the background
+            assert memory_index.get_index_type(memory.db.index) == memory_index.IVF_FLAT
+
+            asyncio.run(memory.delete_documents_by_ids(ids[:1]))
+            assert memory.db.tombstones
+
+            removed = asyncio.run(memory.delete_documents_by_query(docs[1].page_content, 0.99))
+            assert [doc.metadata["id"] for doc in removed] == [ids[1]]
+            assert len(memory.db.index_to_docstore_id) == 598
+    finally:
+        memory_index.IVF_MIN_DOCS = ivf_min_docs
+
+
+def test_rebuild_keeps_changes_made_while_building():
+    with temp_memory() as memory:
+        ids = asyncio.run(memory.insert_documents(make_docs(random.Random(0), 100)))
+        late_docs = make_docs(random.Random(1), 5)
+        late_ids: list[str] = []
+        create_index = memory_index.create_index
+
+        def create_while_changing(*args):
+            # the index is built outside the lock, inserts and deletes continue meanwhile
+            late_ids.extend(asyncio.run(memory.insert_documents(late_docs)))
+            memory.db.delete(ids[:3])
+            return create_index(*args)
+
+        memory_index.create_index = create_while_changing
+        try:
+            assert memory.db.rebuild_index(memory_index.HNSW)
+        finally:
+            memory_index.create_index = create_index
+
+        assert memory_index.get_index_type(memory.db.index) == memory_index.HNSW
+        assert set(memory.db.index_to_docstore_id.values()) == set(ids[3:] + late_ids)
+        found = asyncio.run(memory.search_similarity_threshold(late_docs[0].page_content, 1, 0.99))
+        assert [doc.metadata["id"] for doc in found] == late_ids[:1]
+
+
+def test_multi_search_matches_single_searches():
+    with temp_memory() as memory:
+        docs = make_docs(random.Random(0), 300)
+        asyncio.run(memory.insert_documents(docs))
+        queries = [docs[3].page_content, " ".join(docs[8].page_content.split()[:20]), docs[3].page_content]
+        groups = {
+            "memories": ("area == 'main' or area == 'fragments'", 5),
+            "solutions": ("area == 'solutions'", 3),
+            "tagged": ("tag == 't3'", 4),  # not indexed, checked by the evaluator
+        }
+        results = asyncio.run(memory.search_similarity_threshold_multi(queries, groups, 0.55))
+
+        assert list(results) == list(groups)
+        for name, (condition, limit) in groups.items():
+            assert len(results[name]) == len(queries)
+            for query, found in zip(queries, results[name]):
+                single = asyncio.run(memory.search_similarity_threshold(query, limit, 0.55, condition))
+                assert [doc.metadata["id"] for doc in found] == [doc.metadata["id"] for doc in single]
+                assert len(found) <= limit
+        assert results["memories"][0] and results["memories"][0] == results["memories"][2]
+
+
+if __name__ == "__main__":
+    test_journal_replay_after_crash()
+    test_recover_snapshot()
+    test_delete_by_query_after_delete_on_ivf()
+    test_rebuild_keeps_changes_made_while_building()
+    test_multi_search_matches_single_searches()
+    print("ok")
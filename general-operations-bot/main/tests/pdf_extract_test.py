@@ -0,0 +1,61 @@
+import sys, os
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import asyncio
+import tempfile
+
+import fitz
+
+from python.helpers import pdf_extract
+from python.helpers.pdf_extract import PdfPageCache
+
+PAGES = 3
+
+
+def make_pdf(path: str):
+    with fitz.open() as pdf:
+        for number in range(PAGES):
+            pdf.new_page().insert_text((72, 72), f"Text of page number {number + 1}")
+        pdf.save(path)
+
+
+async def collect(path: str, cache: PdfPageCache) -> dict[int, str | None]:
+    # one worker extracts in a thread, so the patched extract_page is used
+    return dict([page async for page in pdf_extract.extract_pages(path, 1, cache)])
+
+
+def test_failed_page_is_extracted_again():
+    extract_page = pdf_extract.extract_page
+    broken = {1}
+
+    def extract_or_fail(path: str, number: int) -> str:
+        if number in broken:
+            raise RuntimeError("broken page")
+        return extract_page(path, number)
+
+    pdf_extract.extract_page = extract_or_fail
+    try:
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, "document.pdf")
+            make_pdf(path)
+            cache = PdfPageCache(os.path.join(folder, "pages.sqlite"))
+
+            pages = asyncio.run(collect(path, cache))
+            assert pages[1] is None
+            assert "page number 1" in str(pages[0]) and "page number 3" in str(pages[2])
+            checksum = pdf_extract.file_checksum(path)
+            assert sorted(cache.get_pages(checksum, range(PAGES))) == [0, 2]
+
+            broken.clear()
+            pages = asyncio.run(collect(path, cache))
+            assert "page number 2" in str(pages[1])
+            assert sorted(cache.get_pages(checksum, range(PAGES))) == [0, 1, 2]
+            cache.conn.close()
+    finally:
+        pdf_extract.extract_page = extract_page
+
+
+if __name__ == "__main__":
+    test_failed_page_is_extracted_again()
+    print("ok")
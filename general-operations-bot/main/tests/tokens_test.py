@@ -0,0 +1,88 @@
+import sys, os
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import random
+from contextlib import contextmanager
+
+import tiktoken
+
+from python.helpers import tokens
+
+
+def _local_encoding() -> tiktoken.Encoding:
+    # byte level BPE with a few merges, built locally so the tests need no download
+    ranks = {bytes([i]): i for i in range(256)}
+    for word in ["th", "he", "in", "er", "an", " t", " a", "the", " the", "ing", "and", " and"]:
+        ranks[word.encode()] = len(ranks)
+    return tiktoken.Encoding(
+        "local",
+        pat_str=r"""'s|'t|'re|'ve|'m|'ll|'d| ?\p{L}+| ?\p{N}+| ?[^\s\p{L}\p{N}]+|\s+(?!\S)|\s+""",
+        mergeable_ranks=ranks,
+        special_tokens={},
+    )
+
+
+ENCODING = _local_encoding()
+
+
+@contextmanager
+def local_encoding():
+    """Count tokens with the local encoding instead of the default one."""
+    get_encoding = tokens.get_encoding
+    tokens.get_encoding = lambda encoding_name=tokens.DEFAULT_ENCODING: ENCODING  # type: ignore
+    try:
+        yield ENCODING
+    finally:
+        tokens.get_encoding = get_encoding
+
+
+def make_text(rng: random.Random, words: int) -> str:
+    vocabulary = ["the", "thing", "and", "another", "token", "héllo", "1234", "end.", "\n\n", "ünïcode"]
+    return " ".join(rng.choice(vocabulary) for _ in range(words))
+
+
+def count(text: str) -> int:
+    return len(ENCODING.encode_ordinary(text))
+
+
+def test_trim_to_tokens_is_exact():
+    rng = random.Random(0)
+    with local_encoding():
+        for _ in range(50):
+            text = make_text(rng, rng.randint(20, 400))
+            max_tokens = rng.randint(1, count(text) - 1)
+
+            start = tokens.trim_to_tokens(text, max_tokens, "start")
+            assert start.endswith("...")
+            kept = start[:-3]
+            assert text.startswith(kept)
+            # fits, and one more character does not
+            assert count(kept) <= max_tokens < count(text[: len(kept) + 1])
+
+            end = tokens.trim_to_tokens(text, max_tokens, "end", ellipsis="[...]")
+            assert end.startswith("[...]")
+            kept = end[5:]
+            assert text.endswith(kept)
+            assert count(kept) <= max_tokens < count(text[len(text) - len(kept) - 1 :])
+
+
+def test_trim_to_tokens_keeps_short_text():
+    with local_encoding():
+        text = "the thing and another"
+        assert tokens.trim_to_tokens(text, count(text), "start") == text
+        assert tokens.trim_to_tokens(text, count(text) - 1, "end").startswith("...")
+
+
+def test_batch_counts_match_single_counts():
+    rng = random.Random(1)
+    texts = [make_text(rng, rng.randint(0, 100)) for _ in range(20)]
+    with local_encoding():
+        assert tokens.count_tokens_batch(texts) == [tokens.count_tokens(text) for text in texts]
+
+
+if __name__ == "__main__":
+    test_trim_to_tokens_is_exact()
+    test_trim_to_tokens_keeps_short_text()
+    test_batch_counts_match_single_counts()
+    print("ok")